@@ -0,0 +1,21 @@
+"""ASGI config for CAS project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Ticket validations are served by the async views in ``core.asgi``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'baseauth.settings')
+
+# sets up Django, so the apps can be imported
+django_application = get_asgi_application()
+
+from core.asgi import route_validation  # noqa: E402
+
+application = route_validation(django_application)
@@ -0,0 +1,38 @@
+"""Preparation of the file system for baseauth.
+
+Called by manage.py and by the gunicorn master before the application is
+loaded, so that importing the settings has no side effects and workers do
+not touch the file system when they start.
+"""
+import os
+
+SECRET_KEY_FILE = os.path.join(os.path.dirname(__file__), 'secret_key.py')
+
+
+def create_secret_key():
+    """Write a random secret key to secret_key.py, unless the key is set in
+    the environment or the file exists."""
+    if os.environ.get('SECRET_KEY') or os.path.exists(SECRET_KEY_FILE):
+        return
+    from django.core.management.utils import get_random_secret_key
+
+    with open(SECRET_KEY_FILE, 'w') as f:
+        f.write("SECRET_KEY = '%s'\n" % get_random_secret_key())
+
+
+def create_log_dir():
+    # the file based email backend creates its directory on its own
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+
+    try:
+        log_dir = settings.LOG_DIR
+    except ImproperlyConfigured:
+        # reported by the management command or the application
+        return
+    os.makedirs(log_dir, exist_ok=True)
+
+
+def prepare():
+    create_secret_key()
+    create_log_dir()
@@ -19,8 +19,6 @@ from email.utils import getaddresses
 from urllib.parse import urlparse
 
 import environ
-import ldap
-from django_auth_ldap.config import LDAPSearch, LDAPSearchUnion
 
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
@@ -33,14 +31,15 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 PROJECT_NAME = '.'.join(__name__.split('.')[:-1])
 
-try:
-    from .secret_key import SECRET_KEY
-except ImportError:
-    from django.core.management.utils import get_random_secret_key
-
-    with open(os.path.join(BASE_DIR, PROJECT_NAME, 'secret_key.py'), 'w+') as f:
-        SECRET_KEY = get_random_secret_key()
-        f.write("SECRET_KEY = '%s'\n" % SECRET_KEY)
+# Importing the settings has no side effects: secret_key.py and the
+# directories below are created by manage.py and gunicorn-conf.py, see
+# baseauth.prepare
+SECRET_KEY = env.str('SECRET_KEY', default='')
+if not SECRET_KEY:
+    try:
+        from .secret_key import SECRET_KEY
+    except ImportError:
+        pass
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -76,13 +75,24 @@ ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=[SITE_HOSTNAME])
 
 BEHIND_PROXY = env.bool('BEHIND_PROXY', default=True)
 
+# Networks of the reverse proxies whose X-Forwarded-For entries are trusted,
+# see general.ip
+TRUSTED_PROXIES = env.list(
+    'TRUSTED_PROXIES',
+    default=(
+        ['127.0.0.0/8', '::1/128', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']
+        if BEHIND_PROXY
+        else []
+    ),
+)
+
 DJANGO_ADMINS = env('DJANGO_ADMINS', default=None)
 
 if DJANGO_ADMINS:
     ADMINS = getaddresses([DJANGO_ADMINS])
     MANAGERS = ADMINS
 
-SUPERUSERS = env.tuple('DJANGO_SUPERUSERS', default=())
+SUPERUSERS = frozenset(env.tuple('DJANGO_SUPERUSERS', default=()))
 
 
 # Application definition
@@ -121,6 +131,12 @@ for backend in AUTH_BACKENDS_TO_USE:
     # A generically configurable LDAP authentication backend
     # See https://django-auth-ldap.readthedocs.io/en/latest/authentication.html for details
     if backend == 'ldap':
+        # imported only if used, as python-ldap takes long to import
+        import ldap
+        from django_auth_ldap.config import LDAPSearch
+
+        from core.ldap_config import LDAPSearchUnion
+
         AUTH_LDAP_CONNECTION_OPTIONS = {
             ldap.OPT_X_TLS_CACERTFILE: '/etc/ssl/certs/ca-certificates.crt',
             ldap.OPT_X_TLS_NEWCTX: 0,
@@ -154,29 +170,112 @@ for backend in AUTH_BACKENDS_TO_USE:
                     )
                     for x in AUTH_LDAP_USER_SEARCH_BASE_LIST
                 ]
-                AUTH_LDAP_USER_SEARCH = LDAPSearchUnion(*searches)
+                # the search base a user was found in is remembered, and the
+                # bases after it are not searched on the next login
+                AUTH_LDAP_USER_SEARCH = LDAPSearchUnion(
+                    *searches,
+                    remember_base=env.bool(
+                        'AUTH_LDAP_USER_SEARCH_REMEMBER_BASE', default=True
+                    ),
+                )
 
         AUTH_LDAP_USER_ATTR_MAP = env.dict(
             'AUTH_LDAP_USER_ATTR_MAP',
             default={'first_name': 'givenName', 'last_name': 'sn', 'email': 'mail'},
         )
 
-        AUTH_LDAP_ALWAYS_UPDATE_USER = True
-        AUTH_LDAP_CACHE_TIMEOUT = 0
+        # Existing users are only updated if their attributes in the directory
+        # changed, see core.ldap.LDAPUser, and not at all on login if the users
+        # are synced by the syncldap management command, see core.ldap_sync
+        AUTH_LDAP_ALWAYS_UPDATE_USER = False
+        AUTH_LDAP_UPDATE_USER_ON_LOGIN = env.bool(
+            'AUTH_LDAP_UPDATE_USER_ON_LOGIN', default=True
+        )
+        AUTH_LDAP_SYNC_PAGE_SIZE = env.int('AUTH_LDAP_SYNC_PAGE_SIZE', default=500)
+        # Attribute of the users listing the DNs of their groups, e.g. memberOf
+        AUTH_LDAP_SYNC_GROUP_ATTR = env.str('AUTH_LDAP_SYNC_GROUP_ATTR', default=None)
+        # Seconds the DN, attributes and groups of a user are cached
+        AUTH_LDAP_CACHE_TIMEOUT = env.int('AUTH_LDAP_CACHE_TIMEOUT', default=0)
+
+        # Connections to the LDAP server are pooled per worker process,
+        # a pool size of 0 disables pooling
+        AUTH_LDAP_POOL_SIZE = env.int('AUTH_LDAP_POOL_SIZE', default=4)
+        AUTH_LDAP_POOL_IDLE_TIMEOUT = env.int(
+            'AUTH_LDAP_POOL_IDLE_TIMEOUT', default=300
+        )
+        AUTH_LDAP_POOL_HEALTH_CHECK_INTERVAL = env.int(
+            'AUTH_LDAP_POOL_HEALTH_CHECK_INTERVAL', default=30
+        )
 
-        AUTHENTICATION_BACKENDS.append('django_auth_ldap.backend.LDAPBackend')
+        AUTHENTICATION_BACKENDS.append('core.ldap.LDAPBackend')
 
 # CAS
 MAMA_CAS_SERVICES = [
     {
         'SERVICE': fr'^http[s]?://{re.escape(urlparse(SITE_URL).hostname)}',
         'CALLBACKS': ['core.utils.get_attributes'],
+        # Attributes sent to the service, defaults to all available attributes
+        # 'ATTRIBUTES': ['display_name', 'first_name', 'last_name', 'email', 'groups'],
         'LOGOUT_ALLOW': True,
         # 'LOGOUT_URL': '',
     }
 ]
 
 MAMA_CAS_ENABLE_SINGLE_SIGN_OUT = True
+
+# Further services are loaded from this JSON file and the database, see
+# core.services
+MAMA_CAS_SERVICE_BACKENDS = ['core.services.RegistryBackend']
+CAS_SERVICES_FILE = env.str('CAS_SERVICES_FILE', default=None)
+# Seconds between the checks for changed services
+CAS_SERVICES_RELOAD_INTERVAL = env.int('CAS_SERVICES_RELOAD_INTERVAL', default=10)
+# Number of service URLs whose matching service is cached per worker
+CAS_SERVICES_CACHE_SIZE = env.int('CAS_SERVICES_CACHE_SIZE', default=1024)
+
+# Where CAS tickets are stored, either in the database (db) or in Redis (redis)
+CAS_TICKET_STORE = env.str('CAS_TICKET_STORE', default='db')
+CAS_TICKET_BACKENDS = {
+    'db': 'core.tickets.DatabaseTicketBackend',
+    'redis': 'core.tickets.RedisTicketBackend',
+}
+if CAS_TICKET_STORE not in CAS_TICKET_BACKENDS:
+    raise environ.ImproperlyConfigured(
+        f'Unknown CAS_TICKET_STORE {CAS_TICKET_STORE}, '
+        f'expected one of {", ".join(CAS_TICKET_BACKENDS)}'
+    )
+CAS_TICKET_BACKEND = CAS_TICKET_BACKENDS[CAS_TICKET_STORE]
+CAS_TICKET_REDIS_ALIAS = 'default'
+# Seconds consumed service tickets are kept in the database, as they are needed
+# for the single sign-out of the sessions, see core.expiry; defaults to the
+# session lifetime (SESSION_COOKIE_AGE)
+CAS_TICKET_RETENTION = env.int('CAS_TICKET_RETENTION', default=60 * 60 * 24 * 14)
+
+# Seconds the CAS attributes of a user are cached, changes of the user or their
+# groups invalidate the cache immediately
+CAS_ATTRIBUTES_CACHE_TIMEOUT = env.int('CAS_ATTRIBUTES_CACHE_TIMEOUT', default=3600)
+
+# Single sign-out requests are queued in Redis and sent by the signoutworker
+# management command, unless the queue is disabled
+CAS_SIGN_OUT_QUEUE = env.bool('CAS_SIGN_OUT_QUEUE', default=True)
+CAS_SIGN_OUT_CONCURRENCY = env.int('CAS_SIGN_OUT_CONCURRENCY', default=10)
+# seconds, can be set per service with 'SIGN_OUT_TIMEOUT' in MAMA_CAS_SERVICES
+CAS_SIGN_OUT_TIMEOUT = env.float('CAS_SIGN_OUT_TIMEOUT', default=5)
+CAS_SIGN_OUT_RETRIES = env.int('CAS_SIGN_OUT_RETRIES', default=5)
+
+# Proxy callbacks sent when services request proxy-granting tickets, see
+# core.callbacks; timeouts in seconds
+CAS_PROXY_CALLBACK_CONNECT_TIMEOUT = env.float(
+    'CAS_PROXY_CALLBACK_CONNECT_TIMEOUT', default=3
+)
+CAS_PROXY_CALLBACK_READ_TIMEOUT = env.float(
+    'CAS_PROXY_CALLBACK_READ_TIMEOUT', default=5
+)
+CAS_PROXY_CALLBACK_CONCURRENCY = env.int('CAS_PROXY_CALLBACK_CONCURRENCY', default=20)
+# seconds the certificate check of a callback host is skipped after it passed
+CAS_PROXY_CALLBACK_VERIFIED_TIMEOUT = env.int(
+    'CAS_PROXY_CALLBACK_VERIFIED_TIMEOUT', default=300
+)
+
 """Email settings."""
 SERVER_EMAIL = 'error@%s' % urlparse(SITE_URL).hostname
 
@@ -194,9 +293,6 @@ if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
     EMAIL_FILE_PATH = os.path.join(BASE_DIR, '..', 'tmp', 'emails')
 
-    if not os.path.exists(EMAIL_FILE_PATH):
-        os.makedirs(EMAIL_FILE_PATH)
-
 """ Https settings """
 if SITE_URL.startswith('https'):
     CSRF_COOKIE_SECURE = True
@@ -207,9 +303,12 @@ if SITE_URL.startswith('https'):
 X_FRAME_OPTIONS = 'DENY'
 
 MIDDLEWARE = [
+    'general.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # redirects logged in users to services before the following middlewares
+    'core.sso.SingleSignOnMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -220,11 +319,19 @@ MIDDLEWARE = [
     'axes.middleware.AxesMiddleware',
 ]
 
+# Middleware of the async ticket validation views of the ASGI application, see
+# core.asgi; all of them have to support async requests
+CAS_VALIDATION_MIDDLEWARE = ['general.middleware.RequestMetricsMiddleware']
+
+# Bearer token for the Prometheus metrics endpoint, which is disabled if unset
+METRICS_TOKEN = env.str('METRICS_TOKEN', default=None)
+
 AXES_LOCKOUT_URL = reverse_lazy('locked_out')
 AXES_VERBOSE = DEBUG
 
 if BEHIND_PROXY:
-    MIDDLEWARE += ['general.middleware.SetRemoteAddrFromForwardedFor']
+    # before all middlewares using the address of the client
+    MIDDLEWARE.insert(1, 'general.middleware.SetRemoteAddrFromForwardedFor')
     USE_X_FORWARDED_HOST = True
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
@@ -262,8 +369,14 @@ DATABASES = {
         'PASSWORD': env.str('POSTGRES_PASSWORD', default=f'password_{PROJECT_NAME}'),
         'HOST': f'{PROJECT_NAME}-postgres' if DOCKER else 'localhost',
         'PORT': env.str('POSTGRES_PORT', default='5432'),
+        # reused connections are checked first, see CONN_MAX_AGE below
+        'CONN_HEALTH_CHECKS': env.bool('POSTGRES_HEALTH_CHECKS', default=True),
     }
 }
+# Connection pool per worker instead of a connection per thread, see general.db
+POSTGRES_POOL = env.bool('POSTGRES_POOL', default=False)
+# Seconds a worker thread keeps its connection open without a pool
+POSTGRES_CONN_MAX_AGE = env.int('POSTGRES_CONN_MAX_AGE', default=60)
 
 
 # Password validation
@@ -281,6 +394,39 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+
+# Hasher of new passwords: pbkdf2, argon2 or scrypt; passwords are rehashed with
+# it at the next login, see core.hashers
+PASSWORD_HASHER = env.str('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_HASHERS = {
+    'pbkdf2': 'core.hashers.PBKDF2PasswordHasher',
+    'argon2': 'core.hashers.Argon2PasswordHasher',
+    'scrypt': 'core.hashers.ScryptPasswordHasher',
+}
+if PASSWORD_HASHER not in PASSWORD_HASHERS:
+    raise environ.ImproperlyConfigured(f'Unknown PASSWORD_HASHER {PASSWORD_HASHER}')
+PASSWORD_HASHERS = [
+    PASSWORD_HASHERS.pop(PASSWORD_HASHER),
+    *PASSWORD_HASHERS.values(),
+    # passwords of older installations
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# Cost of the hashers, the defaults of Django
+PASSWORD_PBKDF2_ITERATIONS = env.int('PASSWORD_PBKDF2_ITERATIONS', default=600000)
+PASSWORD_ARGON2_TIME_COST = env.int('PASSWORD_ARGON2_TIME_COST', default=2)
+# in KiB
+PASSWORD_ARGON2_MEMORY_COST = env.int('PASSWORD_ARGON2_MEMORY_COST', default=102400)
+PASSWORD_ARGON2_PARALLELISM = env.int('PASSWORD_ARGON2_PARALLELISM', default=8)
+PASSWORD_SCRYPT_WORK_FACTOR = env.int('PASSWORD_SCRYPT_WORK_FACTOR', default=2**14)
+PASSWORD_SCRYPT_BLOCK_SIZE = env.int('PASSWORD_SCRYPT_BLOCK_SIZE', default=8)
+PASSWORD_SCRYPT_PARALLELISM = env.int('PASSWORD_SCRYPT_PARALLELISM', default=1)
+# Threads per worker process hashing passwords, 0 hashes in the request thread
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=2)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -323,9 +469,6 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 """Logging."""
 LOG_DIR = os.path.join(BASE_DIR, '..', 'logs')
 
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -358,7 +501,10 @@ LOGGING = {
         },
         'mail_admins': {
             'level': 'ERROR',
-            'class': 'django.utils.log.AdminEmailHandler',
+            # each distinct error once per 10 minutes, at most 10 emails
+            'class': 'general.log.ThrottledAdminEmailHandler',
+            'interval': 600,
+            'limit': 10,
         },
         'stream_to_console': {'level': 'DEBUG', 'class': 'logging.StreamHandler'},
         'rq_console': {
@@ -390,6 +536,44 @@ LOGGING = {
         },
     },
 }
+
+# Loggers only queue the records, which are written by a listener thread, see
+# general.log; under gunicorn the master writes the files of all workers
+LOG_QUEUE = env.bool('LOG_QUEUE', default=True)
+
+if LOG_QUEUE:
+    LOGGING['handlers'].update(
+        {
+            'queue': {
+                'level': 'DEBUG',
+                'class': 'general.log.QueueHandler',
+                'sink': 'general.log.output',
+            },
+            'mail_queue': {
+                'level': 'ERROR',
+                'class': 'general.log.QueueHandler',
+                'sink': 'general.log.mail',
+                'local': True,
+            },
+        }
+    )
+    LOGGING['loggers'].update(
+        {
+            'general.log.output': {
+                'handlers': ['console', 'file'],
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+            'general.log.mail': {
+                'handlers': ['mail_admins'],
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+        }
+    )
+    for logger in ('', 'django', 'django.request'):
+        LOGGING['loggers'][logger]['handlers'] = ['queue', 'mail_queue']
+
 """Cache settings."""
 CACHES = {
     'default': {
@@ -401,9 +585,96 @@ CACHES = {
         'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
     }
 }
+
+# Redis Sentinels as host:port, which are asked for the current master of the
+# REDIS_SENTINEL_SERVICE instead of connecting to a single Redis
+REDIS_SENTINELS = env.list('REDIS_SENTINELS', default=[])
+REDIS_SENTINEL_SERVICE = env.str('REDIS_SENTINEL_SERVICE', default='mymaster')
+if REDIS_SENTINELS:
+    DJANGO_REDIS_CONNECTION_FACTORY = 'django_redis.pool.SentinelConnectionFactory'
+    CACHES['default']['LOCATION'] = f'redis://{REDIS_SENTINEL_SERVICE}/0'
+    CACHES['default']['OPTIONS']['SENTINELS'] = [
+        (host, int(port or 26379))
+        for host, _, port in (sentinel.partition(':') for sentinel in REDIS_SENTINELS)
+    ]
+    # the connection pool of the master does not wait for free connections, so
+    # the blocking pool below is not used
+
+# Concurrent requests of one gunicorn worker, see gunicorn-conf.py
+GUNICORN_WORKER_CLASS = env.str('GUNICORN_WORKER_CLASS', default='sync')
+if GUNICORN_WORKER_CLASS == 'gevent':
+    WORKER_CONCURRENCY = env.int('GUNICORN_WORKER_CONNECTIONS', default=100)
+elif GUNICORN_WORKER_CLASS == 'gthread':
+    WORKER_CONCURRENCY = env.int('GUNICORN_THREADS', default=1)
+else:
+    WORKER_CONCURRENCY = 1
+
+if WORKER_CONCURRENCY > 1 and not REDIS_SENTINELS:
+    # one Redis connection per concurrent request at most, requests wait for
+    # a free connection instead of opening new ones; the session listener
+    # keeps one more connection, see core.sessions
+    CACHES['default']['OPTIONS'].update(
+        {
+            'CONNECTION_POOL_CLASS': 'redis.BlockingConnectionPool',
+            'CONNECTION_POOL_KWARGS': {
+                'max_connections': WORKER_CONCURRENCY + 1,
+                'timeout': 10,
+            },
+        }
+    )
+
+if POSTGRES_POOL:
+    DATABASES['default'].update(
+        {
+            'ENGINE': 'general.db',
+            # connections are returned to the pool after every request
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': env.int('POSTGRES_POOL_MIN_SIZE', default=1),
+                    'max_size': env.int(
+                        'POSTGRES_POOL_MAX_SIZE', default=min(WORKER_CONCURRENCY, 10)
+                    ),
+                    # seconds a request waits for a free connection
+                    'timeout': env.float('POSTGRES_POOL_TIMEOUT', default=10),
+                    # seconds before idle connections above min_size are closed
+                    'max_idle': env.float('POSTGRES_POOL_MAX_IDLE', default=600),
+                }
+            },
+        }
+    )
+elif GUNICORN_WORKER_CLASS in ('sync', 'gthread'):
+    # connections of greenlets and async requests would be left open when the
+    # greenlet or request ends, so they are only reused by threads
+    DATABASES['default']['CONN_MAX_AGE'] = POSTGRES_CONN_MAX_AGE
+
+# Read replicas of the database as host[:port], see general.db.routers
+POSTGRES_REPLICAS = env.list('POSTGRES_REPLICAS', default=[])
+# Seconds reads stick to the primary after a change
+POSTGRES_REPLICA_PIN_SECONDS = env.int('POSTGRES_REPLICA_PIN_SECONDS', default=5)
+for number, replica in enumerate(POSTGRES_REPLICAS, 1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+if POSTGRES_REPLICAS:
+    DATABASE_ROUTERS = ['general.db.routers.ReplicaRouter']
+    MIDDLEWARE += ['general.db.routers.ReplicaMiddleware']
 """Session settings."""
-SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+# Sessions are stored in Redis, and recently used sessions are kept in the memory
+# of every worker, see core.sessions
+SESSION_ENGINE = 'core.sessions'
 SESSION_CACHE_ALIAS = 'default'
+# Number of sessions kept per worker, 0 disables the local layer
+SESSION_LOCAL_CACHE_SIZE = env.int('SESSION_LOCAL_CACHE_SIZE', default=10000)
+# Seconds a session is kept
+SESSION_LOCAL_CACHE_TIMEOUT = env.float('SESSION_LOCAL_CACHE_TIMEOUT', default=10)
+# Write the sessions to the database as well, with the flushsessions management
+# command, so they survive a restart of Redis
+SESSION_PERSIST = env.bool('SESSION_PERSIST', default=False)
 SESSION_COOKIE_NAME = f'sessionid_{PROJECT_NAME}'
 SESSION_COOKIE_DOMAIN = env.str('SESSION_COOKIE_DOMAIN', default=None)
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
@@ -421,8 +692,17 @@ HOME_REDIRECT = reverse_lazy('cas_login')
 # Axes settings
 AXES_FAILURE_LIMIT = 3
 AXES_COOLOFF_TIME = 1  # number in hours
+# failures are counted in Redis, access logs are written by the flushaxesaudit
+# management command
+AXES_HANDLER = 'core.lockout.AxesRedisHandler'
+AXES_ENABLE_ACCESS_FAILURE_LOG = True
+# the same client address as in the middleware and the locked out view
+AXES_CLIENT_IP_CALLABLE = 'general.ip.get_client_ip'
 
 CAPTCHA_FLITE_PATH = '/usr/bin/flite'
+# Number of pre-rendered captchas kept in Redis by the fillcaptchapool
+# management command, see core.captchas
+CAPTCHA_POOL_SIZE = env.int('CAPTCHA_POOL_SIZE', default=200)
 
 if DEBUG:
     INSTALLED_APPS += ['debug_toolbar']
@@ -13,14 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from mama_cas.views import LoginView
-
 from django.conf import settings
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.views.generic import RedirectView
 
-from core.views import locked_out
+from core.views import LoginView, captcha_audio, captcha_image, locked_out, metrics
 
 urlpatterns = [
     path(
@@ -32,9 +30,18 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # views
     path('login/', LoginView.as_view(), name='cas_login'),
-    path('', include('mama_cas.urls')),
+    path('', include('core.urls')),
+    # captchas of the pool, see core.captchas
+    re_path(
+        r'^captcha/image/(?P<key>\w+)/$',
+        captcha_image,
+        name='captcha-image',
+        kwargs={'scale': 1},
+    ),
+    re_path(r'^captcha/audio/(?P<key>\w+).wav$', captcha_audio, name='captcha-audio'),
     path('captcha/', include('captcha.urls')),
     path('locked/', locked_out, name='locked_out'),
+    path('metrics', metrics, name='metrics'),
     # i18n
     path('i18n/', include('django.conf.urls.i18n')),
 ]
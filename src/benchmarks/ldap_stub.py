@@ -0,0 +1,86 @@
+"""In-memory stand-in for LDAP connections.
+
+Only the operations used by django_auth_ldap and ``core.ldap`` are
+implemented, and filters are limited to a single ``(attribute=value)``.
+"""
+import itertools
+import re
+
+import ldap
+
+from django.conf import settings
+
+FILTER_RE = re.compile(r'^\((\w+)=([^)]*)\)$')
+
+# DN: (password, attributes)
+DIRECTORY = {
+    'uid=ldapuser,ou=people,dc=example,dc=org': (
+        'password',
+        {
+            'uid': [b'ldapuser'],
+            'givenName': [b'LDAP'],
+            'sn': [b'User'],
+            'mail': [b'ldapuser@example.org'],
+        },
+    ),
+}
+
+
+class StubLDAPObject:
+    def __init__(self, uri, *args, **kwargs):
+        self.uri = uri
+        self.bound_dn = None
+        self._msgids = itertools.count(1)
+        self._results = {}
+
+    def set_option(self, option, value):
+        pass
+
+    def start_tls_s(self):
+        pass
+
+    def simple_bind_s(self, who=None, cred=None, *args, **kwargs):
+        self.bound_dn = None
+        if who == settings.AUTH_LDAP_BIND_DN:
+            valid = cred == settings.AUTH_LDAP_BIND_PASSWORD
+        else:
+            valid = who in DIRECTORY and DIRECTORY[who][0] == cred
+        if not valid:
+            raise ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+        self.bound_dn = who
+
+    def whoami_s(self):
+        return f'dn:{self.bound_dn}'
+
+    def unbind_s(self):
+        self.bound_dn = None
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, *args):
+        if scope == ldap.SCOPE_BASE:
+            entries = [dn for dn in DIRECTORY if dn == base.lower()]
+        else:
+            match = FILTER_RE.match(filterstr)
+            attr, value = match.groups() if match else ('objectClass', '*')
+            entries = [
+                dn
+                for dn, (_password, attrs) in DIRECTORY.items()
+                if dn.endswith(base.lower())
+                and (value == '*' or value.encode() in attrs.get(attr, []))
+            ]
+        return [(dn, DIRECTORY[dn][1]) for dn in entries]
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, *args):
+        msgid = next(self._msgids)
+        self._results[msgid] = self.search_s(base, scope, filterstr, attrlist)
+        return msgid
+
+    def result2(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        if msgid == ldap.RES_ANY:
+            msgid = next(iter(self._results))
+        return ldap.RES_SEARCH_RESULT, self._results.pop(msgid), msgid
+
+    def result(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        return self.result2(msgid, all, timeout)[:2]
+
+    def abandon(self, msgid):
+        self._results.pop(msgid, None)
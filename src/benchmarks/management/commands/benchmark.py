@@ -0,0 +1,280 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from importlib.metadata import version
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from mama_cas.compat import defused_etree
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from benchmarks.ldap_stub import StubLDAPObject
+from core.ldap import LDAPConnectionPool
+from core.tickets import get_ticket_backend
+
+CAS_NS = {'cas': 'http://www.yale.edu/tp/cas'}
+
+FLOWS = ['login', 'sso', 'serviceValidate', 'proxy', 'proxyValidate', 'logout']
+
+# redirects of the logged in user to a service per cycle, like when visiting
+# several services
+SSO_REDIRECTS = 3
+
+AUTH_BACKENDS = {
+    'django': 'django.contrib.auth.backends.ModelBackend',
+    'ldap': 'core.ldap.LDAPBackend',
+}
+
+CREDENTIALS = {
+    'django': ('djangouser', 'password'),
+    'ldap': ('ldapuser', 'password'),
+}
+
+SESSION_ENGINES = {
+    'tiered': 'core.sessions',
+    'cache': 'django.contrib.sessions.backends.cache',
+}
+
+PACKAGES = ['Django', 'django-mama-cas', 'django-axes', 'django-auth-ldap']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the CAS flows login, sso (redirect when already logged in), '
+        'serviceValidate, proxy, proxyValidate and logout, and compare the '
+        'results with the previous run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n',
+            '--number',
+            type=int,
+            default=200,
+            help='Number of cycles per scenario (default: 200)',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help='Number of cycles run before measuring (default: 10)',
+        )
+        parser.add_argument(
+            '--store',
+            action='append',
+            choices=settings.CAS_TICKET_BACKENDS.keys(),
+            help='Ticket store, can be given multiple times (default: all)',
+        )
+        parser.add_argument(
+            '--auth',
+            action='append',
+            choices=AUTH_BACKENDS.keys(),
+            help='Authentication backend, can be given multiple times '
+            '(default: all)',
+        )
+        parser.add_argument(
+            '--session',
+            action='append',
+            choices=SESSION_ENGINES.keys(),
+            help='Session store, can be given multiple times (default: all)',
+        )
+        parser.add_argument(
+            '--results',
+            default=os.path.join(settings.BASE_DIR, 'benchmarks', 'results.jsonl'),
+            help='File the results are appended to (default: %(default)s)',
+        )
+
+    def cycle(self, username, password, measure):
+        service = settings.SERVICE_URL
+        callback = f'{service}callback/'
+        client = Client()
+
+        response = measure(
+            'login',
+            client.post,
+            f'/login/?service={service}',
+            {'username': username, 'password': password},
+        )
+        ticket = parse_qs(urlparse(response['Location']).query)['ticket'][0]
+
+        for _i in range(SSO_REDIRECTS):
+            response = measure('sso', client.get, '/login/', {'service': service})
+            if 'ticket=' not in response.get('Location', ''):
+                raise RuntimeError('sso did not redirect to the service')
+
+        response = measure(
+            'serviceValidate',
+            client.get,
+            '/p3/serviceValidate',
+            {'service': service, 'ticket': ticket, 'pgtUrl': callback},
+        )
+        pgtiou = self.find(
+            response, 'cas:authenticationSuccess/cas:proxyGrantingTicket'
+        )
+
+        response = measure(
+            'proxy',
+            client.get,
+            '/proxy',
+            {'pgt': self.pgts.pop(pgtiou), 'targetService': service},
+        )
+        ticket = self.find(response, 'cas:proxySuccess/cas:proxyTicket')
+
+        response = measure(
+            'proxyValidate',
+            client.get,
+            '/p3/proxyValidate',
+            {'service': service, 'ticket': ticket},
+        )
+        self.find(response, 'cas:authenticationSuccess/cas:user')
+
+        measure('logout', client.get, '/logout/')
+
+    def find(self, response, path):
+        element = defused_etree.fromstring(response.content).find(path, CAS_NS)
+        if element is None:
+            raise RuntimeError(response.content.decode())
+        return element.text
+
+    def proxy_callback(self, url, **kwargs):
+        """Stands in for the proxy callback of the service."""
+        query = parse_qs(urlparse(url).query)
+        if 'pgtIou' in query:
+            self.pgts[query['pgtIou'][0]] = query['pgtId'][0]
+        return mock.Mock(status_code=200)
+
+    def run_scenario(self, auth, number, warmup):
+        timings = {flow: [] for flow in FLOWS}
+        queries = {flow: [] for flow in FLOWS}
+
+        def measure(flow, method, *args):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = method(*args)
+                duration = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise RuntimeError(f'{flow} returned {response.status_code}')
+            timings[flow].append(duration)
+            queries[flow].append(len(context.captured_queries))
+            return response
+
+        username, password = CREDENTIALS[auth]
+        for _i in range(warmup):
+            self.cycle(username, password, lambda flow, method, *args: method(*args))
+        for _i in range(number):
+            self.cycle(username, password, measure)
+
+        results = {}
+        for flow in FLOWS:
+            durations = sorted(timings[flow])
+            results[flow] = {
+                'rps': len(durations) / sum(durations),
+                'p50': durations[len(durations) // 2] * 1000,
+                'p99': durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+                * 1000,
+                'queries': statistics.mean(queries[flow]),
+            }
+        return results
+
+    def previous_results(self, path):
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return {}
+        return json.loads(lines[-1])['scenarios'] if lines else {}
+
+    def report(self, name, results, previous):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(
+            f'  {"flow":16}{"req/s":>10}{"change":>9}{"p50 ms":>10}'
+            f'{"p99 ms":>10}{"queries":>9}'
+        )
+        for flow, result in results.items():
+            change = ''
+            if flow in previous:
+                change = f'{result["rps"] / previous[flow]["rps"] - 1:+.0%}'
+            self.stdout.write(
+                f'  {flow:16}{result["rps"]:10.1f}{change:>9}{result["p50"]:10.2f}'
+                f'{result["p99"]:10.2f}{result["queries"]:9.1f}'
+            )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = connection.creation.create_test_db(verbosity=0)
+        logging.disable(logging.WARNING)
+
+        username, password = CREDENTIALS['django']
+        get_user_model().objects.create_user(username, password=password)
+        previous = self.previous_results(options['results'])
+        self.pgts = {}
+
+        scenarios = {}
+        try:
+            with ExitStack() as stack:
+                stack.enter_context(
+                    mock.patch('requests.Session.get', self.proxy_callback)
+                )
+                stack.enter_context(
+                    mock.patch.object(
+                        LDAPConnectionPool, 'connection_class', StubLDAPObject
+                    )
+                )
+                # logout requests are queued, but never sent
+                stack.enter_context(override_settings(CAS_SIGN_OUT_QUEUE=True))
+
+                for store, auth, session in itertools.product(
+                    options['store'] or settings.CAS_TICKET_BACKENDS,
+                    options['auth'] or AUTH_BACKENDS,
+                    options['session'] or SESSION_ENGINES,
+                ):
+                    name = f'{store}/{auth}/{session}'
+                    with override_settings(
+                        CAS_TICKET_BACKEND=settings.CAS_TICKET_BACKENDS[store],
+                        AUTHENTICATION_BACKENDS=[
+                            'axes.backends.AxesBackend',
+                            AUTH_BACKENDS[auth],
+                        ],
+                        SESSION_ENGINE=SESSION_ENGINES[session],
+                    ):
+                        get_ticket_backend.cache_clear()
+                        scenarios[name] = self.run_scenario(
+                            auth, options['number'], options['warmup']
+                        )
+                    self.report(name, scenarios[name], previous.get(name, {}))
+        finally:
+            get_ticket_backend.cache_clear()
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['results'], 'a') as f:
+            f.write(
+                json.dumps(
+                    {
+                        'date': datetime.now().isoformat(timespec='seconds'),
+                        'python': platform.python_version(),
+                        'packages': {name: version(name) for name in PACKAGES},
+                        'number': options['number'],
+                        'scenarios': scenarios,
+                    }
+                )
+                + '\n'
+            )
+        self.stdout.write(f'Results appended to {options["results"]}')
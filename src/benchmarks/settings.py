@@ -0,0 +1,74 @@
+"""Settings to run the benchmarks locally, with SQLite instead of Postgres,
+an in-process Redis and a stub LDAP directory:
+
+    python manage.py benchmark --settings=benchmarks.settings
+"""
+import os
+
+os.environ.update(
+    {
+        'DEBUG': 'False',
+        'DOCKER': 'False',
+        'SITE_URL': 'http://localhost/',
+        'FORCE_SCRIPT_NAME': '',
+        'BEHIND_PROXY': 'False',
+        'AUTHENTICATION_BACKENDS': 'django',
+    }
+)
+
+import fakeredis  # noqa: E402
+import ldap  # noqa: E402
+from django_auth_ldap.config import LDAPSearch  # noqa: E402
+
+from baseauth.settings import *  # noqa: E402,F401,F403
+
+INSTALLED_APPS += ['benchmarks']  # noqa: F405
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+CACHES['default']['OPTIONS'].update(  # noqa: F405
+    CONNECTION_POOL_KWARGS={
+        'connection_class': fakeredis.FakeConnection,
+        'server': fakeredis.FakeServer(),
+    },
+    # the asyncio client of the ticket store connects to the same server
+    ASYNC_CONNECTION_CLASS='fakeredis.aioredis.FakeAsyncRedisConnection',
+)
+
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+SERVICE_URL = 'https://service.example.org/'
+
+MAMA_CAS_SERVICES = [
+    {
+        'SERVICE': r'^https://service\.example\.org/',
+        'CALLBACKS': ['core.utils.get_attributes'],
+        'PROXY_ALLOW': True,
+        'PROXY_PATTERN': r'^https://service\.example\.org/',
+        'LOGOUT_ALLOW': True,
+    }
+]
+
+# see benchmarks.ldap_stub
+AUTH_LDAP_SERVER_URI = 'ldap://ldap.example.org'
+AUTH_LDAP_BIND_DN = 'cn=baseauth,dc=example,dc=org'
+AUTH_LDAP_BIND_PASSWORD = 'password'
+AUTH_LDAP_USER_SEARCH = LDAPSearch(
+    'ou=people,dc=example,dc=org', ldap.SCOPE_SUBTREE, '(uid=%(user)s)'
+)
+AUTH_LDAP_USER_ATTR_MAP = {
+    'first_name': 'givenName',
+    'last_name': 'sn',
+    'email': 'mail',
+}
+AUTH_LDAP_ALWAYS_UPDATE_USER = False
+AUTH_LDAP_UPDATE_USER_ON_LOGIN = True
+AUTH_LDAP_CACHE_TIMEOUT = 0
+AUTH_LDAP_POOL_SIZE = 4
+AUTH_LDAP_POOL_IDLE_TIMEOUT = 300
+AUTH_LDAP_POOL_HEALTH_CHECK_INTERVAL = 30
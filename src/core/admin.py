@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import Service
+
+
+@admin.register(Service)
+class ServiceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'service', 'position', 'is_active', 'logout_allow')
+    list_editable = ('position', 'is_active')
+    list_filter = ('is_active', 'proxy_allow', 'logout_allow')
+    search_fields = ('name', 'service')
@@ -0,0 +1,187 @@
+"""ASGI application with async ticket validation.
+
+Services validate tickets server to server, so the validation endpoints
+need none of the sessions, CSRF protection, messages, locale and axes of
+the login pages. Requests to them are handled by ``ValidationHandler``,
+which only runs the middleware in ``CAS_VALIDATION_MIDDLEWARE`` and the
+async views below; all other requests go through the regular middleware
+and views.
+
+The views await the ticket backend: with ``CAS_TICKET_STORE=redis`` the
+tickets are read and consumed with an asyncio Redis client, with the
+database store the backend runs in a thread per request.
+"""
+import logging
+import re
+from functools import wraps
+
+from mama_cas.exceptions import ValidationError
+from mama_cas.models import ProxyTicket
+from mama_cas.response import ProxyResponse, ValidationResponse
+from mama_cas.utils import to_bool
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.urls import re_path
+from django.utils.cache import add_never_cache_headers
+
+from .cas import (
+    avalidate_proxy_granting_ticket,
+    avalidate_proxy_ticket,
+    avalidate_service_ticket,
+)
+
+logger = logging.getLogger(__name__)
+
+# paths of the views below, with or without FORCE_SCRIPT_NAME
+VALIDATION_PATH = re.compile(
+    r'/(?:p3/)?(?:serviceValidate|proxyValidate)/?$|/(?:validate|proxy)/?$'
+)
+
+
+def cas_view(view):
+    """Allow only GET and HEAD requests and prevent caching of the
+    response, like the mama_cas views."""
+
+    @wraps(view)
+    async def wrapper(request):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        response = await view(request)
+        add_never_cache_headers(response)
+        return response
+
+    return wrapper
+
+
+@cas_view
+async def validate(request):
+    service = request.GET.get('service')
+    ticket = request.GET.get('ticket')
+    renew = to_bool(request.GET.get('renew'))
+
+    try:
+        st, attributes, pgt = await avalidate_service_ticket(
+            service, ticket, renew=renew
+        )
+        content = 'yes\n%s\n' % st.user.get_username()
+    except ValidationError:
+        content = 'no\n\n'
+    return HttpResponse(content=content, content_type='text/plain')
+
+
+@cas_view
+async def service_validate(request):
+    service = request.GET.get('service')
+    ticket = request.GET.get('ticket')
+    pgturl = request.GET.get('pgtUrl')
+    renew = to_bool(request.GET.get('renew'))
+
+    try:
+        st, attributes, pgt = await avalidate_service_ticket(
+            service, ticket, pgturl=pgturl, renew=renew
+        )
+        context = {'ticket': st, 'pgt': pgt, 'attributes': attributes, 'error': None}
+    except ValidationError as e:
+        logger.warning('%s %s' % (e.code, e))
+        context = {'ticket': None, 'error': e}
+    return ValidationResponse(context, content_type='text/xml')
+
+
+@cas_view
+async def proxy_validate(request):
+    service = request.GET.get('service')
+    ticket = request.GET.get('ticket')
+    pgturl = request.GET.get('pgtUrl')
+    renew = to_bool(request.GET.get('renew'))
+
+    try:
+        if not ticket or ticket.startswith(ProxyTicket.TICKET_PREFIX):
+            # If no ticket parameter is present, attempt to validate it
+            # anyway so the appropriate error is raised
+            pt, attributes, pgt, proxies = await avalidate_proxy_ticket(
+                service, ticket, pgturl=pgturl
+            )
+            context = {
+                'ticket': pt,
+                'pgt': pgt,
+                'attributes': attributes,
+                'proxies': proxies,
+                'error': None,
+            }
+        else:
+            st, attributes, pgt = await avalidate_service_ticket(
+                service, ticket, pgturl=pgturl, renew=renew
+            )
+            context = {
+                'ticket': st,
+                'pgt': pgt,
+                'attributes': attributes,
+                'proxies': None,
+                'error': None,
+            }
+    except ValidationError as e:
+        logger.warning('%s %s' % (e.code, e))
+        context = {'ticket': None, 'error': e}
+    return ValidationResponse(context, content_type='text/xml')
+
+
+@cas_view
+async def proxy(request):
+    pgt = request.GET.get('pgt')
+    target_service = request.GET.get('targetService')
+
+    try:
+        pt = await avalidate_proxy_granting_ticket(pgt, target_service)
+        context = {'ticket': pt, 'error': None}
+    except ValidationError as e:
+        logger.warning('%s %s' % (e.code, e))
+        context = {'ticket': None, 'error': e}
+    return ProxyResponse(context, content_type='text/xml')
+
+
+# same routes and names as in core.urls
+urlpatterns = [
+    re_path(r'^validate/?$', validate, name='cas_validate'),
+    re_path(r'^serviceValidate/?$', service_validate, name='cas_service_validate'),
+    re_path(r'^proxyValidate/?$', proxy_validate, name='cas_proxy_validate'),
+    re_path(r'^proxy/?$', proxy, name='cas_proxy'),
+    re_path(
+        r'^p3/serviceValidate/?$', service_validate, name='cas_p3_service_validate'
+    ),
+    re_path(r'^p3/proxyValidate/?$', proxy_validate, name='cas_p3_proxy_validate'),
+]
+
+
+class ValidationHandler(ASGIHandler):
+    """ASGI handler serving the views above with the middleware in
+    ``CAS_VALIDATION_MIDDLEWARE``."""
+
+    def load_middleware(self, is_async=False):
+        # BaseHandler builds the chain from settings.MIDDLEWARE, which is
+        # swapped while the handler is created at startup
+        middleware = settings.MIDDLEWARE
+        settings.MIDDLEWARE = settings.CAS_VALIDATION_MIDDLEWARE
+        try:
+            super().load_middleware(is_async=is_async)
+        finally:
+            settings.MIDDLEWARE = middleware
+
+    async def get_response_async(self, request):
+        request.urlconf = __name__
+        return await super().get_response_async(request)
+
+
+def route_validation(application):
+    """Wrap Django's ASGI application, so that ticket validations are served
+    by a ``ValidationHandler``."""
+    validation_handler = ValidationHandler()
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and VALIDATION_PATH.search(scope['path']):
+            await validation_handler(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,116 @@
+"""Proxy callbacks for proxy-granting tickets.
+
+When a service validates a ticket with a ``pgtUrl``, the certificate of
+the callback URL is verified and the proxy-granting ticket is sent to it
+before the validation response is returned. mama_cas opens two new
+connections for this, each with a fixed timeout of 5 seconds.
+
+``ProxyCallbackClient`` sends the callbacks over a shared session instead,
+which keeps connections to the proxies open. Hosts whose certificate was
+verified are remembered for ``CAS_PROXY_CALLBACK_VERIFIED_TIMEOUT``
+seconds, so only the callback with the ticket is sent to them; as that
+request verifies the certificate as well, invalid certificates are still
+rejected. The async validation views (see core.asgi) await the callbacks
+in a pool of ``CAS_PROXY_CALLBACK_CONCURRENCY`` threads, so pending
+callbacks do not hold the worker.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import requests
+from mama_cas.exceptions import InvalidProxyCallback, UnauthorizedServiceProxy
+from mama_cas.services import proxy_allowed, proxy_callback_allowed
+from mama_cas.utils import add_query_params, is_scheme_https
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import PROXY_CALLBACK_DURATION, timer
+
+logger = logging.getLogger(__name__)
+
+VERIFIED_KEY = 'cas:pgturl:verified:{}'
+
+
+class ProxyCallbackClient:
+    """Verifies proxy callback URLs and sends proxy-granting tickets."""
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or settings.CAS_PROXY_CALLBACK_CONCURRENCY
+        self.timeout = (
+            settings.CAS_PROXY_CALLBACK_CONNECT_TIMEOUT,
+            settings.CAS_PROXY_CALLBACK_READ_TIMEOUT,
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.concurrency, pool_maxsize=self.concurrency
+        )
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='proxy-callback'
+        )
+
+    def check(self, service, pgturl):
+        if not proxy_allowed(service):
+            raise UnauthorizedServiceProxy(
+                '%s is not authorized to use proxy authentication' % service
+            )
+        if not is_scheme_https(pgturl):
+            raise InvalidProxyCallback('Proxy callback %s is not HTTPS' % pgturl)
+        if not proxy_callback_allowed(service, pgturl):
+            raise InvalidProxyCallback(
+                '%s is not an authorized proxy callback URL' % pgturl
+            )
+
+    def get(self, url):
+        try:
+            return self.session.get(url, timeout=self.timeout)
+        except requests.exceptions.SSLError:
+            raise InvalidProxyCallback(
+                'SSL certificate validation failed for proxy callback %s' % url
+            )
+        except requests.exceptions.RequestException as e:
+            raise InvalidProxyCallback(e)
+
+    def send(self, pgturl, pgtid, pgtiou):
+        with timer(PROXY_CALLBACK_DURATION, result='failure') as labels:
+            key = VERIFIED_KEY.format(urlsplit(pgturl).netloc.lower())
+            if not cache.get(key):
+                self.get(pgturl)
+                cache.set(key, True, settings.CAS_PROXY_CALLBACK_VERIFIED_TIMEOUT)
+
+            url = add_query_params(pgturl, {'pgtId': pgtid, 'pgtIou': pgtiou})
+            response = self.get(url)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                raise InvalidProxyCallback(
+                    'Proxy callback %s returned %s' % (pgturl, e)
+                )
+            labels.update(result='success')
+
+    def validate_callback(self, service, pgturl, pgtid, pgtiou):
+        """Verify the proxy callback URL and send the ticket to it, like
+        ``ProxyGrantingTicketManager.validate_callback`` of mama_cas."""
+        self.check(service, pgturl)
+        self.send(pgturl, pgtid, pgtiou)
+
+    async def avalidate_callback(self, service, pgturl, pgtid, pgtiou):
+        self.check(service, pgturl)
+        await asyncio.wrap_future(
+            self.executor.submit(self.send, pgturl, pgtid, pgtiou)
+        )
+
+
+@lru_cache(maxsize=None)
+def get_callback_client():
+    return ProxyCallbackClient()
+
+
+# the threads of the executor do not exist in forked processes
+os.register_at_fork(after_in_child=get_callback_client.cache_clear)
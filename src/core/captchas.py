@@ -0,0 +1,137 @@
+"""Pool of pre-generated captchas for the locked out page.
+
+django-simple-captcha renders the image of a captcha with Pillow and its
+audio version by spawning flite whenever they are requested, which adds
+up when many clients are locked out at once. ``python manage.py
+fillcaptchapool`` keeps a Redis list filled with up to
+``CAPTCHA_POOL_SIZE`` rendered captchas instead.
+
+Each captcha shown takes one entry from the pool: its challenge is stored
+in the database like any other captcha, so it is validated by
+django-simple-captcha, and its image and audio are cached until the
+captcha expires, from where ``core.views.captcha_image`` and
+``core.views.captcha_audio`` serve them. Captchas are only rendered on
+demand if the pool is empty.
+"""
+import logging
+import os
+import pickle  # nosec
+import tempfile
+
+from captcha import views as captcha_views
+from captcha.conf import settings as captcha_settings
+from captcha.fields import CaptchaTextInput
+from captcha.models import CaptchaStore
+from django_redis import get_redis_connection
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404, HttpRequest
+
+from .metrics import CAPTCHA_POOL, CAPTCHAS_RENDERED
+
+logger = logging.getLogger(__name__)
+
+POOL_KEY = 'cas:captcha:pool'
+
+
+def _client():
+    return get_redis_connection('default')
+
+
+def _media_key(kind, key):
+    return f'cas:captcha:{kind}:{key}'
+
+
+def _render_audio(key):
+    try:
+        response = captcha_views.captcha_audio(HttpRequest(), key)
+    except (Http404, OSError) as e:
+        logger.error('Cannot render the audio captcha: %s', e)
+        return None
+    try:
+        return b''.join(response.streaming_content)
+    finally:
+        response.close()
+        # django-simple-captcha leaves the file in the temporary directory
+        os.remove(os.path.join(tempfile.gettempdir(), f'{key}.wav'))
+
+
+def render():
+    """Generate a captcha and render its image and audio."""
+    challenge, response = captcha_settings.get_challenge()()
+    # the views of django-simple-captcha render stored captchas only, so the
+    # captcha is stored until it is rendered
+    with transaction.atomic():
+        store = CaptchaStore.objects.create(challenge=challenge, response=response)
+        entry = {
+            'challenge': store.challenge,
+            'response': store.response,
+            'image': captcha_views.captcha_image(None, store.hashkey).content,
+        }
+        if captcha_settings.CAPTCHA_FLITE_PATH:
+            entry['audio'] = _render_audio(store.hashkey)
+        transaction.set_rollback(True)
+    CAPTCHAS_RENDERED.inc()
+    return entry
+
+
+def fill(size=None):
+    """Add captchas to the pool until it holds ``size`` captchas.
+
+    :return: Number of captchas added
+    """
+    if size is None:
+        size = settings.CAPTCHA_POOL_SIZE
+    client = _client()
+    added = 0
+    while client.llen(POOL_KEY) < size:
+        client.rpush(POOL_KEY, pickle.dumps(render()))
+        added += 1
+    return added
+
+
+def pick():
+    """Return the key of a new captcha, taken from the pool if possible."""
+    raw = _client().lpop(POOL_KEY)
+    if raw is None:
+        CAPTCHA_POOL.labels('miss').inc()
+        return CaptchaStore.generate_key()
+    CAPTCHA_POOL.labels('hit').inc()
+
+    entry = pickle.loads(raw)  # nosec
+    store = CaptchaStore.objects.create(
+        challenge=entry['challenge'], response=entry['response']
+    )
+    cache.set_many(
+        {
+            _media_key(kind, store.hashkey): entry[kind]
+            for kind in ('image', 'audio')
+            if entry.get(kind) is not None
+        },
+        timeout=int(captcha_settings.CAPTCHA_TIMEOUT) * 60,
+    )
+    return store.hashkey
+
+
+def get_image(key):
+    """Return the pre-rendered image of a captcha, if any."""
+    return cache.get(_media_key('image', key))
+
+
+def get_audio(key):
+    """Return the pre-rendered audio of a captcha, if any."""
+    return cache.get(_media_key('audio', key))
+
+
+class PooledCaptchaTextInput(CaptchaTextInput):
+    """Captcha widget showing captchas from the pool."""
+
+    def fetch_captcha_store(self, name, value, attrs=None, generator=None):
+        if generator is not None:
+            return super().fetch_captcha_store(name, value, attrs, generator)
+        key = pick()
+        self._value = [key, '']
+        self._key = key
+        self.id_ = self.build_attrs(attrs).get('id', None)
@@ -0,0 +1,160 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from mama_cas.cas import get_attributes
+from mama_cas.exceptions import InvalidTicket, InvalidTicketSpec
+from mama_cas.models import ProxyTicket
+
+from django.contrib import messages
+from django.contrib.auth import get_user_model, logout
+from django.utils.translation import gettext_lazy as _
+
+from .tickets import get_ticket_backend
+
+logger = logging.getLogger(__name__)
+
+
+def validate_service_ticket(
+    service, ticket, pgturl=None, renew=False, require_https=False
+):
+    """Validate a service ticket string using the configured ticket backend.
+
+    Mirrors ``mama_cas.cas.validate_service_ticket``.
+
+    :return: Tuple of service ticket, attributes and optional proxy-granting
+        ticket
+    """
+    logger.debug('Service validation request received for %s' % ticket)
+
+    # Check for proxy tickets passed to /serviceValidate
+    if ticket and ticket.startswith(ProxyTicket.TICKET_PREFIX):
+        raise InvalidTicketSpec(
+            'Proxy tickets cannot be validated with /serviceValidate'
+        )
+
+    backend = get_ticket_backend()
+    st = backend.validate_service_ticket(
+        ticket, service, renew=renew, require_https=require_https
+    )
+    attributes = get_attributes(st.user, st.service)
+
+    if pgturl is not None:
+        logger.debug('Proxy-granting ticket request received for %s' % pgturl)
+        pgt = backend.create_proxy_granting_ticket(service, pgturl, st)
+    else:
+        pgt = None
+    return st, attributes, pgt
+
+
+def validate_proxy_ticket(service, ticket, pgturl=None):
+    """Validate a proxy ticket string using the configured ticket backend.
+
+    Mirrors ``mama_cas.cas.validate_proxy_ticket``.
+
+    :return: Tuple of proxy ticket, attributes, optional proxy-granting
+        ticket and the list of proxies
+    """
+    logger.debug('Proxy validation request received for %s' % ticket)
+
+    backend = get_ticket_backend()
+    pt, proxies = backend.validate_proxy_ticket(ticket, service)
+    attributes = get_attributes(pt.user, pt.service)
+
+    if pgturl is not None:
+        logger.debug('Proxy-granting ticket request received for %s' % pgturl)
+        pgt = backend.create_proxy_granting_ticket(service, pgturl, pt)
+    else:
+        pgt = None
+    return pt, attributes, pgt, proxies
+
+
+def validate_proxy_granting_ticket(pgt, target_service):
+    """Validate a proxy-granting ticket string and issue a proxy ticket.
+
+    Mirrors ``mama_cas.cas.validate_proxy_granting_ticket``.
+
+    :return: Proxy ticket
+    """
+    logger.debug(
+        'Proxy ticket request received for %s using %s' % (target_service, pgt)
+    )
+
+    backend = get_ticket_backend()
+    pgt = backend.validate_proxy_granting_ticket(pgt, target_service)
+    return backend.create_proxy_ticket(target_service, pgt)
+
+
+@sync_to_async
+def _aget_attributes(ticket):
+    # the async ticket backends do not load the user of a ticket, as this
+    # requires a database query
+    try:
+        user = ticket.user
+    except get_user_model().DoesNotExist:
+        raise InvalidTicket('Ticket %s does not exist' % ticket)
+    return get_attributes(user, ticket.service)
+
+
+async def avalidate_service_ticket(
+    service, ticket, pgturl=None, renew=False, require_https=False
+):
+    """Async version of ``validate_service_ticket``."""
+    logger.debug('Service validation request received for %s' % ticket)
+
+    if ticket and ticket.startswith(ProxyTicket.TICKET_PREFIX):
+        raise InvalidTicketSpec(
+            'Proxy tickets cannot be validated with /serviceValidate'
+        )
+
+    backend = get_ticket_backend()
+    st = await backend.avalidate_service_ticket(
+        ticket, service, renew=renew, require_https=require_https
+    )
+    attributes = await _aget_attributes(st)
+
+    if pgturl is not None:
+        logger.debug('Proxy-granting ticket request received for %s' % pgturl)
+        pgt = await backend.acreate_proxy_granting_ticket(service, pgturl, st)
+    else:
+        pgt = None
+    return st, attributes, pgt
+
+
+async def avalidate_proxy_ticket(service, ticket, pgturl=None):
+    """Async version of ``validate_proxy_ticket``."""
+    logger.debug('Proxy validation request received for %s' % ticket)
+
+    backend = get_ticket_backend()
+    pt, proxies = await backend.avalidate_proxy_ticket(ticket, service)
+    attributes = await _aget_attributes(pt)
+
+    if pgturl is not None:
+        logger.debug('Proxy-granting ticket request received for %s' % pgturl)
+        pgt = await backend.acreate_proxy_granting_ticket(service, pgturl, pt)
+    else:
+        pgt = None
+    return pt, attributes, pgt, proxies
+
+
+async def avalidate_proxy_granting_ticket(pgt, target_service):
+    """Async version of ``validate_proxy_granting_ticket``."""
+    logger.debug(
+        'Proxy ticket request received for %s using %s' % (target_service, pgt)
+    )
+
+    backend = get_ticket_backend()
+    pgt = await backend.avalidate_proxy_granting_ticket(pgt, target_service)
+    return await backend.acreate_proxy_ticket(target_service, pgt)
+
+
+def logout_user(request):
+    """End a single sign-on session for the current user."""
+    logger.debug('Logout request received for %s' % request.user)
+    if request.user.is_authenticated:
+        backend = get_ticket_backend()
+        backend.consume_tickets(request.user)
+        backend.request_sign_out(request.user)
+
+        logger.info('Single sign-on session ended for %s' % request.user)
+        logout(request)
+        messages.success(request, _('You have been successfully logged out'))
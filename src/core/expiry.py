@@ -0,0 +1,118 @@
+"""Deletion of invalid tickets from the database.
+
+mama_cas keeps consumed and expired tickets in the database until its
+``cleanupcas`` command deletes them one by one. ``python manage.py
+sweeptickets`` deletes them in small batches instead, so validation
+requests are never blocked for long:
+
+- each batch is selected by walking the ``(expires, id)`` or ``(consumed,
+  id)`` index from where the previous batch ended, so skipped tickets are
+  not read again
+- each batch is deleted in its own short transaction by primary key
+
+Tickets referenced by other tickets are kept until the referencing tickets
+have been deleted, which may take another run for chains of proxies.
+Service tickets are kept for ``CAS_TICKET_RETENTION`` seconds, as the
+database ticket backend finds the services to sign out of by the service
+tickets consumed during the session.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from mama_cas.models import ProxyGrantingTicket, ProxyTicket, ServiceTicket
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils.timezone import now
+
+from .metrics import TICKETS_DELETED
+
+logger = logging.getLogger(__name__)
+
+
+def _references():
+    """Tickets referencing each ticket model, which prevent its deletion."""
+    return {
+        ProxyTicket: ProxyGrantingTicket.objects.filter(granted_by_pt=OuterRef('pk')),
+        ProxyGrantingTicket: ProxyTicket.objects.filter(granted_by_pgt=OuterRef('pk')),
+        ServiceTicket: ProxyGrantingTicket.objects.filter(granted_by_st=OuterRef('pk')),
+    }
+
+
+class TicketSweeper:
+    """Deletes consumed and expired tickets in batches."""
+
+    # proxy tickets first, as they reference proxy-granting tickets, which
+    # reference service tickets
+    models = [ProxyTicket, ProxyGrantingTicket, ServiceTicket]
+
+    def __init__(self, batch_size=1000, pause=0):
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def cutoff(self, model):
+        if model is ServiceTicket:
+            return now() - timedelta(seconds=settings.CAS_TICKET_RETENTION)
+        return now()
+
+    def batches(self, model, field, cutoff):
+        """Yield the primary keys of invalid tickets in batches, ordered by
+        ``field``."""
+        queryset = (
+            model.objects.filter(**{f'{field}__lte': cutoff})
+            .filter(~Exists(_references()[model]))
+            .order_by(field, 'pk')
+            .values_list(field, 'pk')
+        )
+        last = None
+        while True:
+            if last is not None:
+                value, pk = last
+                batch = list(
+                    queryset.filter(
+                        Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+                    )[: self.batch_size]
+                )
+            else:
+                batch = list(queryset[: self.batch_size])
+            if not batch:
+                return
+            last = batch[-1]
+            yield [pk for _value, pk in batch]
+
+    def delete(self, model, pks):
+        # the references are checked again, as tickets may have been issued
+        # since the batch was selected
+        queryset = model.objects.filter(pk__in=pks).filter(
+            ~Exists(_references()[model])
+        )
+        _total, deleted = queryset.delete()
+        return deleted.get(model._meta.label, 0)
+
+    def sweep(self, model):
+        deleted = 0
+        cutoff = self.cutoff(model)
+        for field in ('expires', 'consumed'):
+            for pks in self.batches(model, field, cutoff):
+                count = self.delete(model, pks)
+                TICKETS_DELETED.labels(model._meta.model_name).inc(count)
+                deleted += count
+                if self.pause:
+                    time.sleep(self.pause)
+        return deleted
+
+    def run(self):
+        """Delete all invalid tickets.
+
+        :return: Dictionary of the number of deleted tickets per model
+        """
+        result = {}
+        for model in self.models:
+            result[model._meta.model_name] = self.sweep(model)
+            logger.info(
+                'Deleted %d %s',
+                result[model._meta.model_name],
+                model._meta.verbose_name_plural,
+            )
+        return result
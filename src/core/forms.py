@@ -4,9 +4,12 @@ from mama_cas.forms import LoginForm as MamaCasLoginForm
 from django import forms
 from django.utils.translation import gettext_lazy as _
 
+from .captchas import PooledCaptchaTextInput
+from .metrics import AUTHENTICATION_DURATION, timer
+
 
 class AxesCaptchaForm(forms.Form):
-    captcha = CaptchaField()
+    captcha = CaptchaField(widget=PooledCaptchaTextInput)
 
 
 # TODO remove as soon as this is fixed in MamaCAS
@@ -17,3 +20,12 @@ class LoginForm(MamaCasLoginForm):
         strip=False,
         error_messages={'required': _('Please enter your password')},
     )
+
+    def clean(self):
+        with timer(AUTHENTICATION_DURATION, backend='', result='failure') as labels:
+            try:
+                return super().clean()
+            finally:
+                user = getattr(self, 'user', None)
+                if user is not None:
+                    labels.update(backend=user.backend, result='success')
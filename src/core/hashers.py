@@ -0,0 +1,125 @@
+"""Password hashers of the django authentication backend.
+
+The hasher of new passwords is chosen with ``PASSWORD_HASHER`` and its
+cost with the ``PASSWORD_*`` settings. Django rehashes the password of a
+user with the chosen hasher and cost on the next login, so passwords
+hashed with another hasher or cost stay valid.
+
+Hashing a password takes around 100 ms of CPU, for valid and invalid
+passwords alike. It is run in a pool of ``PASSWORD_HASHING_WORKERS``
+threads per process, as hashlib and argon2 release the GIL while hashing,
+so at most that many passwords are hashed at once and the other requests
+of a gevent or gthread worker are not blocked. In a gevent worker the
+pool consists of real threads as well, which are waited for
+cooperatively.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from .utils import gevent_threadpool
+
+_lock = threading.Lock()
+_pool = None
+# set in the threads of the pool, where verify calls encode
+_local = threading.local()
+
+
+def _reset():
+    global _lock, _pool
+    _lock = threading.Lock()
+    _pool = None
+
+
+# the threads of the pool do not exist in forked processes
+os.register_at_fork(after_in_child=_reset)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                if gevent_threadpool() is not None:
+                    # real threads, which are waited for cooperatively
+                    from gevent.threadpool import ThreadPool
+
+                    _pool = ThreadPool(settings.PASSWORD_HASHING_WORKERS)
+                else:
+                    _pool = ThreadPoolExecutor(
+                        max_workers=settings.PASSWORD_HASHING_WORKERS,
+                        thread_name_prefix='password-hashing',
+                    )
+    return _pool
+
+
+def _run(func):
+    _local.in_pool = True
+    try:
+        return func()
+    finally:
+        _local.in_pool = False
+
+
+def run_hashing(func, *args, **kwargs):
+    """Run ``func`` in the password hashing pool and return its result."""
+    if not settings.PASSWORD_HASHING_WORKERS or getattr(_local, 'in_pool', False):
+        return func(*args, **kwargs)
+    pool = _get_pool()
+    func = partial(func, *args, **kwargs)
+    if isinstance(pool, ThreadPoolExecutor):
+        return pool.submit(_run, func).result()
+    return pool.apply(_run, (func,))
+
+
+class PooledHasherMixin:
+    """Runs encoding and verification in the password hashing pool."""
+
+    def encode(self, password, salt, *args, **kwargs):
+        return run_hashing(super().encode, password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return run_hashing(super().verify, password, encoded)
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r * p bytes, OpenSSL allows 32 MiB by default
+        return 2 * 128 * self.work_factor * self.block_size * self.parallelism
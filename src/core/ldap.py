@@ -0,0 +1,315 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import ldap
+from django_auth_ldap.backend import (
+    LDAPBackend as BaseLDAPBackend,
+    _LDAPUser,
+    valid_cache_key,
+)
+from ldap.ldapobject import ReconnectLDAPObject
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import LDAP_DURATION, timer
+from .utils import gevent_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class PooledLDAPObject(ReconnectLDAPObject):
+    """LDAP connection remembering the DN it is currently bound with.
+
+    libldap does blocking I/O, which gevent cannot patch, so in a gevent
+    worker LDAP calls are run in gevent's thread pool to not block the
+    other requests of the worker.
+    """
+
+    bound_dn = None
+
+    def _ldap_call(self, func, *args, **kwargs):
+        threadpool = gevent_threadpool()
+        if threadpool is None:
+            return super()._ldap_call(func, *args, **kwargs)
+        return threadpool.apply(super()._ldap_call, (func, *args), kwargs)
+
+    def simple_bind_s(self, who=None, cred=None, *args, **kwargs):
+        self.bound_dn = None
+        result = super().simple_bind_s(who, cred, *args, **kwargs)
+        self.bound_dn = who
+        return result
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.last_used = time.monotonic()
+        # closed instead of returned to the pool if False
+        self.reusable = True
+
+
+class LDAPConnectionPool:
+    """Pool of LDAP connections, which are kept open and bound with the
+    service account between authentications.
+
+    Connections are ``ReconnectLDAPObject`` instances, which reconnect and
+    replay the last bind if the server went away. Idle connections are
+    closed after ``idle_timeout`` seconds and checked with a WhoAmI
+    request if they were not used for ``health_check_interval`` seconds.
+    If more than ``size`` connections are needed at the same time,
+    additional connections are opened and closed after use.
+    """
+
+    connection_class = PooledLDAPObject
+
+    def __init__(
+        self, uri, options, start_tls, size, idle_timeout, health_check_interval
+    ):
+        self.uri = uri
+        self.options = options
+        self.start_tls = start_tls
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = self.connection_class(
+            self.uri, bytes_mode=False, retry_max=2, retry_delay=0.5
+        )
+        for opt, value in self.options.items():
+            connection.set_option(opt, value)
+        if self.start_tls:
+            connection.start_tls_s()
+        return PooledConnection(connection)
+
+    def _close(self, pooled):
+        try:
+            pooled.connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _is_healthy(self, pooled):
+        idle = time.monotonic() - pooled.last_used
+        if idle > self.idle_timeout:
+            return False
+        if idle > self.health_check_interval:
+            try:
+                pooled.connection.whoami_s()
+            except ldap.LDAPError:
+                return False
+        return True
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                pooled = self._idle.pop()
+            if self._is_healthy(pooled):
+                return pooled
+            self._close(pooled)
+        return self._connect()
+
+    def release(self, pooled):
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            if pooled.reusable and len(self._idle) < self.size:
+                self._idle.append(pooled)
+                return
+        self._close(pooled)
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        except ldap.INVALID_CREDENTIALS:
+            # a failed bind leaves the connection intact
+            self.release(pooled)
+            raise
+        except Exception:
+            self._close(pooled)
+            raise
+        else:
+            self.release(pooled)
+
+
+_pools = {}
+
+
+def get_pool(backend, request=None):
+    """Return the connection pool of the current process for the backend's
+    settings and the server of the request.
+
+    Like django_auth_ldap, a callable ``SERVER_URI`` is called with the
+    request, and ``GLOBAL_OPTIONS`` are applied before the first connection
+    is opened. Pools are never shared between processes, so the pool of a
+    gunicorn worker is created on its first LDAP authentication after the
+    fork.
+    """
+    uri = backend.settings.SERVER_URI
+    if callable(uri):
+        uri = uri(request)
+    key = (os.getpid(), backend.settings_prefix, uri)
+    if key not in _pools:
+        # applies the global options once per process
+        backend.ldap
+        _pools[key] = LDAPConnectionPool(
+            uri=uri,
+            options=backend.settings.CONNECTION_OPTIONS,
+            start_tls=backend.settings.START_TLS,
+            size=settings.AUTH_LDAP_POOL_SIZE,
+            idle_timeout=settings.AUTH_LDAP_POOL_IDLE_TIMEOUT,
+            health_check_interval=settings.AUTH_LDAP_POOL_HEALTH_CHECK_INTERVAL,
+        )
+    return _pools[key]
+
+
+def user_cache_key(username):
+    return valid_cache_key(f'ldap:user:{username}')
+
+
+class LDAPUser(_LDAPUser):
+    def _bind_as(self, bind_dn, bind_password, sticky=False):
+        with timer(LDAP_DURATION, operation='bind'):
+            if sticky or not settings.AUTH_LDAP_POOL_SIZE:
+                return super()._bind_as(bind_dn, bind_password, sticky=sticky)
+
+            # Check the user's credentials on another pooled connection, so
+            # the connection of this user stays bound with the service account
+            logger.debug('Binding as %s', bind_dn)
+            with get_pool(self.backend, self._request).connection() as pooled:
+                try:
+                    pooled.connection.simple_bind_s(bind_dn, bind_password)
+                finally:
+                    self._bind_service_account(pooled)
+
+    def _bind_service_account(self, pooled):
+        """Bind the pooled connection with the service account again, as
+        it must not be reused with the credentials of the user, which a
+        ``ReconnectLDAPObject`` would also replay after reconnecting."""
+        try:
+            pooled.connection.simple_bind_s(
+                self.settings.BIND_DN, self.settings.BIND_PASSWORD
+            )
+        except ldap.LDAPError as e:
+            logger.warning('Closing LDAP connection, rebind failed: %s', e)
+            pooled.reusable = False
+
+    def _load_user_dn(self):
+        timeout = self.settings.CACHE_TIMEOUT
+        if timeout > 0:
+            cached = cache.get(user_cache_key(self._username))
+            if cached is not None:
+                self._user_dn, self._user_attrs = cached
+                return
+
+        with timer(LDAP_DURATION, operation='search'):
+            super()._load_user_dn()
+
+        if timeout > 0 and self._user_dn is not None:
+            cache.set(
+                user_cache_key(self._username), (self._user_dn, self.attrs), timeout
+            )
+
+    def _get_or_create_user(self, force_populate=False):
+        super()._get_or_create_user(force_populate=force_populate)
+
+        if force_populate or self.settings.ALWAYS_UPDATE_USER:
+            return
+        if not settings.AUTH_LDAP_UPDATE_USER_ON_LOGIN:
+            # existing users are updated by the sync, see core.ldap_sync
+            return
+
+        # only write the fields that differ from the directory
+        changed = []
+        for field, attr in self.settings.USER_ATTR_MAP.items():
+            try:
+                value = self.attrs[attr][0]
+            except (TypeError, LookupError):
+                continue
+            if getattr(self._user, field) != value:
+                setattr(self._user, field, value)
+                changed.append(field)
+
+        if changed:
+            logger.debug('Updating %s of Django user %s', changed, self._user)
+            self._user.save(update_fields=changed)
+
+
+class LDAPBackend(BaseLDAPBackend):
+    """LDAP authentication backend with connection pooling and caching.
+
+    If ``AUTH_LDAP_POOL_SIZE`` is set, the connection of each ``LDAPUser``
+    is taken from the pool and returned afterwards. django_auth_ldap skips
+    the service account bind as long as ``_connection_bound`` is set, so a
+    pooled connection which is still bound with the service account is
+    used for the user search right away, without a new TLS handshake or
+    bind.
+
+    If ``AUTH_LDAP_CACHE_TIMEOUT`` is set, the DN and attributes of a user
+    are cached, so that a login only needs the bind as the user.
+    """
+
+    @contextmanager
+    def pooled_connection(self, ldap_user):
+        if not settings.AUTH_LDAP_POOL_SIZE:
+            yield
+            return
+
+        with get_pool(self, ldap_user._request).connection() as pooled:
+            ldap_user._connection = pooled.connection
+            ldap_user._connection_bound = (
+                pooled.connection.bound_dn == self.settings.BIND_DN
+            )
+            try:
+                yield
+            finally:
+                # later uses of the ldap_user (e.g. permission lookups) must
+                # not use the connection after it was returned to the pool
+                ldap_user._connection = None
+                ldap_user._connection_bound = False
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            return None
+
+        if not password and not self.settings.PERMIT_EMPTY_PASSWORD:
+            logger.debug('Rejecting empty password for %s', username)
+            return None
+
+        ldap_user = LDAPUser(self, username=username.strip(), request=request)
+        with timer(LDAP_DURATION, operation='authenticate'):
+            with self.pooled_connection(ldap_user):
+                return self.authenticate_ldap_user(ldap_user, password)
+
+    def populate_user(self, username):
+        ldap_user = LDAPUser(self, username=username)
+        with self.pooled_connection(ldap_user):
+            return ldap_user.populate_user()
+
+    def refresh_user(self, username):
+        """Populate a user from the directory, bypassing all caches.
+
+        :param username: Username of the user
+        :return: User instance, or None if the user was not found
+        """
+        cache.delete_many(
+            [
+                user_cache_key(username),
+                valid_cache_key(f'django_auth_ldap.user_dn.{username}'),
+            ]
+        )
+
+        ldap_user = LDAPUser(self, username=username)
+        with self.pooled_connection(ldap_user):
+            if ldap_user.dn is not None and self.settings.GROUP_TYPE is not None:
+                groups = ldap_user._get_groups()
+                cache.delete(groups._cache_key('_group_names'))
+            return ldap_user.populate_user()
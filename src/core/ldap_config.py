@@ -0,0 +1,134 @@
+"""LDAP configuration objects.
+
+Like ``django_auth_ldap.config`` this is safe to import into settings.py.
+"""
+import logging
+import pprint
+
+import ldap
+from django_auth_ldap.config import LDAPSearchUnion as BaseLDAPSearchUnion
+
+logger = logging.getLogger(__name__)
+
+
+class LDAPSearchUnion(BaseLDAPSearchUnion):
+    """Union of LDAP searches, which are run concurrently on one connection.
+
+    All searches are started asynchronously and their results are
+    collected as the server answers them. The entries of the first search,
+    in the configured order, which found any are returned, so a user found
+    in several bases is resolved to the first of these bases instead of
+    being rejected as ambiguous like with django_auth_ldap's union. As soon
+    as a search found entries and all searches before it found none, the
+    remaining searches are abandoned.
+
+    If ``remember_base`` is set, the search base a user was found in is
+    cached, and the next search for this user only runs the searches up to
+    that base, unless the user is not found there anymore.
+    """
+
+    remember_timeout = 60 * 60 * 24 * 30
+
+    def __init__(self, *args, remember_base=False):
+        super().__init__(*args)
+        self.remember_base = remember_base
+
+    def search_with_additional_terms(self, term_dict, escape=True):
+        searches = [
+            s.search_with_additional_terms(term_dict, escape) for s in self.searches
+        ]
+
+        return type(self)(*searches, remember_base=self.remember_base)
+
+    def search_with_additional_term_string(self, filterstr):
+        searches = [
+            s.search_with_additional_term_string(filterstr) for s in self.searches
+        ]
+
+        return type(self)(*searches, remember_base=self.remember_base)
+
+    def _remember_key(self, username):
+        return f'ldap:search_base:{username}'
+
+    def execute(self, connection, filterargs=(), escape=True):
+        username = None
+        if self.remember_base and isinstance(filterargs, dict):
+            username = filterargs.get('user')
+
+        searches = list(self.searches)
+        results = {}
+
+        if username:
+            from django.core.cache import cache
+
+            base_dns = [search.base_dn for search in searches]
+            base_dn = cache.get(self._remember_key(username))
+            if base_dn in base_dns:
+                # the searches after the remembered base cannot take precedence
+                index = base_dns.index(base_dn) + 1
+                results, base_dn = self._execute_concurrently(
+                    connection, searches[:index], filterargs, escape
+                )
+                searches = searches[index:]
+
+        if not results:
+            results, base_dn = self._execute_concurrently(
+                connection, searches, filterargs, escape
+            )
+
+        if username and len(results) == 1:
+            from django.core.cache import cache
+
+            cache.set(self._remember_key(username), base_dn, self.remember_timeout)
+
+        return results.items()
+
+    def _execute_concurrently(self, connection, searches, filterargs, escape):
+        # the results of the searches by their position, None while pending
+        answers = [None] * len(searches)
+        pending = {}
+        for index, search in enumerate(searches):
+            msgid = search._begin(connection, filterargs, escape)
+            if msgid is None:
+                answers[index] = {}
+            else:
+                pending[msgid] = index
+
+        try:
+            while True:
+                for index, results in enumerate(answers):
+                    if results is None:
+                        break
+                    if results:
+                        return results, searches[index].base_dn
+                else:
+                    return {}, None
+
+                try:
+                    kind, data, msgid = connection.result2(ldap.RES_ANY, all=1)
+                except ldap.LDAPError as e:
+                    # an error of a single search, e.g. a missing search base
+                    msgid = e.args[0].get('msgid') if e.args else None
+                    logger.error('result() raised %s', pprint.pformat(e))
+                    if msgid not in pending:
+                        # no search can be answered anymore
+                        for index in pending.values():
+                            answers[index] = {}
+                        pending.clear()
+                    else:
+                        answers[pending.pop(msgid)] = {}
+                    continue
+
+                index = pending.pop(msgid, None)
+                if index is None:
+                    continue
+                if kind not in (ldap.RES_SEARCH_ENTRY, ldap.RES_SEARCH_RESULT):
+                    data = []
+
+                answers[index] = dict(searches[index]._process_results(data))
+        finally:
+            for msgid in pending:
+                try:
+                    connection.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
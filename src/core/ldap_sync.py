@@ -0,0 +1,265 @@
+"""Incremental sync of the users in the LDAP directory.
+
+django_auth_ldap creates and updates the Django users one login at a time.
+``python manage.py syncldap`` instead reads the users of all search bases
+of ``AUTH_LDAP_USER_SEARCH`` in pages of ``AUTH_LDAP_SYNC_PAGE_SIZE``
+entries and writes them to the database in bulk. Only entries modified
+since the previous sync of a search base are read, so the newest
+``modifyTimestamp`` of every search base is kept in Redis as watermark.
+
+Users are matched by their lowercased username, like django_auth_ldap
+does. With ``AUTH_LDAP_SYNC_GROUP_ATTR`` (e.g. ``memberOf``) the groups
+of the users are set to the groups listed in this attribute, named after
+the first RDN of the group DNs.
+"""
+import logging
+import re
+from functools import reduce
+from operator import or_
+
+import ldap
+from ldap.cidict import cidict
+from ldap.controls import SimplePagedResultsControl
+from ldap.dn import str2dn
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .ldap import LDAPBackend, get_pool
+from .metrics import LDAP_DURATION, timer
+from .utils import invalidate_attributes
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = 'ldap:sync:watermark:{}'
+
+# the attribute holding the username in the filter of a user search
+_USERNAME_ATTR = re.compile(r'\(([\w;-]+)=%\(user\)s\)')
+
+
+def _values(attrs, attr):
+    return [
+        value.decode() if isinstance(value, bytes) else value
+        for value in attrs.get(attr) or []
+    ]
+
+
+def _group_name(value):
+    try:
+        return str2dn(value)[0][0][1]
+    except (ldap.DECODING_ERROR, IndexError):
+        # not a DN
+        return value
+
+
+class LDAPSync:
+    """Writes the users of the directory to the database."""
+
+    def __init__(self, backend=None, page_size=None):
+        self.backend = backend or LDAPBackend()
+        self.page_size = page_size or settings.AUTH_LDAP_SYNC_PAGE_SIZE
+        self.group_attr = settings.AUTH_LDAP_SYNC_GROUP_ATTR
+        self.user_model = get_user_model()
+
+    def get_searches(self):
+        search = self.backend.settings.USER_SEARCH
+        if search is None:
+            raise ImproperlyConfigured('Syncing users requires AUTH_LDAP_USER_SEARCH')
+        return getattr(search, 'searches', [search])
+
+    def run(self, full=False):
+        """Sync the users of all search bases.
+
+        :param full: Read all users, not only the modified ones
+        :return: Number of users created or updated
+        """
+        count = 0
+        with get_pool(self.backend).connection() as pooled:
+            connection = pooled.connection
+            if connection.bound_dn != self.backend.settings.BIND_DN:
+                connection.simple_bind_s(
+                    self.backend.settings.BIND_DN, self.backend.settings.BIND_PASSWORD
+                )
+            for search in self.get_searches():
+                count += self.sync_search(connection, search, full=full)
+        return count
+
+    def sync_search(self, connection, search, full=False):
+        match = _USERNAME_ATTR.search(search.filterstr)
+        if match is None:
+            raise ImproperlyConfigured(
+                f'The filter of the user search in {search.base_dn} has no '
+                '(attribute=%(user)s) term'
+            )
+        username_attr = match.group(1)
+
+        filterstr = search.filterstr % {'user': '*'}
+        key = WATERMARK_KEY.format(search.base_dn.lower())
+        watermark = None if full else cache.get(key)
+        if watermark:
+            filterstr = f'(&{filterstr}(modifyTimestamp>={watermark}))'
+        attrlist = [
+            username_attr,
+            'modifyTimestamp',
+            *self.backend.settings.USER_ATTR_MAP.values(),
+        ]
+        if self.group_attr:
+            attrlist.append(self.group_attr)
+
+        count = 0
+        newest = watermark
+        with timer(LDAP_DURATION, operation='sync'):
+            for page in self._pages(connection, search, filterstr, attrlist):
+                entries = {}
+                for _dn, attrs in page:
+                    attrs = cidict(attrs)
+                    usernames = _values(attrs, username_attr)
+                    if not usernames:
+                        continue
+                    entries[usernames[0].lower()] = attrs
+                    for timestamp in _values(attrs, 'modifyTimestamp'):
+                        newest = max(newest or timestamp, timestamp)
+                count += self.apply(entries)
+
+        # entries modified in the same second are read again by the next sync
+        if newest:
+            cache.set(key, newest, timeout=None)
+        logger.info('Synced %d users of %s', count, search.base_dn)
+        return count
+
+    def _pages(self, connection, search, filterstr, attrlist):
+        control = SimplePagedResultsControl(True, size=self.page_size, cookie='')
+        while True:
+            msgid = connection.search_ext(
+                search.base_dn,
+                search.scope,
+                filterstr,
+                attrlist,
+                serverctrls=[control],
+            )
+            _kind, data, _msgid, controls = connection.result3(msgid)
+            # search references have no DN
+            yield [(dn, attrs) for dn, attrs in data if dn is not None]
+
+            cookie = next(
+                (
+                    c.cookie
+                    for c in controls
+                    if c.controlType == SimplePagedResultsControl.controlType
+                ),
+                None,
+            )
+            if not cookie:
+                return
+            control.cookie = cookie
+
+    def apply(self, entries):
+        """Create or update the users of the directory entries in bulk.
+
+        :param entries: Attributes of the entries by lowercased username
+        :return: Number of users created or updated
+        """
+        if not entries:
+            return 0
+
+        users = self._get_users(entries)
+        created = []
+        updated = []
+        fields = set()
+        for username, attrs in entries.items():
+            values = {}
+            for field, attr in self.backend.settings.USER_ATTR_MAP.items():
+                value = _values(attrs, attr)
+                if value:
+                    values[field] = value[0]
+
+            user = users.get(username)
+            if user is None:
+                user = self.user_model(
+                    **{self.user_model.USERNAME_FIELD: username}, **values
+                )
+                user.set_unusable_password()
+                created.append(user)
+                continue
+
+            changed = [
+                field
+                for field, value in values.items()
+                if getattr(user, field) != value
+            ]
+            if changed:
+                for field in changed:
+                    setattr(user, field, values[field])
+                updated.append(user)
+                fields.update(changed)
+
+        changed_groups = set()
+        with transaction.atomic():
+            self.user_model.objects.bulk_create(created)
+            if updated:
+                self.user_model.objects.bulk_update(updated, fields)
+            if self.group_attr:
+                changed_groups = self.apply_groups(entries, self._get_users(entries))
+
+        # bulk writes do not send the signals which invalidate the attributes
+        invalidate_attributes(*{user.pk for user in updated} | changed_groups)
+        return len(created) + len(updated)
+
+    def _get_users(self, usernames):
+        return {
+            user.username_lower: user
+            for user in self.user_model.objects.annotate(
+                username_lower=Lower(self.user_model.USERNAME_FIELD)
+            ).filter(username_lower__in=list(usernames))
+        }
+
+    def apply_groups(self, entries, users):
+        """Set the groups of the users to the groups of their entries.
+
+        :return: Primary keys of the users whose groups changed
+        """
+        wanted = {
+            users[username].pk: {
+                _group_name(value) for value in _values(attrs, self.group_attr)
+            }
+            for username, attrs in entries.items()
+        }
+        names = set().union(*wanted.values())
+        Group.objects.bulk_create(
+            [Group(name=name) for name in names], ignore_conflicts=True
+        )
+        group_pks = dict(Group.objects.filter(name__in=names).values_list('name', 'pk'))
+
+        membership = self.user_model.groups.through
+        current = {}
+        for user_pk, group_pk in membership.objects.filter(
+            user_id__in=wanted
+        ).values_list('user_id', 'group_id'):
+            current.setdefault(user_pk, set()).add(group_pk)
+
+        added = []
+        removed = []
+        changed = set()
+        for user_pk, group_names in wanted.items():
+            target = {group_pks[name] for name in group_names}
+            present = current.get(user_pk, set())
+            if target == present:
+                continue
+            changed.add(user_pk)
+            added.extend(
+                membership(user_id=user_pk, group_id=group_pk)
+                for group_pk in target - present
+            )
+            if present - target:
+                removed.append(Q(user_id=user_pk, group_id__in=present - target))
+
+        membership.objects.bulk_create(added)
+        if removed:
+            membership.objects.filter(reduce(or_, removed)).delete()
+        return changed
@@ -0,0 +1,294 @@
+import json
+import logging
+from typing import Optional
+
+from axes.conf import settings
+from axes.handlers.base import AbstractAxesHandler, AxesBaseHandler
+from axes.helpers import (
+    get_cache_timeout,
+    get_client_cache_keys,
+    get_client_str,
+    get_client_username,
+    get_credentials,
+    get_failure_limit,
+    get_lockout_parameters,
+)
+from axes.models import AccessAttempt, AccessFailureLog, AccessLog
+from axes.signals import user_locked_out
+from django_redis import get_redis_connection
+
+from django.db import router, transaction
+from django.utils.dateparse import parse_datetime
+
+from .metrics import LOCKOUT_DURATION, timer
+
+logger = logging.getLogger(__name__)
+
+FAILURES_PREFIX = 'axes:failures:'
+AUDIT_KEY = 'axes:audit'
+
+
+class AxesRedisHandler(AbstractAxesHandler, AxesBaseHandler):
+    """Axes handler counting failed logins in Redis.
+
+    Failures are counted with ``INCR`` on one key per lockout parameter,
+    which expires after ``AXES_COOLOFF_TIME``, so the lockout decision
+    needs a single ``MGET`` and no database query.
+
+    Access logs and access failure logs are not written to the database
+    directly, but appended to a Redis list, which is written to the
+    database in batches by ``python manage.py flushaxesaudit``.
+    """
+
+    def __init__(self):
+        self.redis = get_redis_connection(getattr(settings, 'AXES_CACHE', 'default'))
+
+    def _keys(self, request_or_attempt, credentials=None):
+        return [
+            f'{FAILURES_PREFIX}{key}'
+            for key in get_client_cache_keys(request_or_attempt, credentials)
+        ]
+
+    def _audit(self, pipe, kind, request, username, **kwargs):
+        record = {
+            'kind': kind,
+            'username': username,
+            'ip_address': request.axes_ip_address,
+            'user_agent': request.axes_user_agent,
+            'http_accept': request.axes_http_accept,
+            'path_info': request.axes_path_info,
+            'attempt_time': request.axes_attempt_time.isoformat(),
+            **kwargs,
+        }
+        pipe.rpush(AUDIT_KEY, json.dumps(record))
+
+    def reset_attempts(
+        self,
+        *,
+        ip_address: Optional[str] = None,
+        username: Optional[str] = None,
+        ip_or_username: bool = False,
+    ) -> int:
+        if ip_address is None and username is None:
+            keys = list(self.redis.scan_iter(f'{FAILURES_PREFIX}*'))
+        elif ip_or_username:
+            keys = self._keys(AccessAttempt(ip_address=ip_address)) + self._keys(
+                AccessAttempt(username=username)
+            )
+        else:
+            keys = self._keys(AccessAttempt(username=username, ip_address=ip_address))
+
+        count = self.redis.delete(*keys) if keys else 0
+        logger.info('AXES: Reset %d access attempts from Redis.', count)
+        return count
+
+    def get_failures(self, request, credentials: Optional[dict] = None) -> int:
+        with timer(LOCKOUT_DURATION, operation='check'):
+            values = self.redis.mget(self._keys(request, credentials))
+        return max(int(value or 0) for value in values)
+
+    def user_login_failed(self, sender, credentials: dict, request=None, **kwargs):
+        if request is None:
+            logger.error(
+                'AXES: AxesRedisHandler.user_login_failed does not function '
+                'without a request.'
+            )
+            return
+
+        username = get_client_username(request, credentials)
+        if get_lockout_parameters(request, credentials) == ['username'] and (
+            username is None
+        ):
+            logger.warning(
+                'AXES: Username is None and username is the only lockout '
+                'parameter, the failure is not counted.'
+            )
+            return
+
+        # a failure during a lockout must not extend the lockout
+        if (
+            not settings.AXES_RESET_COOL_OFF_ON_FAILURE_DURING_LOCKOUT
+            and request.axes_locked_out
+        ):
+            request.axes_credentials = credentials
+            user_locked_out.send(
+                'axes',
+                request=request,
+                username=username,
+                ip_address=request.axes_ip_address,
+            )
+            return
+
+        client_str = get_client_str(
+            username,
+            request.axes_ip_address,
+            request.axes_user_agent,
+            request.axes_path_info,
+            request,
+        )
+
+        if self.is_whitelisted(request, credentials):
+            logger.info('AXES: Login failed from whitelisted client %s.', client_str)
+            return
+
+        timeout = get_cache_timeout()
+        keys = self._keys(request, credentials)
+        with timer(LOCKOUT_DURATION, operation='count'), self.redis.pipeline() as pipe:
+            for key in keys:
+                pipe.incr(key)
+                if timeout:
+                    pipe.expire(key, timeout)
+            results = pipe.execute()
+
+        failures = max(results[:: 2 if timeout else 1])
+        request.axes_failures_since_start = failures
+        limit = get_failure_limit(request, credentials)
+        logger.warning(
+            'AXES: Login failure by %s. Count = %d of %d.', client_str, failures, limit
+        )
+
+        if settings.AXES_LOCK_OUT_AT_FAILURE and failures >= limit:
+            logger.warning(
+                'AXES: Locking out %s after repeated login failures.', client_str
+            )
+            request.axes_locked_out = True
+            request.axes_credentials = credentials
+            user_locked_out.send(
+                'axes',
+                request=request,
+                username=username,
+                ip_address=request.axes_ip_address,
+            )
+
+        if settings.AXES_ENABLE_ACCESS_FAILURE_LOG:
+            with self.redis.pipeline(transaction=False) as pipe:
+                self._audit(
+                    pipe,
+                    'failure',
+                    request,
+                    username,
+                    locked_out=request.axes_locked_out,
+                )
+                pipe.execute()
+
+    def user_logged_in(self, sender, request, user, **kwargs):
+        username = user.get_username()
+        logger.info(
+            'AXES: Successful login by %s.',
+            get_client_str(
+                username,
+                request.axes_ip_address,
+                request.axes_user_agent,
+                request.axes_path_info,
+                request,
+            ),
+        )
+
+        with self.redis.pipeline(transaction=False) as pipe:
+            if settings.AXES_RESET_ON_SUCCESS:
+                pipe.delete(*self._keys(request, get_credentials(username)))
+            if not settings.AXES_DISABLE_ACCESS_LOG:
+                self._audit(pipe, 'login', request, username)
+            pipe.execute()
+
+    def user_logged_out(self, sender, request, user, **kwargs):
+        username = user.get_username() if user else None
+        logger.info(
+            'AXES: Successful logout by %s.',
+            get_client_str(
+                username,
+                request.axes_ip_address,
+                request.axes_user_agent,
+                request.axes_path_info,
+                request,
+            ),
+        )
+
+        if username and not settings.AXES_DISABLE_ACCESS_LOG:
+            with self.redis.pipeline(transaction=False) as pipe:
+                self._audit(pipe, 'logout', request, username)
+                pipe.execute()
+
+    def remove_out_of_limit_failure_logs(
+        self,
+        *,
+        username: str,
+        limit: Optional[int] = None,
+    ) -> int:
+        if limit is None:
+            limit = settings.AXES_ACCESS_FAILURE_LOG_PER_USER_LIMIT
+        pks = AccessFailureLog.objects.filter(username=username).values_list(
+            'pk', flat=True
+        )[limit:]
+        count, _ = AccessFailureLog.objects.filter(pk__in=list(pks)).delete()
+        return count
+
+
+def _access_fields(record):
+    return {
+        'username': record['username'],
+        'ip_address': record['ip_address'],
+        'user_agent': record['user_agent'],
+        'http_accept': record['http_accept'],
+        'path_info': record['path_info'],
+        'attempt_time': parse_datetime(record['attempt_time']),
+    }
+
+
+def flush_audit(batch_size=1000):
+    """Write the queued axes audit records to the database.
+
+    Records are only removed from the queue after they were written, and
+    concurrent flushes are serialized with a Redis lock.
+
+    :param batch_size: Number of records written per transaction
+    :return: Number of records written
+    """
+    handler = AxesRedisHandler()
+    redis = handler.redis
+    count = 0
+
+    with redis.lock(f'{AUDIT_KEY}:lock', timeout=300, blocking_timeout=0):
+        while True:
+            records = [
+                json.loads(record)
+                for record in redis.lrange(AUDIT_KEY, 0, batch_size - 1)
+            ]
+            if not records:
+                break
+
+            failures = []
+            logins = []
+            logouts = []
+            for record in records:
+                if record['kind'] == 'failure':
+                    failures.append(
+                        AccessFailureLog(
+                            locked_out=record['locked_out'], **_access_fields(record)
+                        )
+                    )
+                elif record['kind'] == 'login':
+                    logins.append(AccessLog(**_access_fields(record)))
+                else:
+                    logouts.append(record)
+
+            with transaction.atomic(using=router.db_for_write(AccessLog)):
+                for model, objs in ((AccessFailureLog, failures), (AccessLog, logins)):
+                    times = [obj.attempt_time for obj in objs]
+                    model.objects.bulk_create(objs)
+                    # attempt_time is set to now on creation, so restore the
+                    # time of the attempt
+                    for obj, attempt_time in zip(objs, times):
+                        obj.attempt_time = attempt_time
+                    model.objects.bulk_update(objs, ['attempt_time'])
+                for record in logouts:
+                    AccessLog.objects.filter(
+                        username=record['username'], logout_time__isnull=True
+                    ).update(logout_time=parse_datetime(record['attempt_time']))
+                for username in {failure.username for failure in failures}:
+                    handler.remove_out_of_limit_failure_logs(username=username)
+
+            redis.ltrim(AUDIT_KEY, len(records), -1)
+            count += len(records)
+
+    return count
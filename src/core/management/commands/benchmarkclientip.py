@@ -0,0 +1,68 @@
+import time
+
+from ipware.ip import get_client_ip as ipware_get_client_ip
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from general.ip import get_client_ip, get_trusted_proxies
+
+
+class Command(BaseCommand):
+    help = 'Measure the client IP resolution for long X-Forwarded-For chains'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--length',
+            type=int,
+            action='append',
+            help='Number of addresses sent by the client in X-Forwarded-For, can be '
+            'given multiple times (default: 1, 10, 100 and 1000)',
+        )
+        parser.add_argument(
+            '--proxies',
+            type=int,
+            default=2,
+            help='Number of trusted proxies at the end of the chain (default: 2)',
+        )
+        parser.add_argument(
+            '-n',
+            '--number',
+            type=int,
+            default=10000,
+            help='Number of resolutions per chain (default: 10000)',
+        )
+
+    def handle(self, *args, **options):
+        number = options['number']
+        proxies = options['proxies']
+        # the index is built once per process
+        get_trusted_proxies()
+
+        for length in options['length'] or [1, 10, 100, 1000]:
+            # addresses sent by the client, the client and the trusted proxies
+            chain = [f'203.0.{i // 256 % 256}.{i % 256}' for i in range(length)]
+            chain += ['198.51.100.7'] + [f'10.0.0.{i + 1}' for i in range(proxies)]
+            request = RequestFactory().get(
+                '/',
+                REMOTE_ADDR=chain[-1],
+                HTTP_X_FORWARDED_FOR=', '.join(chain[:-1]),
+            )
+
+            results = {}
+            for name, resolve in [
+                ('resolver', get_client_ip),
+                ('ipware', lambda request: ipware_get_client_ip(request)[0]),
+            ]:
+                start = time.perf_counter()
+                for _ in range(number):
+                    # not cached between the requests
+                    request.__dict__.pop('client_ip', None)
+                    client_ip = resolve(request)
+                duration = time.perf_counter() - start
+                results[name] = f'{number / duration:.0f}/s ({client_ip})'
+
+            self.stdout.write(
+                f'{length} entries: '
+                + ', '.join(f'{name} {result}' for name, result in results.items())
+            )
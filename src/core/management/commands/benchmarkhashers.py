@@ -0,0 +1,93 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from core.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+
+COST = (
+    'iterations',
+    'time_cost',
+    'memory_cost',
+    'work_factor',
+    'block_size',
+    'parallelism',
+)
+
+HASHERS = {
+    'pbkdf2': PBKDF2PasswordHasher,
+    'argon2': Argon2PasswordHasher,
+    'scrypt': ScryptPasswordHasher,
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure the password verifications per second of the password hashers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasher',
+            action='append',
+            choices=HASHERS.keys(),
+            help='Hasher to benchmark with the configured cost, can be given '
+            'multiple times (default: all)',
+        )
+        parser.add_argument(
+            '-n',
+            '--number',
+            type=int,
+            default=20,
+            help='Number of verifications per hasher (default: 20)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Concurrent logins sent to the hashing pool of a worker '
+            '(default: 10)',
+        )
+
+    def handle(self, *args, **options):
+        number = options['number']
+        cores = len(os.sched_getaffinity(0))
+
+        for name in options['hasher'] or HASHERS:
+            hasher = HASHERS[name]()
+            try:
+                encoded = hasher.encode('correct horse battery staple', hasher.salt())
+            except ValueError as e:
+                # the library of the hasher is not installed
+                self.stdout.write(f'{name}: {e}')
+                continue
+
+            # one login at a time in the request thread uses one core
+            with override_settings(PASSWORD_HASHING_WORKERS=0):
+                start = time.perf_counter()
+                for _ in range(number):
+                    hasher.verify('wrong password', encoded)
+                per_core = number / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                list(
+                    executor.map(
+                        lambda _: hasher.verify('wrong password', encoded),
+                        range(number),
+                    )
+                )
+            pooled = number / (time.perf_counter() - start)
+
+            decoded = hasher.decode(encoded)
+            cost = ', '.join(f'{key}={decoded[key]}' for key in COST if key in decoded)
+            self.stdout.write(
+                f'{name} ({cost}): '
+                f'{per_core:.1f} logins/s/core, {1000 / per_core:.0f} ms per login, '
+                f'{pooled:.1f} logins/s in the hashing pool of a worker '
+                f'(cores available: {cores})'
+            )
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    help = 'Compare ticket issue and validation throughput of the ticket stores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store',
+            action='append',
+            choices=settings.CAS_TICKET_BACKENDS.keys(),
+            help='Ticket store to benchmark, can be given multiple times '
+            '(default: all)',
+        )
+        parser.add_argument(
+            '-n',
+            '--number',
+            type=int,
+            default=1000,
+            help='Number of tickets to issue and validate (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        number = options['number']
+        service = settings.SITE_URL
+
+        for store in options['store'] or settings.CAS_TICKET_BACKENDS:
+            backend = import_string(settings.CAS_TICKET_BACKENDS[store])()
+
+            # everything written to the database is rolled back afterwards,
+            # tickets left in Redis are consumed or expire on their own
+            with transaction.atomic():
+                user = get_user_model().objects.create(
+                    username=f'benchmark-{get_random_string(8)}'
+                )
+
+                start = time.perf_counter()
+                tickets = [
+                    backend.create_service_ticket(service, user).ticket
+                    for _ in range(number)
+                ]
+                issued = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for ticket in tickets:
+                    backend.validate_service_ticket(ticket, service)
+                validated = time.perf_counter() - start
+
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f'{store}: {number / issued:.0f} issues/s, '
+                f'{number / validated:.0f} validations/s'
+            )
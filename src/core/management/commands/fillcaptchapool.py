@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Fill the pool of pre-rendered captchas in Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            help='Number of captchas to keep in the pool (default: CAPTCHA_POOL_SIZE)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Keep running and refill the pool every INTERVAL seconds',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            help='Serve the Prometheus metrics of the pool filler on this port',
+        )
+
+    def handle(self, *args, **options):
+        from core.captchas import fill
+
+        if options['metrics_port']:
+            from prometheus_client import start_http_server
+
+            start_http_server(options['metrics_port'])
+
+        while True:
+            added = fill(options['size'])
+            if added or not options['interval']:
+                self.stdout.write(f'{added} captchas added to the pool')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
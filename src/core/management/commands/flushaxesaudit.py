@@ -0,0 +1,29 @@
+from redis.exceptions import LockError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Write the queued axes access logs and failure logs to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of records written per transaction (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        if settings.AXES_HANDLER != 'core.lockout.AxesRedisHandler':
+            raise CommandError('The axes Redis handler is not configured')
+
+        from core.lockout import flush_audit
+
+        try:
+            count = flush_audit(batch_size=options['batch_size'])
+        except LockError:
+            raise CommandError('Another flush is already running')
+
+        self.stdout.write(f'{count} records written')
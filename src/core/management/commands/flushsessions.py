@@ -0,0 +1,30 @@
+from redis.exceptions import LockError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Write the sessions changed since the last run to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of sessions written per transaction (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.SESSION_PERSIST:
+            self.stdout.write('Session persistence is disabled')
+            return
+
+        from core.sessions import flush
+
+        try:
+            count = flush(batch_size=options['batch_size'])
+        except LockError:
+            raise CommandError('Another flush is already running')
+
+        self.stdout.write(f'{count} sessions written')
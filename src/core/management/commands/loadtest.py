@@ -0,0 +1,118 @@
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from django.core.management.base import BaseCommand, CommandError
+
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class Command(BaseCommand):
+    help = 'Measure login and ticket validation throughput of a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='Base URL of the server, e.g. http://localhost:8000/auth'
+        )
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument(
+            '--service',
+            required=True,
+            help='Service URL, which must be allowed in MAMA_CAS_SERVICES',
+        )
+        parser.add_argument(
+            '-c',
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Number of concurrent clients (default: 10)',
+        )
+        parser.add_argument(
+            '-n',
+            '--number',
+            type=int,
+            default=200,
+            help='Number of logins and validations (default: 200)',
+        )
+
+    def login(self, url, username, password, service):
+        session = requests.Session()
+        login_url = f'{url}/login/'
+        params = {'service': service}
+
+        start = time.perf_counter()
+        response = session.get(login_url, params=params)
+        match = CSRF_RE.search(response.text)
+        if match is None:
+            raise CommandError(f'No login form at {response.url}')
+        response = session.post(
+            login_url,
+            params=params,
+            data={
+                'csrfmiddlewaretoken': match.group(1),
+                'username': username,
+                'password': password,
+            },
+            headers={'Referer': response.url},
+            allow_redirects=False,
+        )
+        duration = time.perf_counter() - start
+
+        ticket = parse_qs(urlparse(response.headers.get('Location', '')).query).get(
+            'ticket'
+        )
+        if not ticket:
+            raise CommandError(f'Login failed with status {response.status_code}')
+        return duration, ticket[0]
+
+    def validate(self, url, service, ticket):
+        start = time.perf_counter()
+        response = requests.get(
+            f'{url}/p3/serviceValidate',
+            params={'service': service, 'ticket': ticket},
+        )
+        duration = time.perf_counter() - start
+        if 'authenticationSuccess' not in response.text:
+            raise CommandError(f'Validation of {ticket} failed')
+        return duration
+
+    def report(self, name, durations, elapsed):
+        durations = sorted(durations)
+        p50 = durations[len(durations) // 2]
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        self.stdout.write(
+            f'{name:10} {len(durations) / elapsed:8.1f} req/s   '
+            f'mean {statistics.mean(durations) * 1000:7.1f} ms   '
+            f'p50 {p50 * 1000:7.1f} ms   p99 {p99 * 1000:7.1f} ms'
+        )
+
+    def handle(self, *args, **options):
+        url = options['url'].rstrip('/')
+        service = options['service']
+        number = options['number']
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            start = time.perf_counter()
+            logins = list(
+                executor.map(
+                    lambda _i: self.login(
+                        url, options['username'], options['password'], service
+                    ),
+                    range(number),
+                )
+            )
+            self.report('login', [d for d, _t in logins], time.perf_counter() - start)
+
+            start = time.perf_counter()
+            validations = list(
+                executor.map(
+                    lambda ticket: self.validate(url, service, ticket),
+                    [t for _d, t in logins],
+                )
+            )
+            self.report('validate', validations, time.perf_counter() - start)
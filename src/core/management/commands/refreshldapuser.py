@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Update users from the LDAP directory, bypassing the LDAP cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='+', help='Usernames to refresh')
+
+    def handle(self, *args, **options):
+        if 'core.ldap.LDAPBackend' not in settings.AUTHENTICATION_BACKENDS:
+            raise CommandError('The ldap authentication backend is not configured')
+
+        from core.ldap import LDAPBackend
+
+        backend = LDAPBackend()
+        for username in options['usernames']:
+            if backend.refresh_user(username) is None:
+                self.stderr.write(f'{username}: not found in the directory')
+            else:
+                self.stdout.write(f'{username}: refreshed')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.services import reload, services
+
+
+class Command(BaseCommand):
+    help = 'Make all workers reload the CAS services'
+
+    def handle(self, *args, **options):
+        reload()
+        count = len(services.get_registry().services)
+        self.stdout.write(f'{count} services loaded')
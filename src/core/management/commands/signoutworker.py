@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Send the queued single sign-out requests to the services'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.CAS_SIGN_OUT_CONCURRENCY,
+            help='Number of requests sent concurrently '
+            f'(default: {settings.CAS_SIGN_OUT_CONCURRENCY})',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            help='Serve the Prometheus metrics of the worker on this port',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit as soon as the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        from core.signout import SignOutWorker
+
+        if options['metrics_port']:
+            from prometheus_client import start_http_server
+
+            start_http_server(options['metrics_port'])
+
+        worker = SignOutWorker(concurrency=options['concurrency'])
+        sent = worker.run(once=options['once'])
+        self.stdout.write(f'{sent} requests sent')
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete consumed and expired CAS tickets from the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of tickets deleted per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches (default: 0)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Keep running and delete the invalid tickets every INTERVAL '
+            'seconds',
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            help='Serve the Prometheus metrics of the sweeper on this port',
+        )
+
+    def handle(self, *args, **options):
+        from core.expiry import TicketSweeper
+
+        if options['metrics_port']:
+            from prometheus_client import start_http_server
+
+            start_http_server(options['metrics_port'])
+
+        sweeper = TicketSweeper(
+            batch_size=options['batch_size'], pause=options['pause']
+        )
+        while True:
+            result = sweeper.run()
+            self.stdout.write(
+                ', '.join(f'{count} {name}s deleted' for name, count in result.items())
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Create and update the users of the LDAP directory in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Read all users, not only those modified since the last sync',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Keep running and sync the modified users every INTERVAL seconds',
+        )
+
+    def handle(self, *args, **options):
+        if 'core.ldap.LDAPBackend' not in settings.AUTHENTICATION_BACKENDS:
+            raise CommandError('The ldap authentication backend is not configured')
+
+        from core.ldap_sync import LDAPSync
+
+        sync = LDAPSync()
+        full = options['full']
+        while True:
+            count = sync.run(full=full)
+            if count or not options['interval']:
+                self.stdout.write(f'{count} users synced')
+            if not options['interval']:
+                return
+            full = False
+            time.sleep(options['interval'])
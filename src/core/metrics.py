@@ -0,0 +1,128 @@
+"""Prometheus metrics of baseauth.
+
+With gunicorn every worker process writes its metrics to the directory
+given in ``PROMETHEUS_MULTIPROC_DIR`` (set in gunicorn-conf.py), and the
+metrics view aggregates the metrics of all workers.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+REQUEST_DURATION = Histogram(
+    'baseauth_request_duration_seconds',
+    'Duration of HTTP requests',
+    ['view', 'method', 'status'],
+)
+AUTHENTICATION_DURATION = Histogram(
+    'baseauth_authentication_duration_seconds',
+    'Duration of the authentication of a login, including all backends',
+    ['backend', 'result'],
+)
+LDAP_DURATION = Histogram(
+    'baseauth_ldap_duration_seconds',
+    'Duration of LDAP operations',
+    ['operation'],
+)
+LOCKOUT_DURATION = Histogram(
+    'baseauth_lockout_duration_seconds',
+    'Duration of the lockout checks and failure counting of axes',
+    ['operation'],
+)
+TICKET_DURATION = Histogram(
+    'baseauth_ticket_duration_seconds',
+    'Duration of ticket operations',
+    ['operation', 'store'],
+)
+TICKETS_DELETED = Counter(
+    'baseauth_tickets_deleted_total',
+    'Consumed and expired tickets deleted from the database',
+    ['ticket'],
+)
+ATTRIBUTES_DURATION = Histogram(
+    'baseauth_attributes_duration_seconds',
+    'Duration of collecting the CAS attributes of a user',
+)
+ATTRIBUTES_CACHE = Counter(
+    'baseauth_attributes_cache_total',
+    'Lookups of cached CAS attributes',
+    ['result'],
+)
+SESSION_LOCAL_CACHE = Counter(
+    'baseauth_session_local_cache_total',
+    'Sessions loaded from the memory of the worker (hit) or from Redis (miss)',
+    ['result'],
+)
+DB_POOL_WAIT = Histogram(
+    'baseauth_db_pool_wait_seconds',
+    'Time waited for a connection of the database connection pool',
+    ['pool', 'result'],
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'baseauth_db_pool_connections',
+    'Connections of the database connection pools of the running workers',
+    ['pool', 'state'],
+    multiprocess_mode='livesum',
+)
+SIGN_OUT_DURATION = Histogram(
+    'baseauth_sign_out_duration_seconds',
+    'Duration of requesting the single sign-out of the services of a user',
+)
+SIGN_OUT_REQUESTS = Counter(
+    'baseauth_sign_out_requests_total',
+    'Single sign-out requests sent to services',
+    ['result'],
+)
+
+PROXY_CALLBACK_DURATION = Histogram(
+    'baseauth_proxy_callback_duration_seconds',
+    'Duration of verifying a proxy callback URL and sending the ticket to it',
+    ['result'],
+)
+CAPTCHA_POOL = Counter(
+    'baseauth_captcha_pool_total',
+    'Captchas shown, taken from the pool (hit) or rendered on demand (miss)',
+    ['result'],
+)
+CAPTCHAS_RENDERED = Counter(
+    'baseauth_captchas_rendered_total',
+    'Captchas rendered for the captcha pool',
+)
+
+
+@contextmanager
+def timer(histogram, **labels):
+    """Observe the duration of the block in the histogram.
+
+    The labels can be changed within the block by updating the yielded
+    dictionary, e.g. to record the result of an operation.
+    """
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        metric = histogram.labels(**labels) if labels else histogram
+        metric.observe(time.perf_counter() - start)
+
+
+def render():
+    """Return the metrics of all processes in the text exposition format.
+
+    :return: Tuple of the content and its content type
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
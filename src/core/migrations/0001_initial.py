@@ -0,0 +1,102 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+import core.models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='Service',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_changed', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                (
+                    'service',
+                    models.CharField(
+                        help_text='Regular expression matching the URLs of the service',
+                        max_length=500,
+                        validators=[core.models.validate_pattern],
+                        verbose_name='service pattern',
+                    ),
+                ),
+                (
+                    'position',
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text='Services are matched in ascending order of their position',
+                        verbose_name='position',
+                    ),
+                ),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                (
+                    'attributes',
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text='Attributes sent to the service, all if empty',
+                        verbose_name='attributes',
+                    ),
+                ),
+                (
+                    'proxy_allow',
+                    models.BooleanField(
+                        default=False, verbose_name='allow proxy tickets'
+                    ),
+                ),
+                (
+                    'proxy_pattern',
+                    models.CharField(
+                        blank=True,
+                        help_text='Regular expression matching the allowed proxy callback URLs',
+                        max_length=500,
+                        validators=[core.models.validate_pattern],
+                        verbose_name='proxy callback pattern',
+                    ),
+                ),
+                (
+                    'logout_allow',
+                    models.BooleanField(
+                        default=False, verbose_name='send logout requests'
+                    ),
+                ),
+                (
+                    'logout_url',
+                    models.URLField(
+                        blank=True,
+                        help_text='URL logout requests are sent to, defaults to the service URL',
+                        verbose_name='logout URL',
+                    ),
+                ),
+                (
+                    'sign_out_timeout',
+                    models.FloatField(
+                        blank=True,
+                        help_text='Seconds, defaults to CAS_SIGN_OUT_TIMEOUT',
+                        null=True,
+                        verbose_name='logout request timeout',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'service',
+                'verbose_name_plural': 'services',
+                'ordering': ('position', 'pk'),
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+TABLES = [
+    'mama_cas_serviceticket',
+    'mama_cas_proxyticket',
+    'mama_cas_proxygrantingticket',
+]
+
+
+def create_indexes(apps, schema_editor):
+    # the batches of core.expiry walk these indexes; on Postgres they are
+    # created without locking the ticket tables against writes
+    concurrently = (
+        'CONCURRENTLY' if schema_editor.connection.vendor == 'postgresql' else ''
+    )
+    for table in TABLES:
+        schema_editor.execute(
+            f'CREATE INDEX {concurrently} IF NOT EXISTS {table}_expires_id '
+            f'ON {table} (expires, id)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {concurrently} IF NOT EXISTS {table}_consumed_id '
+            f'ON {table} (consumed, id) WHERE consumed IS NOT NULL'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    for table in TABLES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_expires_id')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_consumed_id')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('mama_cas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
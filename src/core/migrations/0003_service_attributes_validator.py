@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+import core.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0002_ticket_expiry_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='service',
+            name='attributes',
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text='Attributes sent to the service, all if empty',
+                validators=[core.models.validate_attributes],
+                verbose_name='attributes',
+            ),
+        ),
+    ]
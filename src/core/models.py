@@ -0,0 +1,106 @@
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from general.models import AbstractBaseModel
+
+
+def validate_pattern(value):
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise ValidationError(
+            _('Invalid regular expression: %(error)s'), params={'error': e}
+        )
+
+
+def validate_attributes(value):
+    from .utils import ATTRIBUTES
+
+    if not isinstance(value, list):
+        raise ValidationError(_('Enter a list of attribute names.'))
+    unknown = [name for name in value if name not in ATTRIBUTES]
+    if unknown:
+        raise ValidationError(
+            _('Unknown attributes: %(unknown)s. Available: %(available)s'),
+            params={
+                'unknown': ', '.join(map(str, unknown)),
+                'available': ', '.join(ATTRIBUTES),
+            },
+        )
+
+
+class Service(AbstractBaseModel):
+    """A service allowed to use CAS, in addition to ``MAMA_CAS_SERVICES``.
+
+    See core.services for how services are matched.
+    """
+
+    name = models.CharField(_('name'), max_length=100)
+    service = models.CharField(
+        _('service pattern'),
+        max_length=500,
+        validators=[validate_pattern],
+        help_text=_('Regular expression matching the URLs of the service'),
+    )
+    position = models.PositiveIntegerField(
+        _('position'),
+        default=0,
+        help_text=_('Services are matched in ascending order of their position'),
+    )
+    is_active = models.BooleanField(_('active'), default=True)
+    attributes = models.JSONField(
+        _('attributes'),
+        default=list,
+        blank=True,
+        validators=[validate_attributes],
+        help_text=_('Attributes sent to the service, all if empty'),
+    )
+    proxy_allow = models.BooleanField(_('allow proxy tickets'), default=False)
+    proxy_pattern = models.CharField(
+        _('proxy callback pattern'),
+        max_length=500,
+        blank=True,
+        validators=[validate_pattern],
+        help_text=_('Regular expression matching the allowed proxy callback URLs'),
+    )
+    logout_allow = models.BooleanField(_('send logout requests'), default=False)
+    logout_url = models.URLField(
+        _('logout URL'),
+        blank=True,
+        help_text=_('URL logout requests are sent to, defaults to the service URL'),
+    )
+    sign_out_timeout = models.FloatField(
+        _('logout request timeout'),
+        null=True,
+        blank=True,
+        help_text=_('Seconds, defaults to CAS_SIGN_OUT_TIMEOUT'),
+    )
+
+    class Meta:
+        ordering = ('position', 'pk')
+        verbose_name = _('service')
+        verbose_name_plural = _('services')
+
+    def __str__(self):
+        return self.name
+
+    def as_config(self):
+        """Return the service in the format of ``MAMA_CAS_SERVICES``."""
+        config = {
+            'SERVICE': self.service,
+            'CALLBACKS': ['core.utils.get_attributes'],
+            'PROXY_ALLOW': self.proxy_allow,
+            'LOGOUT_ALLOW': self.logout_allow,
+        }
+        if self.attributes:
+            config['ATTRIBUTES'] = self.attributes
+        if self.proxy_pattern:
+            config['PROXY_PATTERN'] = self.proxy_pattern
+        if self.logout_url:
+            config['LOGOUT_URL'] = self.logout_url
+        if self.sign_out_timeout is not None:
+            config['SIGN_OUT_TIMEOUT'] = self.sign_out_timeout
+        return config
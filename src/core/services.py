@@ -0,0 +1,316 @@
+"""Registry of the services allowed to use CAS.
+
+Services are configured in ``MAMA_CAS_SERVICES``, in the JSON file given
+in ``CAS_SERVICES_FILE`` and in the database (``core.models.Service``),
+and matched in this order: like in mama_cas, the first service whose
+``SERVICE`` pattern matches the service URL is used.
+
+Instead of trying every pattern in turn, the patterns are compiled into a
+single regular expression per host. Patterns anchored to a literal host,
+e.g. ``^https://example\\.org/``, are only tried for service URLs of this
+host, and recently matched service URLs are cached.
+
+Every worker reloads the registry when the services in the database were
+changed (see ``reload``) or the file was modified, checking at most every
+``CAS_SERVICES_RELOAD_INTERVAL`` seconds.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'cas:services:version'
+
+# defaults of mama_cas.services.backends.ServiceConfig
+DEFAULTS = {
+    'CALLBACKS': [],
+    'LOGOUT_ALLOW': False,
+    'LOGOUT_URL': None,
+    'PROXY_ALLOW': False,
+}
+
+# the host of a service URL, which ends where a pattern anchored to the
+# host has to continue (see _PATTERN_HOST)
+_URL_HOST = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://([^/:?#]*)')
+# a pattern starting with a literal host, followed by a port, a path or
+# the end of the URL
+_PATTERN_HOST = re.compile(
+    r'\^?(?:https?|https\?|http\[s\]\?)://((?:[A-Za-z0-9-]|\\\.)+)'
+    r'(?=/|\\/|:|\$|\(/\|\$\)|\(\?:/\|\$\))'
+)
+
+
+def _pattern_host(pattern):
+    """Return the host all URLs matched by the pattern have, if any."""
+    match = _PATTERN_HOST.match(pattern)
+    if match is None or _has_alternation(pattern):
+        return None
+    return match.group(1).replace('\\', '')
+
+
+def _has_alternation(pattern):
+    """Whether the pattern has a ``|`` outside of groups."""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 1
+        elif char == '[':
+            # skip the character set, a leading ] is part of the set
+            i += 2 if pattern[i + 1 : i + 2] == '^' else 1
+            if pattern[i : i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def _compile(services):
+    """Compile the patterns of the services into a single expression.
+
+    :return: Function returning the first matching service of a URL
+    """
+    if not services:
+        return lambda url: None
+
+    # numbered backreferences would refer to the wrong groups
+    if not any(re.search(r'\\[1-9]', service['SERVICE']) for service in services):
+        try:
+            combined = re.compile(
+                '|'.join(
+                    f'(?P<_s{i}>{service["SERVICE"]})'
+                    for i, service in enumerate(services)
+                )
+            )
+        except re.error:
+            # e.g. global flags or group names used by several patterns
+            pass
+        else:
+            groups = {f'_s{i}': service for i, service in enumerate(services)}
+
+            def match(url):
+                result = combined.match(url)
+                return groups[result.lastgroup] if result else None
+
+            return match
+
+    def match(url):
+        for service in services:
+            if service['MATCH'].match(url):
+                return service
+        return None
+
+    return match
+
+
+class Registry:
+    """Immutable set of services, replaced as a whole on reload."""
+
+    def __init__(self, services, cache_size):
+        self.services = services
+        by_host = {}
+        anywhere = []
+        for position, service in enumerate(services):
+            host = service.get('HOST') or _pattern_host(service['SERVICE'])
+            if host is None:
+                anywhere.append(position)
+            else:
+                by_host.setdefault(host, []).append(position)
+
+        # services of other hosts must be tried as well, in their order
+        self.hosts = {
+            host: _compile([services[i] for i in sorted(positions + anywhere)])
+            for host, positions in by_host.items()
+        }
+        self.default = _compile([services[i] for i in anywhere])
+        self.get_service = lru_cache(maxsize=cache_size)(self._get_service)
+
+    def _get_service(self, url):
+        host = _URL_HOST.match(url)
+        match = self.hosts.get(host.group(1), self.default) if host else self.default
+        return match(url) or {}
+
+
+def _prepare(service, source):
+    service = service.copy()
+    try:
+        service['MATCH'] = re.compile(service['SERVICE'])
+    except KeyError:
+        raise ImproperlyConfigured(f'Missing SERVICE key for a service in {source}')
+    if 'PROXY_PATTERN' in service:
+        service['PROXY_PATTERN'] = re.compile(service['PROXY_PATTERN'])
+    if service.get('ATTRIBUTES'):
+        from .utils import ATTRIBUTES
+
+        unknown = [name for name in service['ATTRIBUTES'] if name not in ATTRIBUTES]
+        if unknown:
+            raise ImproperlyConfigured(
+                f'Unknown ATTRIBUTES {unknown} for the service '
+                f'{service["SERVICE"]} in {source}'
+            )
+    # for backwards compatibility mama_cas allows proxies by default
+    service.setdefault('PROXY_ALLOW', True)
+    for key, value in DEFAULTS.items():
+        service.setdefault(key, value)
+    return service
+
+
+def _load_file(path):
+    try:
+        with open(path) as f:
+            services = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error('Cannot load the services from %s: %s', path, e)
+        return []
+
+    prepared = []
+    for service in services:
+        try:
+            prepared.append(_prepare(service, path))
+        except (ImproperlyConfigured, re.error) as e:
+            logger.error('Ignoring service %r in %s: %s', service, path, e)
+    return prepared
+
+
+def _load_database():
+    from .models import Service
+
+    prepared = []
+    for service in Service.objects.filter(is_active=True):
+        try:
+            prepared.append(_prepare(service.as_config(), 'the database'))
+        except (ImproperlyConfigured, re.error) as e:
+            logger.error('Ignoring service %s: %s', service, e)
+    return prepared
+
+
+class ServiceRegistry:
+    """Loads the services and reloads them when they changed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registry = None
+        self.reset()
+
+    def reset(self):
+        """Reload the services at the next lookup."""
+        self.signature = None
+        self.next_check = 0
+
+    def get_signature(self):
+        path = settings.CAS_SERVICES_FILE
+        try:
+            mtime = os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            mtime = None
+        return cache.get(VERSION_KEY), mtime
+
+    def load(self, signature):
+        services = [
+            _prepare(service, 'MAMA_CAS_SERVICES')
+            for service in getattr(settings, 'MAMA_CAS_SERVICES', [])
+        ]
+        if settings.CAS_SERVICES_FILE:
+            services.extend(_load_file(settings.CAS_SERVICES_FILE))
+        services.extend(_load_database())
+
+        self.registry = Registry(services, settings.CAS_SERVICES_CACHE_SIZE)
+        self.signature = signature
+        logger.debug('Loaded %d services', len(services))
+
+    def get_registry(self):
+        now = time.monotonic()
+        if now >= self.next_check:
+            with self.lock:
+                if now >= self.next_check:
+                    signature = self.get_signature()
+                    if signature != self.signature:
+                        self.load(signature)
+                    self.next_check = now + settings.CAS_SERVICES_RELOAD_INTERVAL
+        return self.registry
+
+    async def aget_registry(self):
+        """Like ``get_registry``, but reloads the services in a thread, as
+        this queries the database."""
+        if time.monotonic() >= self.next_check:
+            return await sync_to_async(self.get_registry)()
+        return self.registry
+
+    def get_service(self, url):
+        """Return the configuration of the first service matching the URL,
+        or an empty dictionary."""
+        return self.get_registry().get_service(url)
+
+    def get_config(self, url, setting):
+        return self.get_service(url).get(setting, DEFAULTS.get(setting))
+
+    def is_valid(self, url):
+        # like mama_cas, all services are allowed if none are configured
+        registry = self.get_registry()
+        return not registry.services or bool(registry.get_service(url))
+
+
+services = ServiceRegistry()
+
+
+def reload():
+    """Make all workers reload the services at their next check."""
+    cache.set(VERSION_KEY, uuid4().hex, timeout=None)
+    services.reset()
+
+
+@receiver(setting_changed)
+def reset_services(setting, **kwargs):
+    if setting in (
+        'MAMA_CAS_SERVICES',
+        'CAS_SERVICES_FILE',
+        'CAS_SERVICES_CACHE_SIZE',
+    ):
+        services.reset()
+
+
+class RegistryBackend:
+    """Service backend of mama_cas using the service registry."""
+
+    def get_callbacks(self, service):
+        return services.get_config(service, 'CALLBACKS')
+
+    def get_logout_url(self, service):
+        return services.get_config(service, 'LOGOUT_URL')
+
+    def logout_allowed(self, service):
+        return services.get_config(service, 'LOGOUT_ALLOW')
+
+    def proxy_allowed(self, service):
+        return services.get_config(service, 'PROXY_ALLOW')
+
+    def proxy_callback_allowed(self, service, pgturl):
+        pattern = services.get_config(service, 'PROXY_PATTERN')
+        return bool(pattern and pattern.match(pgturl))
+
+    def service_allowed(self, service):
+        if not service:
+            return False
+        return services.is_valid(service)
@@ -0,0 +1,297 @@
+"""Tiered session store.
+
+Sessions are stored in Redis under the same keys as with Django's cache
+session store. Each worker additionally keeps up to
+``SESSION_LOCAL_CACHE_SIZE`` recently loaded sessions in memory for
+``SESSION_LOCAL_CACHE_TIMEOUT`` seconds, so e.g. redirecting a logged in
+user to a service needs no Redis round trip.
+
+Every change of a session is published on a Redis channel, on which the
+workers drop their copy of the session. Copies are only served while the
+worker is subscribed, and a session loaded while a change was published
+is not kept, as it may be outdated already.
+
+With ``SESSION_PERSIST`` changed sessions are also written to the database
+by ``python manage.py flushsessions`` (write-behind), and sessions missing
+in Redis, e.g. after a restart of Redis, are loaded from there. Deleted
+sessions are deleted from the database immediately and leave a tombstone
+in Redis, which keeps a concurrent flush and loads from the database from
+bringing them back, so a logout cannot be undone by loading the session
+from the database.
+"""
+import logging
+import os
+import pickle  # nosec
+import threading
+import time
+from collections import OrderedDict
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from django.conf import settings
+from django.contrib.sessions.backends.cache import (
+    KEY_PREFIX,
+    SessionStore as CacheSessionStore,
+)
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousOperation
+from django.db import router, transaction
+from django.utils import timezone
+
+from .metrics import SESSION_LOCAL_CACHE
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'cas:sessions:changed'
+DIRTY_KEY = 'cas:sessions:dirty'
+
+
+def _client():
+    return get_redis_connection(settings.SESSION_CACHE_ALIAS)
+
+
+def _deleted_key(session_key):
+    return f'cas:sessions:deleted:{session_key}'
+
+
+class LocalSessions:
+    """Sessions recently loaded by this process, dropped when they are
+    changed by any process."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # number of changes received, see put
+        self.generation = 0
+        self.listener = None
+        self.listening = False
+
+    def get(self, session_key):
+        if not self.listening:
+            self.start()
+            return None
+        with self.lock:
+            entry = self.entries.get(session_key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= time.monotonic():
+                del self.entries[session_key]
+                return None
+            self.entries.move_to_end(session_key)
+        return pickle.loads(data)  # nosec
+
+    def put(self, session_key, session, generation):
+        """Keep the session, unless a change was received since
+        ``generation`` was read before loading it."""
+        data = pickle.dumps(session)
+        expires = time.monotonic() + settings.SESSION_LOCAL_CACHE_TIMEOUT
+        with self.lock:
+            if not self.listening or generation != self.generation:
+                return
+            self.entries[session_key] = (expires, data)
+            self.entries.move_to_end(session_key)
+            while len(self.entries) > settings.SESSION_LOCAL_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def discard(self, session_key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(session_key, None)
+
+    def start(self):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(
+                    target=self.listen, name='session-listener', daemon=True
+                )
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            pubsub = _client().pubsub()
+            try:
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self.listening = True
+                    elif message['type'] == 'message':
+                        self.discard(message['data'].decode())
+            except RedisError as e:
+                logger.warning('Session listener disconnected: %s', e)
+            finally:
+                # changes may be missed until subscribed again
+                with self.lock:
+                    self.listening = False
+                    self.generation += 1
+                    self.entries.clear()
+                pubsub.close()
+            time.sleep(1)
+
+
+local_sessions = LocalSessions()
+
+# the listener thread is not running in forked processes
+os.register_at_fork(after_in_child=local_sessions.reset)
+
+
+class SessionStore(CacheSessionStore):
+    """Cache session store with a local layer in every process and
+    optional persistence in the database."""
+
+    def load(self):
+        if not settings.SESSION_LOCAL_CACHE_SIZE:
+            return self._load()
+
+        session = local_sessions.get(self.session_key)
+        if session is not None:
+            SESSION_LOCAL_CACHE.labels('hit').inc()
+            return session
+        SESSION_LOCAL_CACHE.labels('miss').inc()
+
+        generation = local_sessions.generation
+        session = self._load()
+        if self.session_key is not None:
+            local_sessions.put(self.session_key, session, generation)
+        return session
+
+    def _load(self):
+        try:
+            session = self._cache.get(self.cache_key)
+        except Exception:
+            # see CacheSessionStore.load
+            session = None
+        if session is None and settings.SESSION_PERSIST:
+            session = self._load_persisted()
+        if session is None:
+            self._session_key = None
+            return {}
+        return session
+
+    def _load_persisted(self):
+        from django.contrib.sessions.models import Session
+
+        if _client().exists(_deleted_key(self.session_key)):
+            return None
+        try:
+            stored = Session.objects.get(
+                session_key=self.session_key, expire_date__gt=timezone.now()
+            )
+        except (Session.DoesNotExist, SuspiciousOperation):
+            return None
+        session = self.decode(stored.session_data)
+        self._cache.set(
+            self.cache_key, session, self.get_expiry_age(expiry=stored.expire_date)
+        )
+        return session
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        super().save(must_create)
+        # no process can have a copy of a new session
+        self._changed(self.session_key, publish=not must_create)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        if settings.SESSION_PERSIST:
+            # a flush which read the session before may still write it back
+            # to the database, so it is marked as changed as well, and the
+            # next flush deletes it again
+            with _client().pipeline(transaction=False) as pipe:
+                pipe.set(_deleted_key(session_key), 1, ex=settings.SESSION_COOKIE_AGE)
+                pipe.sadd(DIRTY_KEY, session_key)
+                pipe.execute()
+        super().delete(session_key)
+        if settings.SESSION_PERSIST:
+            from django.contrib.sessions.models import Session
+
+            Session.objects.filter(session_key=session_key).delete()
+        self._changed(session_key, persist=False)
+
+    def _changed(self, session_key, publish=True, persist=True):
+        publish = publish and settings.SESSION_LOCAL_CACHE_SIZE
+        persist = persist and settings.SESSION_PERSIST
+        if publish:
+            local_sessions.discard(session_key)
+        if publish or persist:
+            with _client().pipeline(transaction=False) as pipe:
+                if publish:
+                    pipe.publish(CHANNEL, session_key)
+                if persist:
+                    pipe.sadd(DIRTY_KEY, session_key)
+                pipe.execute()
+
+    @classmethod
+    def clear_expired(cls):
+        if settings.SESSION_PERSIST:
+            from django.contrib.sessions.models import Session
+
+            Session.objects.filter(expire_date__lt=timezone.now()).delete()
+
+
+def flush(batch_size=1000):
+    """Write the sessions changed since the last flush to the database.
+
+    Sessions which are no longer in Redis, as they expired or were
+    deleted, are deleted.
+    Concurrent flushes are serialized with a Redis lock.
+
+    :param batch_size: Number of sessions written per transaction
+    :return: Number of sessions written or deleted
+    """
+    from django.contrib.sessions.models import Session
+
+    redis = _client()
+    cache = caches[settings.SESSION_CACHE_ALIAS]
+    store = SessionStore()
+    count = 0
+
+    with redis.lock(f'{DIRTY_KEY}:lock', timeout=300, blocking_timeout=0):
+        while True:
+            session_keys = [key.decode() for key in redis.spop(DIRTY_KEY, batch_size)]
+            if not session_keys:
+                break
+
+            found = cache.get_many([KEY_PREFIX + key for key in session_keys])
+            deleted = redis.mget([_deleted_key(key) for key in session_keys])
+            sessions = []
+            expired = []
+            for session_key, tombstone in zip(session_keys, deleted):
+                session = found.get(KEY_PREFIX + session_key)
+                if session is None or tombstone is not None:
+                    expired.append(session_key)
+                    continue
+                sessions.append(
+                    Session(
+                        session_key=session_key,
+                        session_data=store.encode(session),
+                        expire_date=store.get_expiry_date(
+                            expiry=session.get('_session_expiry')
+                        ),
+                    )
+                )
+
+            try:
+                with transaction.atomic(using=router.db_for_write(Session)):
+                    Session.objects.bulk_create(
+                        sessions,
+                        update_conflicts=True,
+                        unique_fields=['session_key'],
+                        update_fields=['session_data', 'expire_date'],
+                    )
+                    Session.objects.filter(session_key__in=expired).delete()
+            except Exception:
+                # written with the next flush
+                redis.sadd(DIRTY_KEY, *session_keys)
+                raise
+            count += len(session_keys)
+
+    return count
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import services, sso
+from .models import Service
+from .utils import invalidate_attributes
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_user_attributes')
+def invalidate_user_attributes(sender, instance, update_fields=None, **kwargs):
+    # update_last_login on every login does not change any attribute
+    if update_fields and update_fields <= {'last_login'}:
+        return
+    invalidate_attributes(instance.pk)
+
+
+@receiver(post_save, sender=User, dispatch_uid='update_user_session_hash')
+def update_user_session_hash(sender, instance, **kwargs):
+    transaction.on_commit(lambda: sso.update_user(instance))
+
+
+@receiver(post_delete, sender=User, dispatch_uid='forget_user_session_hash')
+def forget_user_session_hash(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: sso.forget_user(pk))
+
+
+@receiver(
+    m2m_changed, sender=User.groups.through, dispatch_uid='invalidate_group_members'
+)
+def invalidate_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_attributes(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        invalidate_attributes(*pk_set)
+    elif action == 'pre_clear':
+        # the members are not known anymore after the group was cleared
+        invalidate_attributes(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group, dispatch_uid='invalidate_group_attributes')
+@receiver(pre_delete, sender=Group, dispatch_uid='invalidate_group_attributes')
+def invalidate_group_attributes(sender, instance, **kwargs):
+    invalidate_attributes(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Service, dispatch_uid='reload_services')
+@receiver(post_delete, sender=Service, dispatch_uid='reload_services')
+def reload_services(sender, instance, **kwargs):
+    transaction.on_commit(services.reload)
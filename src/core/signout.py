@@ -0,0 +1,197 @@
+"""Queue for single sign-out requests.
+
+At logout the SAML logout requests for all services of the user are
+rendered and pushed to a Redis list, so the logout response does not wait
+for the services. ``python manage.py signoutworker`` sends them
+concurrently, retrying failed requests with exponential backoff.
+
+A request is moved from the queue to a processing list while it is sent
+and only removed from there afterwards, so requests taken by a worker
+which dies are sent again when the worker is restarted.
+"""
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from django_redis import get_redis_connection
+from mama_cas.request import SingleSignOutRequest
+from mama_cas.services import get_logout_url, logout_allowed
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from .metrics import SIGN_OUT_DURATION, SIGN_OUT_REQUESTS
+from .services import services
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'cas:signout:queue'
+PROCESSING_KEY = 'cas:signout:processing'
+RETRY_KEY = 'cas:signout:retry'
+
+
+def _client():
+    return get_redis_connection('default')
+
+
+def _message(ticket):
+    url = get_logout_url(ticket.service) or ticket.service
+    return json.dumps(
+        {
+            'url': url,
+            'data': SingleSignOutRequest(context={'ticket': ticket})
+            .render_content()
+            .decode(),
+            'timeout': services.get_service(ticket.service).get(
+                'SIGN_OUT_TIMEOUT', settings.CAS_SIGN_OUT_TIMEOUT
+            ),
+            'attempts': 0,
+        }
+    )
+
+
+@SIGN_OUT_DURATION.time()
+def request_sign_out(tickets):
+    """Request the sign-out of the services of the given service tickets.
+
+    With ``CAS_SIGN_OUT_QUEUE`` the logout requests are queued, otherwise
+    they are sent right away.
+
+    :param tickets: Iterable of ServiceTicket instances
+    """
+    tickets = [ticket for ticket in tickets if logout_allowed(ticket.service)]
+    if not tickets:
+        return
+
+    if not settings.CAS_SIGN_OUT_QUEUE:
+        from mama_cas.compat import Session
+
+        session = Session()
+        for ticket in tickets:
+            try:
+                ticket.request_sign_out(session=session)
+            except Exception:
+                logger.exception(
+                    'Error sending the logout request for %s', ticket.service
+                )
+        return
+
+    _client().rpush(QUEUE_KEY, *[_message(ticket) for ticket in tickets])
+
+
+class SignOutWorker:
+    """Sends queued logout requests.
+
+    Requests are sent by ``concurrency`` threads over a shared session,
+    which keeps up to ``concurrency`` connections open per host.
+    """
+
+    def __init__(self, concurrency=None, retries=None, backoff=2):
+        self.concurrency = concurrency or settings.CAS_SIGN_OUT_CONCURRENCY
+        self.retries = settings.CAS_SIGN_OUT_RETRIES if retries is None else retries
+        self.backoff = backoff
+        self.redis = _client()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.concurrency, pool_maxsize=self.concurrency
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def recover(self):
+        """Requeue requests left in the processing list by a stopped
+        worker."""
+        count = 0
+        while self.redis.lmove(PROCESSING_KEY, QUEUE_KEY, 'RIGHT', 'LEFT'):
+            count += 1
+        return count
+
+    def schedule_retries(self):
+        """Move retries which are due back to the queue."""
+        due = self.redis.zrangebyscore(RETRY_KEY, 0, time.time())
+        if due:
+            with self.redis.pipeline() as pipe:
+                pipe.zrem(RETRY_KEY, *due)
+                pipe.rpush(QUEUE_KEY, *due)
+                pipe.execute()
+
+    def fetch(self, block_timeout=1):
+        """Move up to ``concurrency`` requests to the processing list."""
+        raw = self.redis.blmove(QUEUE_KEY, PROCESSING_KEY, block_timeout)
+        if raw is None:
+            return []
+        batch = [raw]
+        while len(batch) < self.concurrency:
+            raw = self.redis.lmove(QUEUE_KEY, PROCESSING_KEY)
+            if raw is None:
+                break
+            batch.append(raw)
+        return batch
+
+    def send(self, raw):
+        message = json.loads(raw)
+        try:
+            response = self.session.post(
+                message['url'],
+                data={'logoutRequest': message['data']},
+                timeout=message['timeout'],
+            )
+            # services answering with a client error will not accept a retry
+            if response.status_code >= 500:
+                raise requests.HTTPError(response.status_code)
+        except requests.RequestException as e:
+            message['attempts'] += 1
+            host = urlparse(message['url']).netloc
+            if message['attempts'] > self.retries:
+                SIGN_OUT_REQUESTS.labels('failed').inc()
+                logger.error(
+                    'Giving up the logout request for %s after %d attempts: %s',
+                    host,
+                    message['attempts'],
+                    e,
+                )
+                return False
+            delay = self.backoff ** message['attempts'] * random.uniform(0.5, 1.5)
+            logger.warning(
+                'Logout request for %s failed (%s), retrying in %.0f seconds',
+                host,
+                e,
+                delay,
+            )
+            self.redis.zadd(RETRY_KEY, {json.dumps(message): time.time() + delay})
+            SIGN_OUT_REQUESTS.labels('retry').inc()
+            return False
+
+        SIGN_OUT_REQUESTS.labels('sent').inc()
+        logger.info('Single sign-out request sent to %s', message['url'])
+        return True
+
+    def process(self, batch):
+        results = list(self.executor.map(self.send, batch))
+        with self.redis.pipeline(transaction=False) as pipe:
+            for raw in batch:
+                pipe.lrem(PROCESSING_KEY, 1, raw)
+            pipe.execute()
+        return results
+
+    def run(self, once=False):
+        """Send queued requests until stopped, or until the queue is empty
+        if ``once`` is set.
+
+        :return: Number of requests sent successfully
+        """
+        self.recover()
+        sent = 0
+        while True:
+            self.schedule_retries()
+            batch = self.fetch(block_timeout=0.1 if once else 1)
+            if not batch:
+                if once:
+                    return sent
+                continue
+            sent += sum(self.process(batch))
@@ -0,0 +1,117 @@
+"""Fast path of the single sign-on.
+
+Most requests of the login view come from users who are already logged in
+and only need a new service ticket for the next service. The
+``SingleSignOnMiddleware`` issues the ticket and redirects these users
+right after the session was loaded, so the other middlewares, the
+database query for the user and the login view are skipped.
+
+Instead of loading the user, the session hash of the user (see
+``django.contrib.auth.get_user``) is compared with the one remembered in
+Redis when the user logged in or was changed. Inactive and deleted users
+have no session hash, so they always take the login view.
+"""
+from mama_cas.services import service_allowed
+from mama_cas.utils import add_query_params, to_bool
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    get_user_model,
+)
+from django.core.cache import cache
+from django.http import HttpResponseRedirect
+from django.urls import Resolver404, resolve
+from django.utils.cache import add_never_cache_headers
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .tickets import get_ticket_backend
+
+
+def _user_key(user_pk):
+    # remembered hashes do not match anymore when the secret key changes
+    secret = salted_hmac(__name__, 'user', algorithm='sha256').hexdigest()[:8]
+    return f'cas:sso:user:{secret}:{user_pk}'
+
+
+def remember_user(user):
+    """Remember the session hash of a user who logged in, unless the user
+    was changed since (see ``update_user``)."""
+    cache.add(
+        _user_key(user.pk),
+        user.get_session_auth_hash(),
+        timeout=settings.SESSION_COOKIE_AGE,
+    )
+
+
+def update_user(user):
+    """Remember the session hash of a changed user, e.g. after a password
+    change, or none if the user is inactive."""
+    cache.set(
+        _user_key(user.pk),
+        user.get_session_auth_hash() if user.is_active else '',
+        timeout=settings.SESSION_COOKIE_AGE,
+    )
+
+
+def forget_user(user_pk):
+    cache.set(_user_key(user_pk), '', timeout=settings.SESSION_COOKIE_AGE)
+
+
+class SingleSignOnMiddleware:
+    """Redirects logged in users to the service with a new service ticket.
+
+    Only GET requests of the login view with a ``service`` and without
+    ``renew`` are handled, for users who do not want to be warned before
+    being redirected. It has to be placed right after the
+    ``SessionMiddleware``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.redirect(request) or self.get_response(request)
+
+    def redirect(self, request):
+        service = request.GET.get('service')
+        if request.method != 'GET' or not service or to_bool(request.GET.get('renew')):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name != 'cas_login':
+            return None
+
+        session = request.session
+        user_pk = session.get(SESSION_KEY)
+        if (
+            user_pk is None
+            or session.get('warn')
+            or session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS
+        ):
+            return None
+        session_hash = session.get(HASH_SESSION_KEY)
+        user_hash = cache.get(_user_key(user_pk))
+        if not (
+            session_hash
+            and user_hash
+            and constant_time_compare(session_hash, user_hash)
+        ):
+            return None
+        # invalid services are rejected by the login view
+        if not service_allowed(service):
+            return None
+
+        request.resolver_match = match
+        user_model = get_user_model()
+        user = user_model(pk=user_model._meta.pk.to_python(user_pk))
+        st = get_ticket_backend().create_service_ticket(service, user)
+        response = HttpResponseRedirect(
+            add_query_params(service, {'ticket': st.ticket})
+        )
+        add_never_cache_headers(response)
+        return response
@@ -0,0 +1,1243 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import ldap
+import requests
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from axes.models import AccessFailureLog, AccessLog
+from axes.utils import reset
+from captcha.models import CaptchaStore
+from django_auth_ldap.config import (
+    LDAPSearch,
+    LDAPSearchUnion as BaseLDAPSearchUnion,
+    _LDAPConfig,
+)
+from django_redis import get_redis_connection
+from ldap.controls import SimplePagedResultsControl
+from mama_cas.exceptions import InvalidProxyCallback
+from mama_cas.models import ProxyGrantingTicket, ProxyTicket, ServiceTicket
+from mama_cas.services import proxy_allowed, service_allowed
+from redis.asyncio import BlockingConnectionPool, UnixDomainSocketConnection
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, update_last_login
+from django.contrib.sessions.backends.cache import KEY_PREFIX
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from benchmarks.ldap_stub import DIRECTORY, StubLDAPObject
+
+from .asgi import ValidationHandler
+from .callbacks import VERIFIED_KEY, ProxyCallbackClient
+from .captchas import POOL_KEY, fill
+from .expiry import TicketSweeper
+from .hashers import run_hashing
+from .ldap import LDAPBackend, LDAPConnectionPool, get_pool
+from .ldap_config import LDAPSearchUnion
+from .ldap_sync import WATERMARK_KEY, LDAPSync
+from .lockout import AUDIT_KEY, flush_audit
+from .models import Service
+from .services import _pattern_host, services
+from .sessions import CHANNEL, DIRTY_KEY, SessionStore, flush, local_sessions
+from .signout import PROCESSING_KEY, QUEUE_KEY, RETRY_KEY, SignOutWorker
+from .sso import _user_key
+from .tickets import RedisTicketBackend, get_ticket_backend
+from .utils import get_attributes
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@override_settings(
+    MAMA_CAS_SERVICES=[
+        {'SERVICE': r'^https://example\.org/', 'ATTRIBUTES': ['first_name', 'groups']}
+    ]
+)
+class AttributesTestCase(TestCase):
+    service = 'https://example.org/service/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('user', first_name='Ada')
+        # cached under the new version
+        get_attributes(self.user, self.service)
+
+    def test_login_keeps_cache(self):
+        update_last_login(None, self.user)
+
+        with self.assertNumQueries(0):
+            attributes = get_attributes(self.user, self.service)
+        self.assertEqual(attributes, {'first_name': 'Ada', 'groups': []})
+
+    def test_change_invalidates_cache(self):
+        self.user.first_name = 'Grace'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(get_attributes(self.user, self.service)['first_name'], 'Grace')
+
+    def test_invalidated_on_commit(self):
+        group = Group.objects.create(name='staff')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+            # a concurrent request caching the old rows would keep them
+            # cached under the next version
+            with self.assertNumQueries(0):
+                get_attributes(self.user, self.service)
+
+        self.assertEqual(get_attributes(self.user, self.service)['groups'], ['staff'])
+
+
+class CountingLDAPObject(StubLDAPObject):
+    """Stub LDAP connection recording the connections and their use."""
+
+    created = []
+
+    def __init__(self, uri, *args, **kwargs):
+        super().__init__(uri, *args, **kwargs)
+        self.binds = []
+        self.health_checks = 0
+        self.healthy = True
+        self.closed = False
+        self.created.append(self)
+
+    def simple_bind_s(self, who=None, cred=None, *args, **kwargs):
+        self.binds.append(who)
+        return super().simple_bind_s(who, cred, *args, **kwargs)
+
+    def whoami_s(self):
+        self.health_checks += 1
+        if not self.healthy:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return super().whoami_s()
+
+    def unbind_s(self):
+        self.closed = True
+        super().unbind_s()
+
+
+LDAP_SETTINGS = {
+    'AUTH_LDAP_SERVER_URI': 'ldap://ldap.example.org',
+    'AUTH_LDAP_BIND_DN': 'cn=baseauth,dc=example,dc=org',
+    'AUTH_LDAP_BIND_PASSWORD': 'password',
+    'AUTH_LDAP_USER_SEARCH': LDAPSearch(
+        'ou=people,dc=example,dc=org', ldap.SCOPE_SUBTREE, '(uid=%(user)s)'
+    ),
+    'AUTH_LDAP_ALWAYS_UPDATE_USER': False,
+    'AUTH_LDAP_UPDATE_USER_ON_LOGIN': True,
+    'AUTH_LDAP_CACHE_TIMEOUT': 0,
+    'AUTH_LDAP_POOL_SIZE': 2,
+    'AUTH_LDAP_POOL_IDLE_TIMEOUT': 300,
+    'AUTH_LDAP_POOL_HEALTH_CHECK_INTERVAL': 30,
+}
+
+
+@override_settings(**LDAP_SETTINGS)
+class LDAPPoolTestCase(TestCase):
+    service_dn = 'cn=baseauth,dc=example,dc=org'
+    user_dn = 'uid=ldapuser,ou=people,dc=example,dc=org'
+
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(
+                LDAPConnectionPool, 'connection_class', CountingLDAPObject
+            ),
+            # pools of other tests
+            mock.patch.dict('core.ldap._pools', clear=True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        CountingLDAPObject.created = []
+        self.backend = LDAPBackend()
+
+    def authenticate(self, password='password', request=None):
+        return self.backend.authenticate(request, 'ldapuser', password)
+
+    def age_idle_connections(self, seconds):
+        for pooled in get_pool(self.backend)._idle:
+            pooled.last_used -= seconds
+
+    def test_reuse(self):
+        user = self.authenticate()
+        self.assertEqual(user.username, 'ldapuser')
+        self.assertEqual(len(CountingLDAPObject.created), 2)
+        service, authentication = CountingLDAPObject.created
+        self.assertEqual(service.binds, [self.service_dn])
+        # bound with the service account again before it is returned
+        self.assertEqual(authentication.binds, [self.user_dn, self.service_dn])
+
+        # the connection bound with the service account is searched right away
+        self.assertIsNotNone(self.authenticate())
+        self.assertEqual(len(CountingLDAPObject.created), 2)
+        self.assertEqual(service.binds, [self.service_dn])
+        self.assertEqual(authentication.binds, [self.user_dn, self.service_dn] * 2)
+
+    def test_user_bind_not_kept(self):
+        self.authenticate()
+        self.assertIsNone(self.authenticate('wrong'))
+        self.assertEqual(
+            [pooled.connection.bound_dn for pooled in get_pool(self.backend)._idle],
+            [self.service_dn] * 2,
+        )
+
+        # a connection which cannot be bound with the service account is closed
+        authentication = CountingLDAPObject.created[1]
+        with mock.patch.object(
+            authentication,
+            'simple_bind_s',
+            side_effect=[None, ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})],
+        ):
+            with self.assertLogs('core.ldap', 'WARNING'):
+                self.assertIsNotNone(self.authenticate())
+        self.assertTrue(authentication.closed)
+        self.assertEqual(len(get_pool(self.backend)._idle), 1)
+
+    def test_connection_cleared_after_return(self):
+        ldap_user = self.authenticate().ldap_user
+
+        self.assertIsNone(ldap_user._connection)
+        self.assertFalse(ldap_user._connection_bound)
+
+    def test_invalid_credentials_keep_connection(self):
+        self.authenticate()
+
+        self.assertIsNone(self.authenticate('wrong'))
+        self.assertEqual(len(get_pool(self.backend)._idle), 2)
+        self.assertFalse(any(c.closed for c in CountingLDAPObject.created))
+
+        self.assertIsNotNone(self.authenticate())
+        self.assertEqual(len(CountingLDAPObject.created), 2)
+
+    def test_idle_expiry(self):
+        self.authenticate()
+        self.age_idle_connections(301)
+
+        self.assertIsNotNone(self.authenticate())
+        self.assertEqual(len(CountingLDAPObject.created), 4)
+        self.assertTrue(all(c.closed for c in CountingLDAPObject.created[:2]))
+        # expired connections are not checked, but closed right away
+        self.assertEqual(sum(c.health_checks for c in CountingLDAPObject.created), 0)
+
+    def test_health_check(self):
+        self.authenticate()
+        service, authentication = CountingLDAPObject.created
+        authentication.healthy = False
+        self.age_idle_connections(31)
+
+        self.assertIsNotNone(self.authenticate())
+        self.assertEqual(service.health_checks, 1)
+        self.assertFalse(service.closed)
+        self.assertTrue(authentication.closed)
+        self.assertEqual(len(CountingLDAPObject.created), 3)
+
+    def test_callable_server_uri(self):
+        request = RequestFactory().get('/login/')
+        server_uri = mock.Mock(return_value='ldap://ldap2.example.org')
+
+        with self.settings(AUTH_LDAP_SERVER_URI=server_uri):
+            self.backend = LDAPBackend()
+            self.assertIsNotNone(self.authenticate(request=request))
+
+        server_uri.assert_called_with(request)
+        self.assertEqual(
+            {c.uri for c in CountingLDAPObject.created}, {'ldap://ldap2.example.org'}
+        )
+
+    def test_global_options(self):
+        with self.settings(AUTH_LDAP_GLOBAL_OPTIONS={ldap.OPT_REFERRALS: 0}):
+            with mock.patch.object(_LDAPConfig, '_ldap_configured', False), mock.patch(
+                'ldap.set_option'
+            ) as set_option:
+                self.backend = LDAPBackend()
+                self.authenticate()
+
+        set_option.assert_called_once_with(ldap.OPT_REFERRALS, 0)
+
+
+@override_settings(
+    **LDAP_SETTINGS,
+    AUTH_LDAP_USER_ATTR_MAP={'first_name': 'givenName', 'email': 'mail'},
+    AUTHENTICATION_BACKENDS=['core.ldap.LDAPBackend'],
+)
+class LDAPBackendTestCase(TestCase):
+    user_dn = 'uid=ldapuser,ou=people,dc=example,dc=org'
+
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(
+                LDAPConnectionPool, 'connection_class', CountingLDAPObject
+            ),
+            mock.patch.dict('core.ldap._pools', clear=True),
+            mock.patch.dict('benchmarks.ldap_stub.DIRECTORY'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        # created on the first login
+        self.user = self.authenticate()
+
+    def authenticate(self, password='password'):
+        # like django.contrib.auth, with a new backend, which reads the settings
+        return LDAPBackend().authenticate(None, 'ldapuser', password)
+
+    def change_directory(self, **attrs):
+        password, entry = DIRECTORY[self.user_dn]
+        DIRECTORY[self.user_dn] = (password, {**entry, **attrs})
+
+    def test_update_changed_fields(self):
+        self.assertEqual(self.user.first_name, 'LDAP')
+
+        with mock.patch.object(get_user_model(), 'save', autospec=True) as save:
+            self.authenticate()
+            save.assert_not_called()
+
+            self.change_directory(givenName=[b'Changed'])
+            user = self.authenticate()
+            save.assert_called_once_with(user, update_fields=['first_name'])
+        self.assertEqual(user.first_name, 'Changed')
+
+    @override_settings(AUTH_LDAP_CACHE_TIMEOUT=300)
+    def test_cache(self):
+        with mock.patch.object(
+            CountingLDAPObject,
+            'search_s',
+            autospec=True,
+            side_effect=StubLDAPObject.search_s,
+        ) as search_s:
+            self.authenticate()
+            self.authenticate()
+            self.assertEqual(search_s.call_count, 1)
+
+            # only the bind as the user, which checks the password
+            self.change_directory(givenName=[b'Changed'])
+            self.assertIsNone(self.authenticate('wrong'))
+            user = self.authenticate()
+            self.assertEqual(search_s.call_count, 1)
+            self.assertEqual(user.first_name, 'LDAP')
+
+        with self.settings(AUTH_LDAP_CACHE_TIMEOUT=0):
+            user = self.authenticate()
+        self.assertEqual(user.first_name, 'Changed')
+
+    @override_settings(AUTH_LDAP_CACHE_TIMEOUT=300)
+    def test_refresh_command(self):
+        self.authenticate()
+        self.change_directory(givenName=[b'Changed'])
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command(
+            'refreshldapuser', 'ldapuser', 'nobody', stdout=stdout, stderr=stderr
+        )
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Changed')
+        self.assertEqual(stdout.getvalue(), 'ldapuser: refreshed\n')
+        self.assertEqual(stderr.getvalue(), 'nobody: not found in the directory\n')
+        # the next login uses the refreshed cache
+        user = self.authenticate()
+        self.assertEqual(user.first_name, 'Changed')
+
+
+class UnionLDAPObject(StubLDAPObject):
+    """Stub LDAP connection answering searches in the order of their search
+    bases in ``order``, with an error for the bases in ``missing``."""
+
+    def __init__(self, order=(), missing=()):
+        super().__init__('ldap://ldap.example.org')
+        self.order = list(order)
+        self.missing = missing
+        self.bases = {}
+        self.abandoned = []
+
+    def search(self, base, *args):
+        msgid = super().search(base, *args)
+        self.bases[msgid] = base
+        return msgid
+
+    def result2(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        msgid = min(
+            self._results,
+            key=lambda msgid: (
+                self.order.index(self.bases[msgid])
+                if self.bases[msgid] in self.order
+                else len(self.order),
+                msgid,
+            ),
+        )
+        if self.bases[msgid] in self.missing:
+            del self._results[msgid]
+            raise ldap.NO_SUCH_OBJECT({'msgid': msgid, 'desc': 'No such object'})
+        return super().result2(msgid, all, timeout)
+
+    def abandon(self, msgid):
+        self.abandoned.append(self.bases[msgid])
+        super().abandon(msgid)
+
+
+@mock.patch.dict(
+    'benchmarks.ldap_stub.DIRECTORY',
+    {
+        'uid=alice,ou=staff,dc=example,dc=org': ('password', {'uid': [b'alice']}),
+        'uid=bob,ou=people,dc=example,dc=org': ('password', {'uid': [b'bob']}),
+        'uid=bob,ou=staff,dc=example,dc=org': ('password', {'uid': [b'bob']}),
+    },
+    clear=True,
+)
+class LDAPSearchUnionTestCase(TestCase):
+    people = 'ou=people,dc=example,dc=org'
+    staff = 'ou=staff,dc=example,dc=org'
+    guests = 'ou=guests,dc=example,dc=org'
+
+    def search(self, username, connection, union_class=LDAPSearchUnion, **kwargs):
+        union = union_class(
+            *[
+                LDAPSearch(base, ldap.SCOPE_SUBTREE, '(uid=%(user)s)')
+                for base in (self.people, self.staff, self.guests)
+            ],
+            **kwargs,
+        )
+        return [dn for dn, _attrs in union.execute(connection, {'user': username})]
+
+    def test_first_hit(self):
+        connection = UnionLDAPObject()
+
+        self.assertEqual(
+            self.search('alice', connection), ['uid=alice,ou=staff,dc=example,dc=org']
+        )
+        self.assertEqual(connection.abandoned, [self.guests])
+
+    def test_no_hit(self):
+        connection = UnionLDAPObject()
+
+        self.assertEqual(self.search('carol', connection), [])
+        self.assertEqual(connection.abandoned, [])
+
+    def test_search_error(self):
+        with self.assertLogs('core.ldap_config', 'ERROR'):
+            self.assertEqual(
+                self.search('alice', UnionLDAPObject(missing=[self.people])),
+                ['uid=alice,ou=staff,dc=example,dc=org'],
+            )
+        with self.assertLogs('core.ldap_config', 'ERROR'):
+            self.assertEqual(
+                self.search('carol', UnionLDAPObject(missing=[self.staff])), []
+            )
+
+    def test_user_in_several_bases(self):
+        # rejected as ambiguous by django_auth_ldap's union
+        self.assertEqual(
+            len(self.search('bob', UnionLDAPObject(), BaseLDAPSearchUnion)), 2
+        )
+
+        # found in the first configured base, whichever base answers first
+        for order in [(), (self.staff,), (self.guests, self.staff)]:
+            with self.subTest(order=order):
+                connection = UnionLDAPObject(order=order)
+
+                self.assertEqual(
+                    self.search('bob', connection),
+                    ['uid=bob,ou=people,dc=example,dc=org'],
+                )
+
+    def test_remember_base(self):
+        for username in ['alice', 'bob']:
+            cache.delete(LDAPSearchUnion()._remember_key(username))
+        self.search('alice', UnionLDAPObject(), remember_base=True)
+
+        # the bases after the remembered one are not searched
+        connection = UnionLDAPObject()
+        self.assertEqual(
+            self.search('alice', connection, remember_base=True),
+            ['uid=alice,ou=staff,dc=example,dc=org'],
+        )
+        self.assertEqual(set(connection.bases.values()), {self.people, self.staff})
+
+        # the bases before the remembered one take precedence
+        cache.set(LDAPSearchUnion()._remember_key('bob'), self.staff)
+        self.assertEqual(
+            self.search('bob', UnionLDAPObject(order=[self.staff]), remember_base=True),
+            ['uid=bob,ou=people,dc=example,dc=org'],
+        )
+
+        # the remaining bases are searched if the user moved
+        cache.set(LDAPSearchUnion()._remember_key('alice'), self.people)
+        self.assertEqual(
+            self.search('alice', UnionLDAPObject(), remember_base=True),
+            ['uid=alice,ou=staff,dc=example,dc=org'],
+        )
+        self.assertEqual(
+            cache.get(LDAPSearchUnion()._remember_key('alice')), self.staff
+        )
+
+    def test_search_with_additional_terms(self):
+        union = LDAPSearchUnion(
+            LDAPSearch(self.people, ldap.SCOPE_SUBTREE, '(uid=%(user)s)'),
+            remember_base=True,
+        )
+
+        for search in [
+            union.search_with_additional_terms({'objectClass': 'person'}),
+            union.search_with_additional_term_string('(objectClass=person)'),
+        ]:
+            self.assertIsInstance(search, LDAPSearchUnion)
+            self.assertTrue(search.remember_base)
+
+
+class LockoutTestCase(TestCase):
+    password = 'correct horse battery staple'
+
+    def setUp(self):
+        reset()
+        get_redis_connection().delete(AUDIT_KEY)
+        get_user_model().objects.create_user('user', password=self.password)
+
+    def login(self, password):
+        return self.client.post('/login/', {'username': 'user', 'password': password})
+
+    def test_lockout_without_queries(self):
+        # only the user lookups of the failed password checks
+        with self.assertNumQueries(3):
+            for _i in range(3):
+                self.login('wrong')
+            response = self.login(self.password)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/locked/', response['Location'])
+
+    def test_reset_ip(self):
+        for _i in range(3):
+            self.login('wrong')
+
+        self.assertEqual(reset(ip='127.0.0.1'), 1)
+
+        response = self.login(self.password)
+        self.assertNotIn('/locked/', response['Location'])
+
+    def test_flush_audit(self):
+        self.login('wrong')
+        self.login(self.password)
+        self.client.get('/logout/')
+
+        self.assertEqual(flush_audit(), 3)
+        self.assertEqual(flush_audit(), 0)
+        self.assertEqual(AccessFailureLog.objects.get().username, 'user')
+        self.assertIsNotNone(AccessLog.objects.get(username='user').logout_time)
+
+
+@mock.patch('captcha.conf.settings.CAPTCHA_FLITE_PATH', None)
+class CaptchaPoolTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection().delete(POOL_KEY)
+
+    def show_captcha(self):
+        response = self.client.get('/locked/')
+        return re.search(r'name="captcha_0" value="(\w+)"', response.content.decode())[
+            1
+        ]
+
+    def test_pool(self):
+        self.assertEqual(fill(2), 2)
+        self.assertEqual(fill(2), 0)
+        self.assertEqual(CaptchaStore.objects.count(), 0)
+
+        key = self.show_captcha()
+        self.assertEqual(get_redis_connection().llen(POOL_KEY), 1)
+
+        with mock.patch('captcha.views.captcha_image') as captcha_image:
+            response = self.client.get(f'/captcha/image/{key}/')
+        captcha_image.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        store = CaptchaStore.objects.get(hashkey=key)
+        response = self.client.post(
+            '/locked/', {'captcha_0': key, 'captcha_1': store.response}
+        )
+        self.assertRedirects(
+            response, reverse('cas_login'), fetch_redirect_response=False
+        )
+
+    def test_empty_pool(self):
+        key = self.show_captcha()
+
+        self.assertTrue(CaptchaStore.objects.filter(hashkey=key).exists())
+        response = self.client.get(f'/captcha/image/{key}/')
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'],
+    MAMA_CAS_SERVICES=[{'SERVICE': r'^https://example\.org/', 'LOGOUT_ALLOW': True}],
+    CAS_SIGN_OUT_QUEUE=True,
+)
+class SignOutTestCase(TestCase):
+    service = 'https://example.org/service/'
+
+    def setUp(self):
+        get_redis_connection().delete(QUEUE_KEY, PROCESSING_KEY, RETRY_KEY)
+        user = get_user_model().objects.create_user('user', password='password')
+        self.client.force_login(user)
+        self.client.get(f'/login/?service={self.service}')
+
+    def test_logout_queues_request(self):
+        with mock.patch('requests.Session.post') as post:
+            self.client.get('/logout/')
+        post.assert_not_called()
+
+        with mock.patch('requests.Session.post') as post:
+            post.return_value.status_code = 200
+            self.assertEqual(SignOutWorker().run(once=True), 1)
+        self.assertEqual(post.call_args.args, (self.service,))
+        self.assertIn('logoutRequest', post.call_args.kwargs['data'])
+
+    def test_failed_request_is_retried(self):
+        self.client.get('/logout/')
+
+        with mock.patch('requests.Session.post') as post:
+            post.side_effect = requests.ConnectionError
+            self.assertEqual(SignOutWorker().run(once=True), 0)
+
+        redis = get_redis_connection()
+        self.assertEqual(redis.llen(PROCESSING_KEY), 0)
+        self.assertEqual(redis.zcard(RETRY_KEY), 1)
+
+
+class MetricsTestCase(TestCase):
+    @override_settings(METRICS_TOKEN='token')
+    def test_metrics(self):
+        self.client.get('/login/')
+
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer token')
+        self.assertContains(
+            response,
+            'baseauth_request_duration_seconds_count{method="GET",status="200",'
+            'view="cas_login"}',
+        )
+
+
+@override_settings(
+    MAMA_CAS_SERVICES=[
+        {
+            'SERVICE': r'^https://example\.org/',
+            'PROXY_ALLOW': True,
+            'PROXY_PATTERN': r'^https://proxy\.example\.org/',
+        }
+    ],
+)
+class ProxyCallbackTestCase(TestCase):
+    service = 'https://example.org/service/'
+    pgturl = 'https://proxy.example.org/callback'
+
+    def setUp(self):
+        cache.delete(VERIFIED_KEY.format('proxy.example.org'))
+        self.client = ProxyCallbackClient(concurrency=2)
+
+    def test_verified_host(self):
+        with mock.patch('requests.Session.get') as get:
+            get.return_value.status_code = 200
+            self.client.validate_callback(self.service, self.pgturl, 'PGT-1', 'IOU-1')
+            self.assertEqual(get.call_count, 2)
+
+            self.client.validate_callback(self.service, self.pgturl, 'PGT-2', 'IOU-2')
+            self.assertEqual(get.call_count, 3)
+        self.assertIn('pgtId=PGT-2', get.call_args.args[0])
+
+    def test_invalid_callback(self):
+        with self.assertRaises(InvalidProxyCallback):
+            self.client.validate_callback(
+                self.service, 'https://example.org/callback', 'PGT-1', 'IOU-1'
+            )
+
+        with mock.patch('requests.Session.get') as get:
+            get.side_effect = requests.exceptions.SSLError
+            with self.assertRaises(InvalidProxyCallback):
+                self.client.validate_callback(
+                    self.service, self.pgturl, 'PGT-1', 'IOU-1'
+                )
+        self.assertIsNone(cache.get(VERIFIED_KEY.format('proxy.example.org')))
+
+
+@override_settings(
+    MAMA_CAS_SERVICES=[
+        {'SERVICE': r'^https://example\.org/admin/', 'PROXY_ALLOW': False},
+        {'SERVICE': r'^https?://example\.org/'},
+        {'SERVICE': r'^https://[a-z]+\.example\.com/', 'ATTRIBUTES': ['email']},
+    ],
+)
+class ServiceRegistryTestCase(TestCase):
+    def test_pattern_host(self):
+        self.assertEqual(_pattern_host(r'^https://example\.org/'), 'example.org')
+        self.assertEqual(_pattern_host(r'^http[s]?://example\.org(/|$)'), 'example.org')
+        self.assertEqual(_pattern_host(r'https?://example\.org:8443'), 'example.org')
+        # patterns which also match other hosts
+        self.assertIsNone(_pattern_host(r'^https://example\.org'))
+        self.assertIsNone(_pattern_host(r'^https://example\.org.*'))
+        self.assertIsNone(_pattern_host(r'^https://example\.org/|^https://evil/'))
+        self.assertIsNone(_pattern_host(r'^https://[a-z]+\.example\.org/'))
+
+    def test_first_match(self):
+        self.assertFalse(
+            services.get_service('https://example.org/admin/')['PROXY_ALLOW']
+        )
+        self.assertTrue(services.get_service('http://example.org/app/')['PROXY_ALLOW'])
+        self.assertEqual(
+            services.get_service('https://www.example.com/')['ATTRIBUTES'], ['email']
+        )
+        self.assertFalse(service_allowed('https://example.org.evil.com/'))
+        self.assertFalse(proxy_allowed('https://example.org/admin/'))
+
+    def test_database_service(self):
+        self.assertFalse(service_allowed('https://service.example.net/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(
+                name='Service', service=r'^https://service\.example\.net/'
+            )
+        self.assertTrue(service_allowed('https://service.example.net/'))
+
+    def test_file_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'services.json')
+            with open(path, 'w') as f:
+                json.dump([{'SERVICE': r'^https://one\.example\.net/'}], f)
+
+            with self.settings(CAS_SERVICES_FILE=path, CAS_SERVICES_RELOAD_INTERVAL=0):
+                self.assertTrue(service_allowed('https://one.example.net/'))
+
+                with open(path, 'w') as f:
+                    json.dump([{'SERVICE': r'^https://two\.example\.net/'}], f)
+                os.utime(path, ns=(0, 0))
+                self.assertFalse(service_allowed('https://one.example.net/'))
+                self.assertTrue(service_allowed('https://two.example.net/'))
+
+    def test_unknown_attributes(self):
+        service = {'SERVICE': r'^https://one\.example\.net/', 'ATTRIBUTES': ['uid']}
+        with self.settings(MAMA_CAS_SERVICES=[service]):
+            with self.assertRaises(ImproperlyConfigured):
+                service_allowed('https://one.example.net/')
+
+        with self.assertRaises(ValidationError):
+            Service(
+                name='Service',
+                service=r'^https://two\.example\.net/',
+                attributes=['email', 'uid'],
+            ).full_clean()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(
+                name='Service',
+                service=r'^https://two\.example\.net/',
+                attributes=['uid'],
+            )
+        with self.assertLogs('core.services', 'ERROR'):
+            self.assertFalse(service_allowed('https://two.example.net/'))
+
+
+@override_settings(CAS_TICKET_RETENTION=3600)
+class TicketSweeperTestCase(TestCase):
+    def ticket(self, model, expires=0, consumed=None, **kwargs):
+        return model.objects.create_ticket(
+            user=self.user,
+            expires=now() + timedelta(seconds=expires),
+            consumed=consumed and now() + timedelta(seconds=consumed),
+            **kwargs,
+        )
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user')
+
+    def test_sweep(self):
+        valid = self.ticket(ServiceTicket, 60, service='https://example.org/')
+        self.ticket(ServiceTicket, -7200, service='https://example.org/')
+        # needed for single sign-out
+        recent = self.ticket(
+            ServiceTicket, -60, consumed=-60, service='https://example.org/'
+        )
+        # granted a proxy-granting ticket which is still valid
+        granting = self.ticket(ServiceTicket, -7200, service='https://example.org/')
+        pgt = ProxyGrantingTicket.objects.create_ticket_str()
+        pgt = ProxyGrantingTicket.objects.create(
+            ticket=pgt,
+            iou=pgt.replace('PGT', 'PGTIOU'),
+            user=self.user,
+            expires=now() + timedelta(seconds=60),
+            granted_by_st=granting,
+        )
+        self.ticket(
+            ProxyTicket, -60, service='https://example.org/', granted_by_pgt=pgt
+        )
+
+        sweeper = TicketSweeper(batch_size=1)
+        self.assertEqual(
+            sweeper.run(),
+            {'proxyticket': 1, 'proxygrantingticket': 0, 'serviceticket': 1},
+        )
+        self.assertEqual(set(ServiceTicket.objects.all()), {valid, recent, granting})
+
+        pgt.consume()
+        self.assertEqual(
+            sweeper.run(),
+            {'proxyticket': 0, 'proxygrantingticket': 1, 'serviceticket': 1},
+        )
+        self.assertEqual(set(ServiceTicket.objects.all()), {valid, recent})
+
+
+@override_settings(
+    MAMA_CAS_SERVICES=[{'SERVICE': r'^https://example\.org/'}],
+    ROOT_URLCONF='core.asgi',
+)
+class AsyncValidationTestCase(TestCase):
+    service = 'https://example.org/service/'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user')
+        get_ticket_backend.cache_clear()
+        self.addCleanup(get_ticket_backend.cache_clear)
+
+    async def validate(self, ticket):
+        return await AsyncClient().get(
+            '/p3/serviceValidate', {'service': self.service, 'ticket': ticket}
+        )
+
+    async def assert_validation(self):
+        st = await sync_to_async(get_ticket_backend().create_service_ticket)(
+            self.service, self.user
+        )
+
+        response = await self.validate(st.ticket)
+        self.assertContains(response, '<cas:user>user</cas:user>')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = await self.validate(st.ticket)
+        self.assertContains(response, 'INVALID_TICKET')
+
+    @override_settings(CAS_TICKET_BACKEND='core.tickets.RedisTicketBackend')
+    async def test_redis_store(self):
+        await self.assert_validation()
+
+    @override_settings(CAS_TICKET_BACKEND='core.tickets.DatabaseTicketBackend')
+    async def test_database_store(self):
+        await self.assert_validation()
+
+    @override_settings(
+        CAS_TICKET_BACKEND='core.tickets.RedisTicketBackend',
+        MAMA_CAS_SERVICES=[
+            {
+                'SERVICE': r'^https://example\.org/',
+                'PROXY_ALLOW': True,
+                'PROXY_PATTERN': r'^https://example\.org/',
+            }
+        ],
+    )
+    async def test_redis_proxy(self):
+        st = await sync_to_async(get_ticket_backend().create_service_ticket)(
+            self.service, self.user
+        )
+        with mock.patch('requests.Session.get') as get:
+            get.return_value.status_code = 200
+            await AsyncClient().get(
+                '/p3/serviceValidate',
+                {
+                    'service': self.service,
+                    'ticket': st.ticket,
+                    'pgtUrl': 'https://example.org/callback',
+                },
+            )
+        pgt = parse_qs(urlparse(get.call_args.args[0]).query)['pgtId'][0]
+
+        response = await AsyncClient().get(
+            '/proxy', {'pgt': pgt, 'targetService': self.service}
+        )
+        pt = re.search(r'PT-[\w-]+', response.content.decode()).group()
+
+        response = await AsyncClient().get(
+            '/p3/proxyValidate', {'service': self.service, 'ticket': pt}
+        )
+        self.assertContains(response, '<cas:user>user</cas:user>')
+        self.assertContains(response, '<cas:proxy>https://example.org/service/')
+
+    def test_redis_client_options(self):
+        client = RedisTicketBackend._new_async_client(
+            {
+                'LOCATION': 'redis://redis:6379/1',
+                'OPTIONS': {
+                    'PASSWORD': 'secret',
+                    'SOCKET_TIMEOUT': 5,
+                    'CONNECTION_POOL_CLASS': 'redis.BlockingConnectionPool',
+                    'CONNECTION_POOL_KWARGS': {
+                        'connection_class': object,
+                        'max_connections': 10,
+                        'timeout': 2,
+                    },
+                    'ASYNC_CONNECTION_CLASS': 'redis.asyncio.UnixDomainSocketConnection',
+                },
+            }
+        )
+        pool = client.connection_pool
+
+        self.assertIsInstance(pool, BlockingConnectionPool)
+        self.assertIs(pool.connection_class, UnixDomainSocketConnection)
+        self.assertEqual((pool.max_connections, pool.timeout), (10, 2))
+        self.assertEqual(pool.connection_kwargs['password'], 'secret')
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 5)
+        self.assertEqual(pool.connection_kwargs['db'], 1)
+
+    async def test_post_not_allowed(self):
+        response = await AsyncClient().post('/serviceValidate')
+        self.assertEqual(response.status_code, 405)
+
+    async def test_slim_middleware(self):
+        communicator = ApplicationCommunicator(
+            ValidationHandler(),
+            {
+                'type': 'http',
+                'method': 'GET',
+                'path': '/serviceValidate',
+                'query_string': b'service=https://example.org/&ticket=ST-1',
+                'headers': [],
+            },
+        )
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output()
+        body = await communicator.receive_output()
+
+        self.assertEqual(start['status'], 200)
+        # no session, locale or security middleware
+        headers = {name.decode() for name, value in start['headers']}
+        self.assertNotIn('Vary', headers)
+        self.assertNotIn('X-Frame-Options', headers)
+        self.assertIn(b'INVALID_TICKET', body['body'])
+
+
+class SessionTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection().delete(DIRTY_KEY)
+        session = SessionStore()
+        session['user'] = 'first'
+        session.save()
+        self.key = session.session_key
+        # the first load starts the listener of this process
+        SessionStore(self.key).load()
+        self.assertTrue(wait_for(lambda: local_sessions.listening))
+
+    def test_local_cache(self):
+        SessionStore(self.key).load()
+        with mock.patch.object(cache, 'get') as get:
+            self.assertEqual(SessionStore(self.key)['user'], 'first')
+        get.assert_not_called()
+
+    def test_changed_by_other_process(self):
+        SessionStore(self.key).load()
+        cache.set(KEY_PREFIX + self.key, {'user': 'second'})
+        self.assertEqual(SessionStore(self.key)['user'], 'first')
+
+        get_redis_connection().publish(CHANNEL, self.key)
+        self.assertTrue(
+            wait_for(lambda: SessionStore(self.key).get('user') == 'second')
+        )
+
+    def test_delete(self):
+        SessionStore(self.key).load()
+        SessionStore(self.key).delete()
+        self.assertIsNone(SessionStore(self.key).get('user'))
+
+    @override_settings(SESSION_PERSIST=True)
+    def test_persist(self):
+        session = SessionStore()
+        session['user'] = 'persisted'
+        session.save()
+        self.assertEqual(flush(), 1)
+        self.assertTrue(
+            Session.objects.filter(session_key=session.session_key).exists()
+        )
+
+        # restart of Redis
+        cache.delete(KEY_PREFIX + session.session_key)
+        local_sessions.discard(session.session_key)
+        self.assertEqual(SessionStore(session.session_key)['user'], 'persisted')
+        self.assertIsNotNone(cache.get(KEY_PREFIX + session.session_key))
+
+        session.delete()
+        self.assertFalse(
+            Session.objects.filter(session_key=session.session_key).exists()
+        )
+
+    @override_settings(SESSION_PERSIST=True)
+    def test_delete_during_flush(self):
+        session = SessionStore()
+        session['user'] = 'logged out'
+        session.save()
+        bulk_create = Session.objects.bulk_create
+        written_back = []
+
+        def logout_and_write(*args, **kwargs):
+            if written_back:
+                return bulk_create(*args, **kwargs)
+            # the logout happens after the flush read the session, which is
+            # then written back to the database
+            SessionStore(session.session_key).delete()
+            result = bulk_create(*args, **kwargs)
+            written_back.append(
+                Session.objects.filter(session_key=session.session_key).exists()
+            )
+            self.assertIsNone(SessionStore(session.session_key).get('user'))
+            return result
+
+        with mock.patch.object(Session.objects, 'bulk_create', logout_and_write):
+            # deleted again by the same flush
+            self.assertEqual(flush(), 2)
+        self.assertEqual(written_back, [True])
+        self.assertFalse(
+            Session.objects.filter(session_key=session.session_key).exists()
+        )
+
+
+@override_settings(MAMA_CAS_SERVICES=[{'SERVICE': r'^https://example\.org/'}])
+class SingleSignOnTestCase(TestCase):
+    service = 'https://example.org/service/'
+    password = 'correct horse battery staple'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user', password=self.password)
+        # session hash remembered in previous tests
+        cache.delete(_user_key(self.user.pk))
+        get_ticket_backend.cache_clear()
+        self.addCleanup(get_ticket_backend.cache_clear)
+        # the services are loaded once per worker
+        services.get_registry()
+        self.client.post('/login/', {'username': 'user', 'password': self.password})
+        # the session is kept in memory once the change of the session key
+        # by the login was received
+        key = self.client.session.session_key
+        self.assertTrue(
+            wait_for(lambda: SessionStore(key).load() and key in local_sessions.entries)
+        )
+
+    def sso(self, **params):
+        return self.client.get('/login/', {'service': self.service, **params})
+
+    def assert_ticket(self, response):
+        self.assertEqual(response.status_code, 302)
+        ticket = parse_qs(urlparse(response['Location']).query)['ticket'][0]
+        response = self.client.get(
+            '/p3/serviceValidate', {'service': self.service, 'ticket': ticket}
+        )
+        self.assertContains(response, '<cas:user>user</cas:user>')
+
+    def test_fast_path(self):
+        # one read of the session hash of the user, the session is in memory
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            # the service ticket
+            with self.assertNumQueries(1):
+                response = self.sso()
+        get.assert_called_once_with(_user_key(self.user.pk))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assert_ticket(response)
+
+    @override_settings(CAS_TICKET_BACKEND='core.tickets.RedisTicketBackend')
+    def test_fast_path_redis_store(self):
+        get_ticket_backend.cache_clear()
+        with self.assertNumQueries(0):
+            response = self.sso()
+        self.assert_ticket(response)
+
+    def test_login_view(self):
+        # renew and warn are handled by the login view
+        self.assertEqual(self.sso(renew='true').status_code, 200)
+        session = self.client.session
+        session['warn'] = True
+        session.save()
+        response = self.sso()
+        self.assertTrue(response['Location'].startswith(reverse('cas_warn')))
+
+    def test_password_change(self):
+        self.user.set_password('new password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        # the session is invalid, so the login form is shown
+        self.assertEqual(self.sso().status_code, 200)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.sso().status_code, 200)
+
+
+class PagedDirectory:
+    """Answers paged searches with a list of entries."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.filters = []
+
+    def search_ext(self, base, scope, filterstr, attrlist, serverctrls):
+        self.filters.append(filterstr)
+        self.control = serverctrls[0]
+        return 1
+
+    def result3(self, msgid):
+        match = re.search(r'\(modifyTimestamp>=(\w+)\)', self.filters[-1])
+        entries = [
+            entry
+            for entry in self.entries
+            if not match or entry[1]['modifyTimestamp'][0].decode() >= match[1]
+        ]
+        start = int(self.control.cookie or 0)
+        end = start + self.control.size
+        cookie = str(end).encode() if end < len(entries) else b''
+        control = SimplePagedResultsControl(True, size=self.control.size, cookie=cookie)
+        return 101, entries[start:end], msgid, [control]
+
+
+@override_settings(
+    AUTH_LDAP_ALWAYS_UPDATE_USER=False,
+    AUTH_LDAP_UPDATE_USER_ON_LOGIN=True,
+    AUTH_LDAP_USER_ATTR_MAP={'first_name': 'givenName'},
+    AUTH_LDAP_SYNC_PAGE_SIZE=2,
+    AUTH_LDAP_SYNC_GROUP_ATTR='memberOf',
+)
+class LDAPSyncTestCase(TestCase):
+    search = LDAPSearch(
+        'ou=people,dc=example,dc=org', ldap.SCOPE_SUBTREE, '(uid=%(user)s)'
+    )
+
+    def setUp(self):
+        cache.delete(WATERMARK_KEY.format(self.search.base_dn))
+        self.directory = PagedDirectory(
+            [
+                self.entry('Alice', 'Alice', '20240101000000Z', ['staff']),
+                self.entry('bob', 'Bob', '20240102000000Z', ['staff', 'admins']),
+                self.entry('carol', 'Carol', '20240103000000Z', []),
+            ]
+        )
+        # created on a login before
+        get_user_model().objects.create_user('alice')
+
+    def entry(self, uid, given_name, timestamp, groups):
+        return (
+            f'uid={uid},ou=people,dc=example,dc=org',
+            {
+                'uid': [uid.encode()],
+                'givenName': [given_name.encode()],
+                'modifyTimestamp': [timestamp.encode()],
+                'memberOf': [
+                    f'cn={group},ou=groups,dc=example,dc=org'.encode()
+                    for group in groups
+                ],
+            },
+        )
+
+    def sync(self):
+        return LDAPSync().sync_search(self.directory, self.search)
+
+    def test_sync(self):
+        self.assertEqual(self.sync(), 3)
+        self.assertEqual(len(self.directory.filters), 2)
+        self.assertEqual(self.directory.filters[0], '(uid=*)')
+
+        users = {user.username: user for user in get_user_model().objects.all()}
+        self.assertEqual(set(users), {'alice', 'bob', 'carol'})
+        self.assertEqual(users['alice'].first_name, 'Alice')
+        self.assertFalse(users['carol'].has_usable_password())
+        self.assertEqual(
+            set(users['bob'].groups.values_list('name', flat=True)), {'staff', 'admins'}
+        )
+
+        # only entries modified since the newest entry of the last sync
+        self.directory.entries[1] = self.entry(
+            'bob', 'Robert', '20240104000000Z', ['admins']
+        )
+        self.assertEqual(self.sync(), 1)
+        self.assertIn('(modifyTimestamp>=20240103000000Z)', self.directory.filters[-1])
+        bob = get_user_model().objects.get(username='bob')
+        self.assertEqual(bob.first_name, 'Robert')
+        self.assertEqual(list(bob.groups.values_list('name', flat=True)), ['admins'])
+        self.assertTrue(Group.objects.filter(name='staff').exists())
+
+    def test_login_without_update(self):
+        from .ldap import LDAPBackend, LDAPUser
+
+        user = get_user_model().objects.get(username='alice')
+        ldap_user = LDAPUser(LDAPBackend(), username='alice')
+        ldap_user._user_dn = 'uid=alice,ou=people,dc=example,dc=org'
+        ldap_user._user_attrs = {'givenName': ['Changed']}
+
+        with override_settings(AUTH_LDAP_UPDATE_USER_ON_LOGIN=False):
+            with self.assertNumQueries(1):
+                ldap_user._get_or_create_user()
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, '')
+
+        ldap_user._get_or_create_user()
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Changed')
+
+
+@override_settings(
+    PASSWORD_HASHERS=[
+        'core.hashers.PBKDF2PasswordHasher',
+        'core.hashers.ScryptPasswordHasher',
+    ],
+    PASSWORD_PBKDF2_ITERATIONS=1000,
+    PASSWORD_SCRYPT_WORK_FACTOR=2**10,
+)
+class HashersTestCase(TestCase):
+    password = 'correct horse battery staple'
+
+    def authenticate(self):
+        return ModelBackend().authenticate(
+            None, username='user', password=self.password
+        )
+
+    def test_pool(self):
+        thread = run_hashing(threading.current_thread)
+        self.assertTrue(thread.name.startswith('password-hashing'))
+
+        # hashing within the pool does not wait for a free thread
+        thread, nested = run_hashing(
+            lambda: (threading.current_thread(), run_hashing(threading.current_thread))
+        )
+        self.assertIs(nested, thread)
+
+    def test_rehash_on_login(self):
+        user = get_user_model().objects.create_user('user', password=self.password)
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+        # the cost changed
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            user = self.authenticate()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+
+        # the hasher changed
+        with self.settings(
+            PASSWORD_HASHERS=[
+                'core.hashers.ScryptPasswordHasher',
+                'core.hashers.PBKDF2PasswordHasher',
+            ]
+        ):
+            user = self.authenticate()
+            self.assertTrue(user.password.startswith('scrypt$'))
+            self.assertEqual(self.authenticate(), user)
@@ -0,0 +1,530 @@
+import asyncio
+import json
+import logging
+import weakref
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from mama_cas.exceptions import (
+    InvalidRequest,
+    InvalidService,
+    InvalidTicket,
+    ValidationError,
+)
+from mama_cas.models import (
+    ProxyGrantingTicket,
+    ProxyTicket,
+    ServiceTicket,
+    TicketManager,
+)
+from mama_cas.services import service_allowed
+from mama_cas.utils import clean_service_url, is_scheme_https, match_service
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from .callbacks import get_callback_client
+from .metrics import TICKET_DURATION, timer
+from .services import services
+from .signout import request_sign_out
+
+logger = logging.getLogger(__name__)
+
+
+class TicketBackend:
+    """Base class of the ticket backends.
+
+    The async methods are used by the ASGI validation views (see
+    core.asgi). Unless a backend implements them natively, they run the
+    sync methods in the thread of the request.
+    """
+
+    async def avalidate_service_ticket(
+        self, ticket, service, renew=False, require_https=False
+    ):
+        return await sync_to_async(self.validate_service_ticket)(
+            ticket, service, renew=renew, require_https=require_https
+        )
+
+    async def acreate_proxy_ticket(self, service, pgt):
+        return await sync_to_async(self.create_proxy_ticket)(service, pgt)
+
+    async def avalidate_proxy_ticket(self, ticket, service):
+        return await sync_to_async(self.validate_proxy_ticket)(ticket, service)
+
+    async def acreate_proxy_granting_ticket(self, service, pgturl, granted_by):
+        return await sync_to_async(self.create_proxy_granting_ticket)(
+            service, pgturl, granted_by
+        )
+
+    async def avalidate_proxy_granting_ticket(self, ticket, service):
+        return await sync_to_async(self.validate_proxy_granting_ticket)(ticket, service)
+
+
+class DatabaseTicketBackend(TicketBackend):
+    """Ticket backend storing tickets in the database using the mama_cas
+    models."""
+
+    def create_service_ticket(self, service, user, primary=False):
+        return ServiceTicket.objects.create_ticket(
+            service=service, user=user, primary=primary
+        )
+
+    def validate_service_ticket(
+        self, ticket, service, renew=False, require_https=False
+    ):
+        return ServiceTicket.objects.validate_ticket(
+            ticket, service, renew=renew, require_https=require_https
+        )
+
+    def create_proxy_ticket(self, service, pgt):
+        return ProxyTicket.objects.create_ticket(
+            service=service, user=pgt.user, granted_by_pgt=pgt
+        )
+
+    def validate_proxy_ticket(self, ticket, service):
+        pt = ProxyTicket.objects.validate_ticket(ticket, service)
+
+        # Build a list of all services that proxied authentication,
+        # in reverse order of which they were traversed
+        proxies = [pt.service]
+        prior_pt = pt.granted_by_pgt.granted_by_pt
+        while prior_pt:
+            proxies.append(prior_pt.service)
+            prior_pt = prior_pt.granted_by_pgt.granted_by_pt
+        return pt, proxies
+
+    def create_proxy_granting_ticket(self, service, pgturl, granted_by):
+        if isinstance(granted_by, ProxyTicket):
+            kwargs = {'granted_by_pt': granted_by}
+        else:
+            kwargs = {'granted_by_st': granted_by}
+
+        # like ProxyGrantingTicketManager.create_ticket, but with the callback
+        # sent by the shared client
+        manager = ProxyGrantingTicket.objects
+        pgtid = manager.create_ticket_str()
+        pgtiou = manager.create_ticket_str(prefix=ProxyGrantingTicket.IOU_PREFIX)
+        try:
+            get_callback_client().validate_callback(service, pgturl, pgtid, pgtiou)
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return None
+        return TicketManager.create_ticket(
+            manager, ticket=pgtid, iou=pgtiou, user=granted_by.user, **kwargs
+        )
+
+    def validate_proxy_granting_ticket(self, ticket, service):
+        return ProxyGrantingTicket.objects.validate_ticket(ticket, service)
+
+    def consume_tickets(self, user):
+        ServiceTicket.objects.consume_tickets(user)
+        ProxyTicket.objects.consume_tickets(user)
+        ProxyGrantingTicket.objects.consume_tickets(user)
+
+    def request_sign_out(self, user):
+        request_sign_out(
+            ServiceTicket.objects.filter(user=user, consumed__gte=user.last_login)
+        )
+
+
+class RedisTicketBackend(TicketBackend):
+    """Ticket backend storing tickets in Redis.
+
+    Tickets are stored as JSON with a TTL matching their lifetime, so
+    expired tickets vanish without any cleanup. Service and proxy tickets
+    are consumed atomically with GETDEL, which guarantees single use even
+    with concurrent validation requests. The returned tickets are unsaved
+    instances of the mama_cas models, so they can be used wherever
+    mama_cas expects a ticket.
+
+    The async methods use an asyncio Redis client, which is created per
+    event loop.
+    """
+
+    key_prefix = 'cas'
+
+    _async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection(settings.CAS_TICKET_REDIS_ALIAS)
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        try:
+            return self._async_clients[loop]
+        except KeyError:
+            client = self._new_async_client(
+                settings.CACHES[settings.CAS_TICKET_REDIS_ALIAS]
+            )
+            self._async_clients[loop] = client
+            return client
+
+    @staticmethod
+    def _new_async_client(config):
+        """Return an asyncio client connecting like the django_redis client
+        of the cache ``config``.
+
+        ``PASSWORD``, the socket timeouts and ``CONNECTION_POOL_KWARGS`` are
+        used as they are, and the pool class of the same name is taken from
+        ``redis.asyncio``. Synchronous connection classes cannot be used, so
+        the ``connection_class`` of ``CONNECTION_POOL_KWARGS`` is replaced by
+        ``ASYNC_CONNECTION_CLASS``, if set.
+        """
+        from redis import asyncio as redis_async
+
+        options = config.get('OPTIONS', {})
+        kwargs = {
+            key: options[option]
+            for option, key in (
+                ('PASSWORD', 'password'),
+                ('SOCKET_TIMEOUT', 'socket_timeout'),
+                ('SOCKET_CONNECT_TIMEOUT', 'socket_connect_timeout'),
+            )
+            if options.get(option)
+        }
+        if 'ASYNC_CONNECTION_CLASS' in options:
+            kwargs['connection_class'] = import_string(
+                options['ASYNC_CONNECTION_CLASS']
+            )
+
+        if 'SENTINELS' in options:
+            # the master of the service named in the location, see
+            # django_redis.pool.SentinelConnectionFactory
+            url = urlsplit(config['LOCATION'])
+            sentinel = redis_async.Sentinel(
+                options['SENTINELS'],
+                sentinel_kwargs=options.get('SENTINEL_KWARGS'),
+                **kwargs,
+            )
+            return sentinel.master_for(url.hostname, db=int(url.path[1:] or 0))
+
+        pool_kwargs = {
+            key: value
+            for key, value in options.get('CONNECTION_POOL_KWARGS', {}).items()
+            if key != 'connection_class'
+        }
+        pool_name = options.get(
+            'CONNECTION_POOL_CLASS', 'redis.connection.ConnectionPool'
+        ).rpartition('.')[2]
+        try:
+            pool_class = getattr(redis_async, pool_name)
+        except AttributeError:
+            raise ImproperlyConfigured(
+                f'redis.asyncio has no connection pool class {pool_name}'
+            )
+        pool = pool_class.from_url(config['LOCATION'], **kwargs, **pool_kwargs)
+        return redis_async.Redis(connection_pool=pool)
+
+    def _ticket_key(self, ticket):
+        return f'{self.key_prefix}:ticket:{ticket}'
+
+    def _user_key(self, user_pk, name):
+        return f'{self.key_prefix}:user:{user_pk}:{name}'
+
+    def _new_ticket(self, model, user_pk, data, ticket=None):
+        ticket = ticket or model.objects.create_ticket_str()
+        expires = now() + timedelta(seconds=model.TICKET_EXPIRE)
+        data.update(user=user_pk, expires=expires.timestamp())
+        return model(
+            ticket=ticket, user_id=user_pk, expires=expires, **self._fields(data)
+        )
+
+    def _store(self, model, user, data, ticket=None):
+        t = self._new_ticket(model, user.pk, data, ticket=ticket)
+        t.user = user
+        self.client.set(
+            self._ticket_key(t.ticket), json.dumps(data), ex=model.TICKET_EXPIRE
+        )
+        logger.debug('Created %s %s' % (t.name, t.ticket))
+        return t
+
+    async def _astore(self, model, user_pk, data, ticket=None):
+        t = self._new_ticket(model, user_pk, data, ticket=ticket)
+        await self.async_client.set(
+            self._ticket_key(t.ticket), json.dumps(data), ex=model.TICKET_EXPIRE
+        )
+        logger.debug('Created %s %s' % (t.name, t.ticket))
+        return t
+
+    def _fields(self, data):
+        return {
+            k: v
+            for k, v in data.items()
+            if k in ('service', 'primary', 'iou') and v is not None
+        }
+
+    def _check_ticket_string(self, model, ticket):
+        if not ticket:
+            raise InvalidRequest('No ticket string provided')
+
+        if not model.TICKET_RE.match(ticket):
+            raise InvalidTicket('Ticket string %s is invalid' % ticket)
+
+    def _decode(self, model, ticket, raw):
+        if raw is None:
+            raise InvalidTicket(
+                '%s %s does not exist, has expired or has already been used'
+                % (model._meta.verbose_name, ticket)
+            )
+        return json.loads(raw)
+
+    def _ticket(self, model, ticket, data, consume):
+        return model(
+            ticket=ticket,
+            user_id=data['user'],
+            expires=datetime.fromtimestamp(data['expires'], tz=timezone.utc),
+            consumed=now() if consume else None,
+            **self._fields(data),
+        )
+
+    def _load(self, model, ticket, consume):
+        self._check_ticket_string(model, ticket)
+
+        key = self._ticket_key(ticket)
+        raw = self.client.getdel(key) if consume else self.client.get(key)
+        data = self._decode(model, ticket, raw)
+        t = self._ticket(model, ticket, data, consume)
+        try:
+            t.user = get_user_model()._default_manager.get(pk=data['user'])
+        except get_user_model().DoesNotExist:
+            raise InvalidTicket('Ticket %s does not exist' % ticket)
+        return t, data
+
+    async def _aload(self, model, ticket, consume):
+        self._check_ticket_string(model, ticket)
+        # reload the services for the checks of the ticket, if necessary
+        await services.aget_registry()
+
+        key = self._ticket_key(ticket)
+        client = self.async_client
+        raw = await (client.getdel(key) if consume else client.get(key))
+        data = self._decode(model, ticket, raw)
+        # the user is loaded together with the attributes instead, which
+        # saves a switch to a thread, see core.cas
+        return self._ticket(model, ticket, data, consume), data
+
+    def _check_service(self, t, service, require_https=False):
+        if not service:
+            raise InvalidRequest('No service identifier provided')
+
+        if require_https and not is_scheme_https(service):
+            raise InvalidService('Service %s is not HTTPS' % service)
+
+        if not service_allowed(service):
+            raise InvalidService('Service %s is not a valid %s URL' % (service, t.name))
+
+        if getattr(t, 'service', None) and not match_service(t.service, service):
+            raise InvalidService(
+                '%s %s for service %s is invalid for service %s'
+                % (t.name, t.ticket, t.service, service)
+            )
+
+    def create_service_ticket(self, service, user, primary=False):
+        return self._store(
+            ServiceTicket,
+            user,
+            {'service': clean_service_url(service), 'primary': primary},
+        )
+
+    def _check_service_ticket(self, st, service, renew, require_https):
+        self._check_service(st, service, require_https=require_https)
+
+        if renew and not st.is_primary():
+            raise InvalidTicket(
+                '%s %s was not issued via primary credentials' % (st.name, st.ticket)
+            )
+
+    def _remember_service(self, pipe, st):
+        """Remember the validated ticket for single sign-out."""
+        key = self._user_key(st.user_id, 'sso')
+        pipe.rpush(key, json.dumps({'ticket': st.ticket, 'service': st.service}))
+        pipe.expire(key, settings.SESSION_COOKIE_AGE)
+
+    def validate_service_ticket(
+        self, ticket, service, renew=False, require_https=False
+    ):
+        st, data = self._load(ServiceTicket, ticket, consume=True)
+        self._check_service_ticket(st, service, renew, require_https)
+
+        pipe = self.client.pipeline()
+        self._remember_service(pipe, st)
+        pipe.execute()
+
+        logger.debug('Validated %s %s' % (st.name, ticket))
+        return st
+
+    async def avalidate_service_ticket(
+        self, ticket, service, renew=False, require_https=False
+    ):
+        st, data = await self._aload(ServiceTicket, ticket, consume=True)
+        self._check_service_ticket(st, service, renew, require_https)
+
+        async with self.async_client.pipeline() as pipe:
+            self._remember_service(pipe, st)
+            await pipe.execute()
+
+        logger.debug('Validated %s %s' % (st.name, ticket))
+        return st
+
+    def create_proxy_ticket(self, service, pgt):
+        return self._store(
+            ProxyTicket,
+            pgt.user,
+            {'service': clean_service_url(service), 'proxies': pgt.proxies},
+        )
+
+    async def acreate_proxy_ticket(self, service, pgt):
+        return await self._astore(
+            ProxyTicket,
+            pgt.user_id,
+            {'service': clean_service_url(service), 'proxies': pgt.proxies},
+        )
+
+    def validate_proxy_ticket(self, ticket, service):
+        pt, data = self._load(ProxyTicket, ticket, consume=True)
+        pt.proxies = data['proxies']
+        self._check_service(pt, service)
+        logger.debug('Validated %s %s' % (pt.name, ticket))
+        return pt, [pt.service] + pt.proxies
+
+    async def avalidate_proxy_ticket(self, ticket, service):
+        pt, data = await self._aload(ProxyTicket, ticket, consume=True)
+        pt.proxies = data['proxies']
+        self._check_service(pt, service)
+        logger.debug('Validated %s %s' % (pt.name, ticket))
+        return pt, [pt.service] + pt.proxies
+
+    def _new_proxy_granting_ticket(self, granted_by):
+        pgtid = ProxyGrantingTicket.objects.create_ticket_str()
+        pgtiou = ProxyGrantingTicket.objects.create_ticket_str(
+            prefix=ProxyGrantingTicket.IOU_PREFIX
+        )
+        if isinstance(granted_by, ProxyTicket):
+            proxies = [granted_by.service] + granted_by.proxies
+        else:
+            proxies = []
+        return pgtid, {'iou': pgtiou, 'proxies': proxies}
+
+    def _remember_proxy_granting_ticket(self, pipe, pgt):
+        key = self._user_key(pgt.user_id, 'pgts')
+        pipe.sadd(key, pgt.ticket)
+        pipe.expire(key, ProxyGrantingTicket.TICKET_EXPIRE)
+
+    def create_proxy_granting_ticket(self, service, pgturl, granted_by):
+        pgtid, data = self._new_proxy_granting_ticket(granted_by)
+        try:
+            get_callback_client().validate_callback(service, pgturl, pgtid, data['iou'])
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return None
+
+        pgt = self._store(ProxyGrantingTicket, granted_by.user, data, ticket=pgtid)
+        pgt.proxies = data['proxies']
+
+        pipe = self.client.pipeline()
+        self._remember_proxy_granting_ticket(pipe, pgt)
+        pipe.execute()
+        return pgt
+
+    async def acreate_proxy_granting_ticket(self, service, pgturl, granted_by):
+        pgtid, data = self._new_proxy_granting_ticket(granted_by)
+        try:
+            await get_callback_client().avalidate_callback(
+                service, pgturl, pgtid, data['iou']
+            )
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return None
+
+        pgt = await self._astore(
+            ProxyGrantingTicket, granted_by.user_id, data, ticket=pgtid
+        )
+        pgt.proxies = data['proxies']
+
+        async with self.async_client.pipeline() as pipe:
+            self._remember_proxy_granting_ticket(pipe, pgt)
+            await pipe.execute()
+        return pgt
+
+    def validate_proxy_granting_ticket(self, ticket, service):
+        pgt, data = self._load(ProxyGrantingTicket, ticket, consume=False)
+        pgt.proxies = data['proxies']
+        self._check_service(pgt, service)
+        logger.debug('Validated %s %s' % (pgt.name, ticket))
+        return pgt
+
+    async def avalidate_proxy_granting_ticket(self, ticket, service):
+        pgt, data = await self._aload(ProxyGrantingTicket, ticket, consume=False)
+        pgt.proxies = data['proxies']
+        self._check_service(pgt, service)
+        logger.debug('Validated %s %s' % (pgt.name, ticket))
+        return pgt
+
+    def consume_tickets(self, user):
+        # outstanding service and proxy tickets expire within seconds,
+        # proxy-granting tickets are bound to the session and removed here
+        key = self._user_key(user.pk, 'pgts')
+        pgts = self.client.smembers(key)
+        pipe = self.client.pipeline()
+        for pgt in pgts:
+            pipe.delete(self._ticket_key(pgt.decode()))
+        pipe.delete(key)
+        pipe.execute()
+
+    def request_sign_out(self, user):
+        key = self._user_key(user.pk, 'sso')
+        pipe = self.client.pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        entries, _ = pipe.execute()
+
+        request_sign_out(
+            ServiceTicket(ticket=entry['ticket'], service=entry['service'], user=user)
+            for entry in map(json.loads, entries)
+        )
+
+
+class InstrumentedTicketBackend:
+    """Wraps a ticket backend and observes the duration of its operations in
+    ``baseauth_ticket_duration_seconds``."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.store = type(backend).__name__
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        # async methods are observed with the name of the sync method
+        operation = name[1:] if iscoroutinefunction(method) else name
+
+        if iscoroutinefunction(method):
+
+            @wraps(method)
+            async def atimed(*args, **kwargs):
+                with timer(TICKET_DURATION, operation=operation, store=self.store):
+                    return await method(*args, **kwargs)
+
+            return atimed
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            with timer(TICKET_DURATION, operation=operation, store=self.store):
+                return method(*args, **kwargs)
+
+        return timed
+
+
+@lru_cache(maxsize=None)
+def get_ticket_backend():
+    """Return the ticket backend configured in ``CAS_TICKET_BACKEND``."""
+    return InstrumentedTicketBackend(import_string(settings.CAS_TICKET_BACKEND)())
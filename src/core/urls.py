@@ -0,0 +1,43 @@
+"""CAS protocol URLs.
+
+Same routes and names as ``mama_cas.urls``, but served by the views in
+``core.views``, which use the configured ticket backend.
+"""
+from mama_cas.views import WarnView
+
+from django.urls import re_path
+
+from . import views
+
+urlpatterns = [
+    re_path(r'^login/?$', views.LoginView.as_view(), name='cas_login'),
+    re_path(r'^logout/?$', views.LogoutView.as_view(), name='cas_logout'),
+    re_path(r'^validate/?$', views.ValidateView.as_view(), name='cas_validate'),
+    re_path(
+        r'^serviceValidate/?$',
+        views.ServiceValidateView.as_view(),
+        name='cas_service_validate',
+    ),
+    re_path(
+        r'^proxyValidate/?$',
+        views.ProxyValidateView.as_view(),
+        name='cas_proxy_validate',
+    ),
+    re_path(r'^proxy/?$', views.ProxyView.as_view(), name='cas_proxy'),
+    re_path(
+        r'^p3/serviceValidate/?$',
+        views.ServiceValidateView.as_view(),
+        name='cas_p3_service_validate',
+    ),
+    re_path(
+        r'^p3/proxyValidate/?$',
+        views.ProxyValidateView.as_view(),
+        name='cas_p3_proxy_validate',
+    ),
+    re_path(r'^warn/?$', WarnView.as_view(), name='cas_warn'),
+    re_path(
+        r'^samlValidate/?$',
+        views.SamlValidateView.as_view(),
+        name='cas_saml_validate',
+    ),
+]
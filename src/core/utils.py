@@ -1,15 +1,90 @@
+import sys
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from general.db.routers import is_pinned, pin_users, replica_reads
+
+from .metrics import ATTRIBUTES_CACHE, ATTRIBUTES_DURATION
+from .services import services
+
+ATTRIBUTES = {
+    'display_name': lambda user: user.get_full_name(),
+    'first_name': lambda user: user.first_name,
+    'last_name': lambda user: user.last_name,
+    'email': lambda user: user.email,
+    'groups': lambda user: list(user.groups.values_list('name', flat=True)),
+}
+
+
+def gevent_threadpool():
+    """Return the thread pool of gevent's hub, if gevent patched this
+    process, e.g. in a gevent gunicorn worker."""
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None or not monkey.is_module_patched('socket'):
+        return None
+    return sys.modules['gevent'].get_hub().threadpool
+
+
+def _attributes_version_key(user_pk):
+    return f'cas:attributes:version:{user_pk}'
+
+
+def invalidate_attributes(*user_pks):
+    """Invalidate the cached CAS attributes of the given users.
+
+    Instead of deleting the cached attributes, the version of the users'
+    cache key is increased, so that a concurrent request cannot write
+    stale attributes back to the cache. The version is increased when the
+    current transaction is committed, as a concurrent request could cache
+    the old rows under the new version before. The users are read from the
+    primary database until the replicas caught up with the change.
+
+    :param user_pks: Primary keys of the users
+    """
+    transaction.on_commit(partial(_increase_attributes_versions, user_pks))
+
+
+def _increase_attributes_versions(user_pks):
+    pin_users(*user_pks)
+    for pk in user_pks:
+        try:
+            cache.incr(_attributes_version_key(pk))
+        except ValueError:
+            # no version yet, so there is nothing cached
+            pass
+
+
+@ATTRIBUTES_DURATION.time()
 def get_attributes(user, service):
     """Get CAS Attributes sent to services.
 
+    Only the attributes listed in ``ATTRIBUTES`` of the matching service
+    in ``MAMA_CAS_SERVICES`` are returned, or all if it is not set. The
+    attributes are cached per user until the user or their groups change.
+
     :param user: User instance
     :param service: Current service
-    :param version: Which type of key naming to use
     :return: Dictionary of attributes to send
     """
-    return {
-        'display_name': user.get_full_name(),
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'email': user.email,
-        'groups': list(user.groups.values_list('name', flat=True)),
-    }
+    names = services.get_service(service).get('ATTRIBUTES') or ATTRIBUTES.keys()
+
+    version = cache.get_or_set(_attributes_version_key(user.pk), 1, timeout=None)
+    key = f'cas:attributes:{user.pk}'
+    attributes = cache.get(key, version=version) or {}
+
+    missing = [name for name in names if name not in attributes]
+    ATTRIBUTES_CACHE.labels('miss' if missing else 'hit').inc()
+    if missing:
+        with replica_reads(bool(settings.POSTGRES_REPLICAS) and not is_pinned(user.pk)):
+            attributes.update({name: ATTRIBUTES[name](user) for name in missing})
+        cache.set(
+            key,
+            attributes,
+            timeout=settings.CAS_ATTRIBUTES_CACHE_TIMEOUT,
+            version=version,
+        )
+
+    return {name: attributes[name] for name in names}
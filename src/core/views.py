@@ -1,21 +1,46 @@
+import logging
+from io import BytesIO
+
 from axes.utils import reset
-from ipware.ip import get_client_ip
+from captcha import views as captcha_views
+from mama_cas import views as cas_views
+from mama_cas.compat import defused_etree
+from mama_cas.exceptions import ValidationError
+from mama_cas.models import ProxyTicket
+from mama_cas.utils import redirect, to_bool
+from ranged_response import RangedFileResponse
 
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.contrib.auth import login
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse_lazy
+from django.utils.crypto import constant_time_compare
 from django.utils.translation import gettext as _
 
-from .forms import AxesCaptchaForm
+from general.ip import get_client_ip
+
+from . import captchas
+from .cas import (
+    logout_user,
+    validate_proxy_granting_ticket,
+    validate_proxy_ticket,
+    validate_service_ticket,
+)
+from .forms import AxesCaptchaForm, LoginForm
+from .metrics import render as render_metrics
+from .sso import remember_user
+from .tickets import get_ticket_backend
+
+logger = logging.getLogger(__name__)
 
 
 def locked_out(request):
     if request.POST:
         form = AxesCaptchaForm(request.POST)
         if form.is_valid():
-            ip, is_routable = get_client_ip(request)
-            reset(ip=ip)
+            reset(ip=get_client_ip(request))
             return HttpResponseRedirect(reverse_lazy('cas_login'))
     else:
         messages.error(
@@ -28,3 +53,199 @@ def locked_out(request):
         form = AxesCaptchaForm()
 
     return render(request, 'core/locked_out.html', dict(form=form))
+
+
+def captcha_image(request, key, scale=1):
+    """Serve the image of a captcha from the pool, or render it."""
+    content = captchas.get_image(key) if scale == 1 else None
+    if content is None:
+        return captcha_views.captcha_image(request, key, scale=scale)
+    return HttpResponse(content, content_type='image/png')
+
+
+def captcha_audio(request, key):
+    """Serve the audio of a captcha from the pool, or render it."""
+    content = captchas.get_audio(key)
+    if content is None:
+        return captcha_views.captcha_audio(request, key)
+    response = RangedFileResponse(request, BytesIO(content), content_type='audio/wav')
+    response['Content-Disposition'] = f'attachment; filename="{key}.wav"'
+    return response
+
+
+def metrics(request):
+    """Prometheus metrics of all workers, for requests with the bearer token
+    set in ``METRICS_TOKEN``."""
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    ):
+        raise Http404
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
+# The following views replace the mama_cas views of the same name, so that
+# tickets are issued and validated through the configured ticket backend.
+
+
+class LoginView(cas_views.LoginView):
+    form_class = LoginForm
+
+    def issue_ticket(self, service, primary=False):
+        st = get_ticket_backend().create_service_ticket(
+            service, self.request.user, primary=primary
+        )
+        if not primary and self.warn_user():
+            return redirect(
+                'cas_warn', params={'service': service, 'ticket': st.ticket}
+            )
+        return redirect(service, params={'ticket': st.ticket})
+
+    def get(self, request, *args, **kwargs):
+        service = request.GET.get('service')
+        renew = to_bool(request.GET.get('renew'))
+        gateway = to_bool(request.GET.get('gateway'))
+
+        if renew:
+            logger.debug('Renew request received by credential requestor')
+        elif gateway and service:
+            logger.debug('Gateway request received by credential requestor')
+            if request.user.is_authenticated:
+                return self.issue_ticket(service)
+            return redirect(service)
+        elif request.user.is_authenticated:
+            # the next requests can take the fast path, see core.sso
+            remember_user(request.user)
+            if service:
+                logger.debug('Service ticket request received by credential requestor')
+                return self.issue_ticket(service)
+            messages.success(request, _('You are logged in as %s') % request.user)
+        return super(cas_views.LoginView, self).get(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        login(self.request, form.user)
+        remember_user(form.user)
+        logger.info('Single sign-on session started for %s' % form.user)
+
+        if form.cleaned_data.get('warn'):
+            self.request.session['warn'] = True
+
+        service = self.request.GET.get('service')
+        if service:
+            return self.issue_ticket(service, primary=True)
+        return redirect('cas_login')
+
+
+class LogoutView(cas_views.LogoutView):
+    def get(self, request, *args, **kwargs):
+        service = request.GET.get('service') or request.GET.get('url')
+        follow_url = getattr(settings, 'MAMA_CAS_FOLLOW_LOGOUT_URL', True)
+        logout_user(request)
+        if service and follow_url:
+            return redirect(service)
+        return redirect('cas_login')
+
+
+class ValidateView(cas_views.ValidateView):
+    def get(self, request, *args, **kwargs):
+        service = request.GET.get('service')
+        ticket = request.GET.get('ticket')
+        renew = to_bool(request.GET.get('renew'))
+
+        try:
+            st, attributes, pgt = validate_service_ticket(service, ticket, renew=renew)
+            content = 'yes\n%s\n' % st.user.get_username()
+        except ValidationError:
+            content = 'no\n\n'
+        return HttpResponse(content=content, content_type='text/plain')
+
+
+class ServiceValidateView(cas_views.ServiceValidateView):
+    def get_context_data(self, **kwargs):
+        service = self.request.GET.get('service')
+        ticket = self.request.GET.get('ticket')
+        pgturl = self.request.GET.get('pgtUrl')
+        renew = to_bool(self.request.GET.get('renew'))
+
+        try:
+            st, attributes, pgt = validate_service_ticket(
+                service, ticket, pgturl=pgturl, renew=renew
+            )
+            return {'ticket': st, 'pgt': pgt, 'attributes': attributes, 'error': None}
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return {'ticket': None, 'error': e}
+
+
+class ProxyValidateView(cas_views.ProxyValidateView):
+    def get_context_data(self, **kwargs):
+        service = self.request.GET.get('service')
+        ticket = self.request.GET.get('ticket')
+        pgturl = self.request.GET.get('pgtUrl')
+        renew = to_bool(self.request.GET.get('renew'))
+
+        try:
+            if not ticket or ticket.startswith(ProxyTicket.TICKET_PREFIX):
+                # If no ticket parameter is present, attempt to validate it
+                # anyway so the appropriate error is raised
+                pt, attributes, pgt, proxies = validate_proxy_ticket(
+                    service, ticket, pgturl=pgturl
+                )
+                return {
+                    'ticket': pt,
+                    'pgt': pgt,
+                    'attributes': attributes,
+                    'proxies': proxies,
+                    'error': None,
+                }
+            st, attributes, pgt = validate_service_ticket(
+                service, ticket, pgturl=pgturl, renew=renew
+            )
+            return {
+                'ticket': st,
+                'pgt': pgt,
+                'attributes': attributes,
+                'proxies': None,
+                'error': None,
+            }
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return {'ticket': None, 'error': e}
+
+
+class ProxyView(cas_views.ProxyView):
+    def get_context_data(self, **kwargs):
+        pgt = self.request.GET.get('pgt')
+        target_service = self.request.GET.get('targetService')
+
+        try:
+            pt = validate_proxy_granting_ticket(pgt, target_service)
+            return {'ticket': pt, 'error': None}
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return {'ticket': None, 'error': e}
+
+
+class SamlValidateView(cas_views.SamlValidateView):
+    def get_context_data(self, **kwargs):
+        target = self.request.GET.get('TARGET')
+
+        assert defused_etree, '/samlValidate endpoint requires defusedxml'
+
+        try:
+            root = defused_etree.parse(self.request, forbid_dtd=True).getroot()
+            ticket = root.find(
+                './/{urn:oasis:names:tc:SAML:1.0:protocol}AssertionArtifact'
+            ).text
+        except (defused_etree.ParseError, ValueError, AttributeError):
+            ticket = None
+
+        try:
+            st, attributes, pgt = validate_service_ticket(
+                target, ticket, require_https=True
+            )
+            return {'ticket': st, 'pgt': pgt, 'attributes': attributes, 'error': None}
+        except ValidationError as e:
+            logger.warning('%s %s' % (e.code, e))
+            return {'ticket': None, 'error': e}
@@ -0,0 +1,130 @@
+"""Postgres database backend with a connection pool per worker process.
+
+Django opens a connection per thread, or greenlet with gevent, and closes
+it after every request unless ``CONN_MAX_AGE`` is set. With this backend
+the connections are taken from a ``psycopg_pool.ConnectionPool`` instead
+and returned to it when Django closes them, so a worker keeps between
+``min_size`` and ``max_size`` connections open (``OPTIONS['pool']``), and
+concurrent requests wait for a free connection for at most ``timeout``
+seconds. With ``CONN_HEALTH_CHECKS`` connections are checked before they
+are handed out.
+
+Pools are created on the first connection of a process. Forked processes
+do not use the pool of their parent, whose connections are left alone, so
+the parent should close its pools before forking (see gunicorn-conf.py).
+"""
+import os
+import threading
+
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from core.metrics import DB_POOL_CONNECTIONS, DB_POOL_WAIT, timer
+
+_lock = threading.Lock()
+_pools = {}
+# pools of the parent process, which must not be closed or garbage collected
+_inherited = []
+
+
+def _forget_pools():
+    global _lock
+    _lock = threading.Lock()
+    _inherited.extend(_pools.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+def close_pools():
+    """Close the pools of this process and all their connections."""
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+        DB_POOL_CONNECTIONS.labels(pool.name, 'open').set(0)
+        DB_POOL_CONNECTIONS.labels(pool.name, 'available').set(0)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # pool of the current connection
+    connection_pool = None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        # the connections to the maintenance database of the test runner
+        # are not pooled
+        if options is None or self.alias == NO_DB_ALIAS:
+            return None
+        if self.settings_dict['CONN_MAX_AGE']:
+            raise ImproperlyConfigured(
+                'Pooled connections are returned after every request, '
+                'CONN_MAX_AGE has to be 0'
+            )
+        if 'isolation_level' in self.settings_dict['OPTIONS']:
+            raise ImproperlyConfigured(
+                'The isolation level of pooled connections cannot be set'
+            )
+
+        # the database is changed by the test runner
+        key = (self.alias, self.settings_dict['NAME'])
+        pool = _pools.get(key)
+        if pool is None:
+            with _lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(
+                        kwargs=self.get_connection_params(),
+                        name=self.alias,
+                        check=(
+                            ConnectionPool.check_connection
+                            if self.settings_dict['CONN_HEALTH_CHECKS']
+                            else None
+                        ),
+                        open=False,
+                        **options,
+                    )
+                    pool.open()
+                    _pools[key] = pool
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        self.isolation_level = IsolationLevel.READ_COMMITTED
+        with timer(DB_POOL_WAIT, pool=pool.name, result='failure') as labels:
+            connection = pool.getconn()
+            labels.update(result='success')
+        self.connection_pool = pool
+        self._observe(pool)
+        return connection
+
+    def _close(self):
+        pool = self.connection_pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        self.connection_pool = None
+        with self.wrap_database_errors:
+            # rolls back open transactions and discards broken connections, or
+            # closes the connection if the pool was closed
+            pool.putconn(self.connection)
+        self._observe(pool)
+
+    def _observe(self, pool):
+        stats = pool.get_stats()
+        DB_POOL_CONNECTIONS.labels(pool.name, 'open').set(stats['pool_size'])
+        DB_POOL_CONNECTIONS.labels(pool.name, 'available').set(stats['pool_available'])
@@ -0,0 +1,120 @@
+"""Routing of read-only work to the read replicas of the database.
+
+All queries use the primary database, unless they are run in a
+``replica_reads`` block, e.g. collecting the CAS attributes of a user, or
+in an admin list view (see ``ReplicaMiddleware``). Reads in these blocks
+go to a random replica of ``POSTGRES_REPLICAS``. Tickets and sessions
+are always read from the primary, as they are read by the next request
+right after they were written.
+
+Replicas lag behind the primary, so for ``POSTGRES_REPLICA_PIN_SECONDS``
+after a change reads stick to the primary: for changed users (see
+``pin_users``), and for clients which sent a POST request, e.g. a login or
+a change in the admin.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'baseauth_db_pinned'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def _pin_key(user_pk):
+    return f'cas:db:pinned:{user_pk}'
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Read from a replica within the block, if ``enabled``."""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin_users(*user_pks):
+    """Read the given users from the primary until the replicas caught
+    up with their changes."""
+    if settings.POSTGRES_REPLICAS:
+        cache.set_many(
+            {_pin_key(pk): True for pk in user_pks},
+            timeout=settings.POSTGRES_REPLICA_PIN_SECONDS,
+        )
+
+
+def is_pinned(user_pk):
+    return bool(cache.get(_pin_key(user_pk)))
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas = [
+            alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS
+        ]
+
+    def db_for_read(self, model, **hints):
+        # transactions see their own changes only on the primary
+        if (
+            self.replicas
+            and _replica_reads.get()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return random.choice(self.replicas)  # nosec
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Reads from a replica in the admin list views, unless the client sent
+    a POST request recently."""
+
+    safe_methods = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request.replica_token is not None:
+                _replica_reads.reset(request.replica_token)
+
+        if request.method not in self.safe_methods:
+            response.set_cookie(
+                PIN_COOKIE,
+                '1',
+                max_age=settings.POSTGRES_REPLICA_PIN_SECONDS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (
+            request.method in ('GET', 'HEAD')
+            and PIN_COOKIE not in request.COOKIES
+            and 'admin' in match.namespaces
+            and match.url_name
+            and match.url_name.endswith('_changelist')
+        ):
+            request.replica_token = _replica_reads.set(True)
@@ -0,0 +1,131 @@
+"""Resolution of the client IP address of a request.
+
+Every proxy in front of the application appends the address it received
+the request from to ``X-Forwarded-For``. Only the entries appended by
+trusted proxies (``TRUSTED_PROXIES``) can be believed, anything to the
+left of them may have been sent by the client. So the chain of
+``REMOTE_ADDR`` and the forwarded addresses is walked from the right, and
+the first address which is not a trusted proxy is the client.
+
+The networks of the trusted proxies are precompiled into an index of the
+network addresses by prefix length, so checking an address takes one set
+lookup per distinct prefix length. Only as many entries of the header are
+parsed as there are trusted proxies in the chain, so long headers sent by
+clients are cheap.
+
+The result is cached on the request and used by the
+``SetRemoteAddrFromForwardedFor`` middleware, by axes (see
+``AXES_CLIENT_IP_CALLABLE``) and by the ``locked_out`` view.
+"""
+import ipaddress
+import socket
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_IPV4_MAPPED = bytes(10) + b'\xff\xff'
+
+
+class ProxyNetworks:
+    """Index of the networks of the trusted proxies."""
+
+    def __init__(self, networks):
+        # version -> [(shift, {network address >> shift})], longest prefix first
+        self.index = {4: {}, 6: {}}
+        for network in networks:
+            try:
+                network = ipaddress.ip_network(network.strip(), strict=False)
+            except ValueError as e:
+                raise ImproperlyConfigured(f'Invalid trusted proxy network: {e}')
+            shift = network.max_prefixlen - network.prefixlen
+            self.index[network.version].setdefault(shift, set()).add(
+                int(network.network_address) >> shift
+            )
+        self.index = {
+            version: sorted(shifts.items()) for version, shifts in self.index.items()
+        }
+
+    def __contains__(self, address):
+        version, value = address
+        for shift, addresses in self.index[version]:
+            if value >> shift in addresses:
+                return True
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_trusted_proxies():
+    return ProxyNetworks(settings.TRUSTED_PROXIES)
+
+
+@receiver(setting_changed)
+def reset_trusted_proxies(setting, **kwargs):
+    if setting == 'TRUSTED_PROXIES':
+        get_trusted_proxies.cache_clear()
+
+
+def _parse(value):
+    """Return the version and the integer value of an address, parsed with
+    ``inet_pton`` as it is a lot faster than ``ipaddress``."""
+    value = value.strip()
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), 'big')
+    except OSError:
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, value)
+    except OSError:
+        return None
+    if packed[:12] == _IPV4_MAPPED:
+        # IPv4 clients of dual stack sockets
+        return 4, int.from_bytes(packed[12:], 'big')
+    return 6, int.from_bytes(packed, 'big')
+
+
+def _format(address):
+    version, value = address
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, value.to_bytes(4, 'big'))
+    return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+
+def resolve_client_ip(remote_addr, forwarded_for=''):
+    """Return the client address of the chain of forwarded addresses.
+
+    Invalid entries end the chain, as they were not appended by a trusted
+    proxy, so the last valid address is used instead.
+
+    :param remote_addr: Address the request was received from
+    :param forwarded_for: Value of the ``X-Forwarded-For`` header
+    :return: Client address, or None if ``remote_addr`` is invalid
+    """
+    address = _parse(remote_addr or '')
+    if address is None:
+        return None
+    trusted = get_trusted_proxies()
+    end = len(forwarded_for)
+    while end > 0 and address in trusted:
+        start = forwarded_for.rfind(',', 0, end)
+        previous = _parse(forwarded_for[start + 1 : end])
+        if previous is None:
+            break
+        address = previous
+        end = start
+    return _format(address)
+
+
+def get_client_ip(request):
+    """Return the client address of the request, resolved once per
+    request."""
+    try:
+        return request.client_ip
+    except AttributeError:
+        pass
+    request.client_ip = resolve_client_ip(
+        request.META.get('REMOTE_ADDR'),
+        request.META.get('HTTP_X_FORWARDED_FOR', ''),
+    )
+    return request.client_ip
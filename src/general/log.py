@@ -0,0 +1,170 @@
+"""Queue based logging.
+
+With ``LOG_QUEUE`` the loggers only put their records on a queue, and a
+listener thread passes them to the handlers of a sink logger, so file
+locks, log rotation, console output and emails never delay a request.
+
+Under gunicorn the master process runs the listener of the log files for
+all of its workers (see ``serve`` and gunicorn-conf.py), which inherit its
+queue, so only one process writes and rotates the files. Other processes,
+e.g. management commands, start a listener of their own. Records for
+handlers which need the Django setup of the worker, like
+``ThrottledAdminEmailHandler``, are always handled in the worker
+(``local=True``).
+"""
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import multiprocessing
+import os
+import pickle  # nosec
+import queue
+import threading
+import time
+from collections import deque
+
+from django.utils.log import AdminEmailHandler
+
+# queue of the gunicorn master, inherited by the workers
+_shared_queue = None
+# queue of the listener of this process
+_local_queue = None
+_lock = threading.Lock()
+# attributes of every record, the others were passed in ``extra``
+_RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord(None, None, '', 0, '', (), None).__dict__
+) | {'message', 'asctime'}
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+class _SinkListener(logging.handlers.QueueListener):
+    """Passes the records to the logger named in their ``sink``."""
+
+    def handle(self, record):
+        logging.getLogger(record.sink).handle(record)
+
+
+def _start_listener(log_queue):
+    listener = _SinkListener(log_queue)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def _get_local_queue():
+    global _local_queue
+    with _lock:
+        if _local_queue is None:
+            _local_queue = queue.SimpleQueue()
+            _start_listener(_local_queue)
+    return _local_queue
+
+
+def _after_fork():
+    # the listener thread is not running in the forked process
+    global _local_queue
+    _local_queue = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue of the process group, or of this process
+    if ``local`` is set, for the handlers of the ``sink`` logger."""
+
+    def __init__(self, sink, local=False):
+        super().__init__(None)
+        self.sink = sink
+        self.local = local
+
+    def enqueue(self, record):
+        if self.local or _shared_queue is None:
+            _get_local_queue().put_nowait(record)
+        else:
+            _shared_queue.put_nowait(record)
+
+    def prepare(self, record):
+        if self.local:
+            # handled in this process, so the record keeps its exception
+            # and request for the handlers
+            record = logging.makeLogRecord(record.__dict__)
+        else:
+            record = super().prepare(record)
+            # the record is pickled for the queue of the master, so extra
+            # values which cannot be pickled, like the request of
+            # django.request records, are replaced by their repr
+            for key, value in record.__dict__.items():
+                if key in _RECORD_ATTRIBUTES or isinstance(value, _PLAIN_TYPES):
+                    continue
+                try:
+                    pickle.dumps(value)
+                except Exception:
+                    record.__dict__[key] = repr(value)
+        record.sink = self.sink
+        return record
+
+
+def serve(config):
+    """Handle the records of the shared queue handlers in ``config`` (a
+    ``LOGGING`` dictionary) in this process, for all processes forked
+    afterwards."""
+    global _shared_queue
+
+    sinks = {
+        handler['sink']
+        for handler in config['handlers'].values()
+        if handler.get('class') == f'{__name__}.QueueHandler'
+        and not handler.get('local')
+    }
+    handlers = {
+        name for sink in sinks for name in config['loggers'][sink].get('handlers', [])
+    }
+    logging.config.dictConfig(
+        {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'formatters': config.get('formatters', {}),
+            'handlers': {name: config['handlers'][name] for name in handlers},
+            'loggers': {sink: config['loggers'][sink] for sink in sinks},
+        }
+    )
+    _shared_queue = multiprocessing.Queue()
+    _start_listener(_shared_queue)
+
+
+class ThrottledAdminEmailHandler(AdminEmailHandler):
+    """``AdminEmailHandler`` sending each distinct error once per
+    ``interval`` seconds, and at most ``limit`` emails per ``interval``."""
+
+    def __init__(self, interval=600, limit=10, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval
+        self.limit = limit
+        self.sent = {}
+        self.recent = deque()
+        self.suppressed = 0
+
+    def get_key(self, record):
+        exc_type = record.exc_info[0].__name__ if record.exc_info else None
+        return record.name, record.pathname, record.lineno, exc_type
+
+    def allow(self, record):
+        # called by emit, which runs under the lock of the handler
+        now = time.monotonic()
+        start = now - self.interval
+        while self.recent and self.recent[0] <= start:
+            self.recent.popleft()
+        self.sent = {key: sent for key, sent in self.sent.items() if sent > start}
+
+        key = self.get_key(record)
+        if key in self.sent or len(self.recent) >= self.limit:
+            self.suppressed += 1
+            return False
+        self.sent[key] = now
+        self.recent.append(now)
+        return True
+
+    def emit(self, record):
+        if self.allow(record):
+            super().emit(record)
@@ -1,28 +1,68 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
 from django.utils.deprecation import MiddlewareMixin
 
+from core.metrics import REQUEST_DURATION
+
+from .ip import get_client_ip
+
 
 class SetRemoteAddrFromForwardedFor(MiddlewareMixin):
-    """Middleware that sets REMOTE_ADDR based on HTTP_X_FORWARDED_FOR, if the
-    latter is set.
-
-    This is useful if you're sitting behind a reverse proxy that causes
-    each request's REMOTE_ADDR to be set to 127.0.0.1. Note that this
-    does NOT validate HTTP_X_FORWARDED_FOR. If you're not behind a
-    reverse proxy that sets HTTP_X_FORWARDED_FOR automatically, do not
-    use this middleware. Anybody can spoof the value of
-    HTTP_X_FORWARDED_FOR, and because this sets REMOTE_ADDR based on
-    HTTP_X_FORWARDED_FOR, that means anybody can "fake" their IP
-    address. Only use this when you can absolutely trust the value of
+    """Middleware that sets REMOTE_ADDR to the client address resolved from
     HTTP_X_FORWARDED_FOR.
+
+    Only the entries appended by the proxies in ``TRUSTED_PROXIES`` are
+    believed, see ``general.ip``. It should be placed before all
+    middlewares which use the address of the client.
     """
 
     def process_request(self, request):
-        try:
-            real_ip = request.META['HTTP_X_FORWARDED_FOR']
-        except KeyError:
-            pass
-        else:
-            # HTTP_X_FORWARDED_FOR can be a comma-separated list of IPs.
-            # Take just the first one.
-            real_ip = real_ip.split(',')[0]
-            request.META['REMOTE_ADDR'] = real_ip
+        client_ip = get_client_ip(request)
+        if client_ip is not None:
+            request.META['REMOTE_ADDR'] = client_ip
+
+
+class RequestMetricsMiddleware:
+    """Middleware that observes the duration of every request in
+    ``baseauth_request_duration_seconds``, labelled with the URL name of
+    the view, the method and the status code of the response.
+
+    It should be the first middleware, so the duration includes all other
+    middlewares. It supports async requests natively, so it can be used
+    in the slim middleware chain of the ASGI validation views.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    methods = {'GET', 'HEAD', 'POST', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        match = request.resolver_match
+        REQUEST_DURATION.labels(
+            view=match.url_name if match else '',
+            # any method string is accepted, so limit the label values
+            method=request.method if request.method in self.methods else 'other',
+            status=response.status_code,
+        ).observe(time.perf_counter() - start)
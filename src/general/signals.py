@@ -8,11 +8,10 @@ def process_user_attributes(sender, user, *args, **kwargs):
     if not user:
         return
 
-    if user.username in settings.SUPERUSERS:
-        user.is_staff = True
-        user.is_superuser = True
-        user.save()
-    else:
-        user.is_staff = False
-        user.is_superuser = False
-        user.save()
+    is_superuser = user.username in settings.SUPERUSERS
+
+    # only write to the database if the flags actually change
+    if user.is_staff != is_superuser or user.is_superuser != is_superuser:
+        user.is_staff = is_superuser
+        user.is_superuser = is_superuser
+        user.save(update_fields=['is_staff', 'is_superuser'])
@@ -0,0 +1,311 @@
+import logging
+import os
+import pickle  # nosec
+import subprocess  # nosec
+import sys
+import time
+from unittest import skipUnless
+
+from axes.helpers import get_client_ip_address
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import resolve
+
+from core.services import services
+
+from .db.base import DatabaseWrapper, close_pools
+from .db.routers import (
+    PIN_COOKIE,
+    ReplicaMiddleware,
+    ReplicaRouter,
+    _replica_reads,
+    is_pinned,
+    pin_users,
+    replica_reads,
+)
+from .ip import get_client_ip, resolve_client_ip
+from .log import QueueHandler, ThrottledAdminEmailHandler
+from .middleware import SetRemoteAddrFromForwardedFor
+
+SERVICE = 'https://example.org/service/'
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=[
+        'axes.backends.AxesBackend',
+        'django.contrib.auth.backends.ModelBackend',
+    ],
+    CAS_TICKET_BACKEND='core.tickets.DatabaseTicketBackend',
+    MAMA_CAS_SERVICES=[{'SERVICE': r'^https://example\.org/'}],
+    SUPERUSERS=frozenset({'admin'}),
+)
+class LoginTestCase(TestCase):
+    password = 'correct horse battery staple'
+
+    def login(self, username):
+        return self.client.post(
+            f'/login/?service={SERVICE}',
+            {'username': username, 'password': self.password},
+        )
+
+    def test_login_query_count(self):
+        get_user_model().objects.create_user('user', password=self.password)
+        # the services are loaded once per worker
+        services.get_registry()
+
+        # user lookup, last_login update and service ticket creation, but no
+        # axes queries and no extra user save as the flags did not change
+        with self.assertNumQueries(3):
+            response = self.login('user')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(SERVICE))
+
+    def test_login_updates_flags(self):
+        admin = get_user_model().objects.create_user('admin', password=self.password)
+        user = get_user_model().objects.create_user(
+            'user', password=self.password, is_staff=True, is_superuser=True
+        )
+
+        self.login('admin')
+        self.client.logout()
+        self.login('user')
+
+        admin.refresh_from_db()
+        user.refresh_from_db()
+        self.assertTrue(admin.is_staff and admin.is_superuser)
+        self.assertFalse(user.is_staff or user.is_superuser)
+
+
+@override_settings(ADMINS=[('Admin', 'admin@example.org')])
+class LogTestCase(TestCase):
+    def record(self, msg, lineno=1):
+        return logging.LogRecord('test', logging.ERROR, __file__, lineno, msg, (), None)
+
+    def test_throttled_admin_emails(self):
+        handler = ThrottledAdminEmailHandler(interval=60, limit=2)
+        for _i in range(3):
+            handler.handle(self.record('error'))
+        handler.handle(self.record('other error', lineno=2))
+        handler.handle(self.record('third error', lineno=3))
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(handler.suppressed, 3)
+
+    def test_queue_handler(self):
+        received = []
+        sink = logging.getLogger('general.tests.sink')
+        sink.propagate = False
+        sink.addHandler(logging.Handler())
+        sink.handlers[0].emit = received.append
+        self.addCleanup(sink.handlers.clear)
+
+        handler = QueueHandler('general.tests.sink', local=True)
+        handler.handle(self.record('queued'))
+        handler.handle(self.record(None))
+        for _i in range(100):
+            if len(received) == 2:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual([record.msg for record in received], ['queued', None])
+
+    def test_shared_queue_record_is_picklable(self):
+        request = RequestFactory().post('/login/', {'username': 'user'})
+        # gunicorn passes the socket file, which cannot be pickled
+        request.META['wsgi.input'] = open(os.devnull, 'rb')
+        self.addCleanup(request.META['wsgi.input'].close)
+        try:
+            raise ValueError('failure')
+        except ValueError:
+            record = logging.getLogger('django.request').makeRecord(
+                'django.request',
+                logging.ERROR,
+                __file__,
+                1,
+                'Internal Server Error: %s',
+                (request.path,),
+                sys.exc_info(),
+                extra={'status_code': 500, 'request': request},
+            )
+
+        prepared = pickle.loads(  # nosec
+            pickle.dumps(QueueHandler('general.log.output').prepare(record))
+        )
+
+        self.assertIn(f'Internal Server Error: {request.path}', prepared.msg)
+        self.assertIn('ValueError: failure', prepared.msg)
+        self.assertEqual(prepared.status_code, 500)
+        self.assertEqual(prepared.request, repr(request))
+        self.assertEqual(prepared.sink, 'general.log.output')
+
+
+@override_settings(TRUSTED_PROXIES=['10.0.0.0/8', '2001:db8::/32', '127.0.0.1'])
+class ClientIPTestCase(SimpleTestCase):
+    def test_resolve(self):
+        for remote_addr, forwarded_for, client_ip in [
+            ('198.51.100.7', '', '198.51.100.7'),
+            # only trusted proxies can forward
+            ('198.51.100.7', '203.0.113.1', '198.51.100.7'),
+            ('10.0.0.1', '198.51.100.7', '198.51.100.7'),
+            # spoofed entries left of the client are ignored
+            ('10.0.0.1', '203.0.113.1, 198.51.100.7, 10.1.2.3', '198.51.100.7'),
+            ('127.0.0.1', '2001:db8::1,198.51.100.7', '198.51.100.7'),
+            ('2001:db8::1', '203.0.113.1,2001:db9::1', '2001:db9::1'),
+            ('::ffff:10.0.0.1', '198.51.100.7', '198.51.100.7'),
+            # invalid entries end the chain
+            ('10.0.0.1', '198.51.100.7, unknown, 10.0.0.2', '10.0.0.2'),
+            ('10.0.0.1', '198.51.100.7,', '10.0.0.1'),
+            # only proxies
+            ('10.0.0.1', '10.0.0.3, 10.0.0.2', '10.0.0.3'),
+            ('', '198.51.100.7', None),
+        ]:
+            with self.subTest(remote_addr=remote_addr, forwarded_for=forwarded_for):
+                self.assertEqual(
+                    resolve_client_ip(remote_addr, forwarded_for), client_ip
+                )
+
+    def test_consumers(self):
+        request = RequestFactory().get(
+            '/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.1.1.1, 198.51.100.7'
+        )
+        SetRemoteAddrFromForwardedFor(lambda request: HttpResponse())(request)
+
+        self.assertEqual(request.META['REMOTE_ADDR'], '198.51.100.7')
+        self.assertEqual(get_client_ip(request), '198.51.100.7')
+        self.assertEqual(get_client_ip_address(request), '198.51.100.7')
+
+    def test_invalid_network(self):
+        with self.assertRaises(ImproperlyConfigured):
+            with self.settings(TRUSTED_PROXIES=['10.0.0.0/33']):
+                resolve_client_ip('10.0.0.1')
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def get_wrapper(self, **options):
+        settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'general.db',
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {'pool': {'min_size': 1, 'max_size': 1, **options}},
+        }
+        wrapper = DatabaseWrapper(settings_dict, alias='pool')
+        self.addCleanup(close_pools)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    @skipUnless(connection.vendor == 'postgresql', 'requires Postgres')
+    def test_reuse(self):
+        wrapper = self.get_wrapper()
+        wrapper.ensure_connection()
+        pid = wrapper.connection.info.backend_pid
+        wrapper.close()
+
+        wrapper.ensure_connection()
+        self.assertEqual(wrapper.connection.info.backend_pid, pid)
+
+    @skipUnless(connection.vendor == 'postgresql', 'requires Postgres')
+    def test_timeout(self):
+        self.get_wrapper(timeout=0.1).ensure_connection()
+
+        # the only connection of the pool is in use
+        with self.assertRaises(OperationalError):
+            self.get_wrapper(timeout=0.1).ensure_connection()
+
+    def test_conn_max_age(self):
+        wrapper = self.get_wrapper()
+        wrapper.settings_dict['CONN_MAX_AGE'] = 60
+
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.ensure_connection()
+
+
+class ReplicaRouterTestCase(SimpleTestCase):
+    databases = {'default'}
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        router.replicas = ['replica1']
+
+        self.assertEqual(router.db_for_read(get_user_model()), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(get_user_model()), 'replica1')
+            self.assertEqual(router.db_for_write(get_user_model()), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(get_user_model()), 'default')
+            with replica_reads(False):
+                self.assertEqual(router.db_for_read(get_user_model()), 'default')
+        self.assertEqual(router.db_for_read(get_user_model()), 'default')
+
+    @override_settings(POSTGRES_REPLICAS=['replica'])
+    def test_pin_users(self):
+        pin_users(1)
+
+        self.assertTrue(is_pinned(1))
+        self.assertFalse(is_pinned(2))
+
+    def test_middleware(self):
+        factory = RequestFactory()
+        reads = []
+
+        def view(request):
+            reads.append(_replica_reads.get())
+            return HttpResponse()
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaMiddleware(get_response)
+        for request in [
+            factory.get('/admin/auth/user/', HTTP_COOKIE=f'{PIN_COOKIE}=1'),
+            factory.get('/admin/auth/user/'),
+            factory.get('/admin/auth/user/1/change/'),
+        ]:
+            request.resolver_match = resolve(request.path_info)
+            middleware(request)
+        request = factory.post('/admin/auth/user/1/change/')
+        request.resolver_match = resolve(request.path_info)
+
+        self.assertEqual(reads, [False, True, False])
+        self.assertFalse(_replica_reads.get())
+        # changes are read from the primary afterwards
+        self.assertIn(PIN_COOKIE, middleware(request).cookies)
+
+
+class StartupTestCase(SimpleTestCase):
+    # seconds a worker may take to load the application, which takes about
+    # 0.5 seconds
+    budget = 2
+
+    def test_startup(self):
+        code = (
+            'import sys, time\n'
+            'start = time.perf_counter()\n'
+            'from django.core.wsgi import get_wsgi_application\n'
+            'get_wsgi_application()\n'
+            'print(time.perf_counter() - start, "ldap" in sys.modules)\n'
+        )
+        result = subprocess.run(  # nosec
+            [sys.executable, '-c', code],
+            env={
+                **os.environ,
+                'AUTHENTICATION_BACKENDS': 'django',
+                'DJANGO_SETTINGS_MODULE': 'baseauth.settings',
+            },
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        duration, ldap = result.stdout.split()
+
+        self.assertLess(float(duration), self.budget)
+        # python-ldap is only imported with the ldap backend
+        self.assertEqual(ldap, 'False')
@@ -1,15 +1,99 @@
 import multiprocessing
 import os
+import shutil
+
+import environ
+
+# export the settings of baseauth/.env, so the worker settings below are shared
+# with the Django settings of the workers
+environ.Env.read_env(os.path.join(os.path.dirname(__file__), 'baseauth', '.env'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'baseauth.settings')
+
+# create secret_key.py and the log directory before any application is loaded
+from baseauth.prepare import prepare  # noqa: E402
+
+prepare()
 
 bind = ':{}'.format(os.getenv('GUNICORN_PORT', '8000'))
 
+# sync, gevent, gthread or uvicorn
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+if worker_class == 'uvicorn':
+    # async ticket validation, see core.asgi
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'baseauth.asgi:application'
+else:
+    wsgi_app = 'baseauth.wsgi:application'
+# load the application in the master, so forked workers start ready to serve;
+# gevent has to patch the standard library before the application is loaded
+preload_app = environ.Env().bool('GUNICORN_PRELOAD', default=worker_class != 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+
+if worker_class == 'gevent':
+    # psycopg waits for the database in C by default, which blocks the whole
+    # worker; the selector based wait function is cooperative once gevent
+    # has patched the selectors module, which the worker does before the
+    # application is loaded
+    os.environ.setdefault('PSYCOPG_WAIT_FUNC', 'wait_selector')
+
 keepalive = 120
 max_requests = 1000
 max_requests_jitter = 50
-timeout = 300
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300' if worker_class == 'sync' else '30'))
 workers = os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
 worker_tmp_dir = '/dev/shm'  # nosec
 
+# every worker writes its metrics to this directory, see core.metrics
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(worker_tmp_dir, 'baseauth-metrics')
+)
+
 loglevel = 'info'
 accesslog = '/logs/gunicorn.access.log'
 errorlog = '/logs/gunicorn.error.log'
+
+
+def on_starting(server):
+    # metrics of a previous run must not be aggregated
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    from django.conf import settings
+
+    if settings.LOG_QUEUE:
+        # the master writes the log files of all workers, see general.log
+        from general.log import serve
+
+        serve(settings.LOGGING)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # connections opened while loading the application must not be
+        # shared by the workers; Redis and LDAP connections are reopened in
+        # forked processes on their own
+        from django.db import connections
+
+        from general.db.base import close_pools
+
+        connections.close_all()
+        close_pools()
+
+
+def worker_exit(server, worker):
+    # end the sessions of the database connections of workers which are
+    # recycled after max_requests, instead of dropping the connections
+    from django.db import connections
+
+    from general.db.base import close_pools
+
+    connections.close_all()
+    close_pools()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
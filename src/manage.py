@@ -14,6 +14,20 @@ def main():
             "available on your PYTHONPATH environment variable? Did you "
             "forget to activate a virtual environment?"
         ) from exc
+
+    from django.core.management.base import CommandParser, handle_default_options
+
+    from baseauth.prepare import prepare
+
+    # apply --settings and --pythonpath like execute_from_command_line, so the
+    # given settings are prepared
+    parser = CommandParser(add_help=False, allow_abbrev=False)
+    parser.add_argument('--settings')
+    parser.add_argument('--pythonpath')
+    options, _args = parser.parse_known_args(sys.argv[2:])
+    handle_default_options(options)
+
+    prepare()
     execute_from_command_line(sys.argv)
 
 